@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Achievement, UserAchievement
+from .models import Achievement, UserAchievement, AchievementCounters, UserPoints
 
 @admin.register(Achievement)
 class AchievementAdmin(admin.ModelAdmin):
@@ -13,3 +13,19 @@ class UserAchievementAdmin(admin.ModelAdmin):
     list_filter = ('earned_at', 'achievement__category')
     search_fields = ('user__username', 'user__email', 'achievement__title')
     date_hierarchy = 'earned_at'
+
+@admin.register(AchievementCounters)
+class AchievementCountersAdmin(admin.ModelAdmin):
+    list_display = ('user', 'books_read', 'books_rated', 'books_in_library', 'progress_marks', 'consecutive_days', 'updated_at')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+
+@admin.register(UserPoints)
+class UserPointsAdmin(admin.ModelAdmin):
+    """Read-only: sums change only with awards (leaderboard keeps PointsBucket in step)"""
+    list_display = ('user', 'points', 'updated_at')
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'points', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
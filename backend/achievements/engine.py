@@ -0,0 +1,199 @@
+"""Выдача достижений по событиям вместо опроса клиентом.
+
+Для каждого пользователя хранится строка AchievementCounters со значениями
+всех поддерживаемых требований (books_read, progress_marks, ...). События
+библиотеки и прогресса (books.signals) меняют счетчики на дельту, и
+выдаются только достижения, порог которых лежит между старым и новым
+значением счетчика. Поэтому стоимость события не зависит от размера
+каталога достижений.
+
+События приходят синхронно из записи. Представления библиотеки и прогресса
+(books.views, books.progress) выполняют запись в transaction.atomic(), так
+что там счетчики фиксируются или откатываются вместе с ней. При записи вне
+транзакции (админка, shell) record() защищает только саму строку счетчиков.
+
+Строка счетчиков строится по данным пользователя при первом событии.
+Достижения, добавленные или измененные позже, выдаются пакетно командой
+``manage.py evaluate_achievements`` (evaluate_users): значения требований
+считаются сгруппированными запросами сразу для диапазона пользователей.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+from . import leaderboard
+from .models import Achievement, AchievementCounters, UserAchievement
+
+# Поддерживаемые ключи Achievement.requirement (совпадают с полями AchievementCounters)
+COUNTERS = ('books_read', 'books_rated', 'books_in_library', 'progress_marks', 'consecutive_days')
+
+
+def meets(requirement, values) -> bool:
+    """Все ли условия требования выполнены. Неизвестные ключи не выполняются никогда."""
+    if not isinstance(requirement, dict) or not requirement:
+        return False
+    for key, threshold in requirement.items():
+        if key not in COUNTERS or not isinstance(threshold, (int, float)):
+            return False
+        if values[key] < threshold:
+            return False
+    return True
+
+
+def _values(counters) -> dict:
+    return {key: getattr(counters, key) for key in COUNTERS}
+
+
+def _source_values(user_id) -> dict:
+    """Значения счетчиков, посчитанные по данным пользователя"""
+    from books import reading_stats
+    from books.models import UserBook
+
+    user_books = UserBook.objects.filter(user_id=user_id)
+    stats = reading_stats.get_stats(user_id)
+    return {
+        'books_read': user_books.filter(status=UserBook.Status.COMPLETED).count(),
+        'books_rated': user_books.filter(rating__isnull=False).count(),
+        'books_in_library': user_books.count(),
+        'progress_marks': stats['total_marks'],
+        'consecutive_days': stats['reading_streak'],
+    }
+
+
+def award(user_id, old_values, new_values):
+    """Выдает достижения, порог которых пересечен при переходе old_values -> new_values"""
+    crossed = Q()
+    for key in COUNTERS:
+        if new_values[key] > old_values[key]:
+            crossed |= Q(**{f'requirement__{key}__gt': old_values[key], f'requirement__{key}__lte': new_values[key]})
+    if not crossed:
+        return []
+
+    candidates = Achievement.objects.filter(crossed).exclude(users__user_id=user_id)
+    earned = []
+    for achievement in candidates:
+        if not meets(achievement.requirement, new_values):
+            continue
+        # Обычно это одна-две строки. Вставка по одной показывает, какие строки добавлены
+        # на самом деле, а post_save начисляет очки только за них
+        try:
+            with transaction.atomic():
+                earned.append(UserAchievement.objects.create(user_id=user_id, achievement=achievement))
+        except IntegrityError:
+            # Достижение успел выдать параллельный процесс
+            continue
+    return earned
+
+
+def build(user_id):
+    """Создает строку счетчиков по данным пользователя и выдает все заработанное.
+
+    Возвращает (счетчики, выданные достижения).
+    """
+    with transaction.atomic():
+        counters, created = AchievementCounters.objects.select_for_update().get_or_create(
+            user_id=user_id, defaults=_source_values(user_id)
+        )
+        if not created:
+            return counters, []
+        return counters, award(user_id, dict.fromkeys(COUNTERS, 0), _values(counters))
+
+
+def record(user_id, highs=None, **deltas):
+    """Применяет событие: дельты счетчиков и новые значения "не меньше" (highs).
+
+    Событие уже записано в БД, поэтому при первой встрече с пользователем
+    счетчики просто строятся по его данным. Возвращает выданные достижения.
+    """
+    with transaction.atomic():
+        counters = AchievementCounters.objects.select_for_update().filter(user_id=user_id).first()
+        if counters is None:
+            return build(user_id)[1]
+
+        old_values = _values(counters)
+        for key, delta in deltas.items():
+            setattr(counters, key, getattr(counters, key) + delta)
+        for key, value in (highs or {}).items():
+            setattr(counters, key, max(getattr(counters, key), value))
+        counters.save()
+        return award(user_id, old_values, _values(counters))
+
+
+def forget(user_id, **deltas):
+    """Уменьшает счетчики (книга удалена из библиотеки). Достижения не отзываются."""
+    if not any(deltas.values()):
+        return
+    AchievementCounters.objects.filter(user_id=user_id).update(
+        **{key: F(key) - delta for key, delta in deltas.items() if delta}
+    )
+
+
+def aggregate_values(user_ids, keys):
+    """Значения требований ``keys`` для пользователей ``user_ids``: по запросу на тип требования.
+
+    Возвращает {user_id: {key: value}}; пользователи без данных получают нули.
+    """
+    from books.models import DailyReadingProgress, ReadingProgress, UserBook, UserReadingStats
+
+    values = {user_id: dict.fromkeys(keys, 0) for user_id in user_ids}
+
+    def fill(key, rows, combine=lambda old, new: old + new):
+        for user_id, value in rows:
+            values[user_id][key] = combine(values[user_id][key], value or 0)
+
+    library_counts = {
+        'books_read': Count('id', filter=Q(status=UserBook.Status.COMPLETED)),
+        'books_rated': Count('id', filter=Q(rating__isnull=False)),
+        'books_in_library': Count('id'),
+    }
+    for key, aggregate in library_counts.items():
+        if key in keys:
+            fill(key, UserBook.objects.filter(user_id__in=user_ids).values('user_id')
+                 .annotate(value=aggregate).order_by().values_list('user_id', 'value'))
+
+    if 'progress_marks' in keys:
+        fill('progress_marks', ReadingProgress.objects.filter(user_book__user_id__in=user_ids)
+             .values('user_book__user_id').annotate(value=Count('id'))
+             .order_by().values_list('user_book__user_id', 'value'))
+        fill('progress_marks', DailyReadingProgress.objects.filter(user_book__user_id__in=user_ids)
+             .values('user_book__user_id').annotate(value=Sum('marks_count'))
+             .order_by().values_list('user_book__user_id', 'value'))
+
+    if 'consecutive_days' in keys:
+        # Серии дней хранятся готовыми: текущая в статистике, лучшая - в счетчиках
+        fill('consecutive_days', UserReadingStats.objects.filter(user_id__in=user_ids)
+             .values_list('user_id', 'reading_streak'), max)
+        fill('consecutive_days', AchievementCounters.objects.filter(user_id__in=user_ids)
+             .values_list('user_id', 'consecutive_days'), max)
+
+    return values
+
+
+def evaluate_users(user_ids, achievements, batch_size=1000) -> int:
+    """Выдает пользователям ``user_ids`` все заработанные из ``achievements``. Возвращает число выданных."""
+    achievements = [
+        achievement for achievement in achievements
+        if meets(achievement.requirement, dict.fromkeys(COUNTERS, float('inf')))
+    ]
+    if not achievements or not user_ids:
+        return 0
+
+    keys = {key for achievement in achievements for key in achievement.requirement}
+    values = aggregate_values(user_ids, keys)
+    earned = set(
+        UserAchievement.objects.filter(user_id__in=user_ids, achievement__in=achievements)
+        .values_list('user_id', 'achievement_id')
+    )
+
+    rows = [
+        UserAchievement(user_id=user_id, achievement_id=achievement.id)
+        for user_id, user_values in values.items()
+        for achievement in achievements
+        if (user_id, achievement.id) not in earned
+        and meets(achievement.requirement, dict(dict.fromkeys(COUNTERS, 0), **user_values))
+    ]
+    for start in range(0, len(rows), batch_size):
+        UserAchievement.objects.bulk_create(rows[start:start + batch_size], ignore_conflicts=True)
+    # Суммы пересчитываются по факту: часть строк могла уже выдать параллельная запись
+    leaderboard.recalculate({row.user_id for row in rows})
+    return len(rows)
@@ -0,0 +1,146 @@
+"""Таблица лидеров по очкам достижений.
+
+Сумма очков пользователя хранится в UserPoints и меняется при выдаче и
+отзыве достижений (engine, сигналы), поэтому топ и место пользователя
+читаются по индексу (-points, user) без агрегации по UserAchievement.
+Одинаковое число очков дает одинаковое место (1, 2, 2, 4).
+
+Место пользователя считается по PointsBucket - числу пользователей с
+каждой суммой очков. Корзины меняются через F() вместе с UserPoints, а
+их число ограничено числом различных сумм (не пользователей), так что
+место - это сумма по нескольким строкам корзин выше, а не подсчет всех
+пользователей, стоящих выше.
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import PointsBucket, UserAchievement, UserPoints
+
+DEFAULT_TOP_SIZE = 10
+MAX_TOP_SIZE = 100
+
+
+def _move_users(changes):
+    """Применяет к корзинам изменения {очки: +-число пользователей} (нулевые суммы не учитываются)"""
+    # Корзины обновляются в одном порядке, чтобы параллельные транзакции не ждали друг друга по кругу
+    for points, delta in sorted(changes.items()):
+        if points <= 0 or not delta:
+            continue
+        if not PointsBucket.objects.filter(points=points).update(users=F('users') + delta):
+            PointsBucket.objects.bulk_create([PointsBucket(points=points)], ignore_conflicts=True)
+            PointsBucket.objects.filter(points=points).update(users=F('users') + delta)
+
+
+def add_points(user_id, points):
+    """Прибавляет очки пользователю (отрицательные - только к существующей строке)"""
+    if not points:
+        return
+    with transaction.atomic():
+        if points > 0:
+            UserPoints.objects.bulk_create([UserPoints(user_id=user_id)], ignore_conflicts=True)
+        old = UserPoints.objects.select_for_update().filter(user_id=user_id).values_list('points', flat=True).first()
+        if old is None:
+            return
+        UserPoints.objects.filter(user_id=user_id).update(points=F('points') + points)
+        _move_users({old: -1, old + points: 1})
+
+
+def forget_user(user_id):
+    """Пользователь удаляется: он выходит из корзин, а отзыв его достижений при том же
+    каскадном удалении уже не трогает корзины (сумма обнуляется)"""
+    with transaction.atomic():
+        old = UserPoints.objects.select_for_update().filter(user_id=user_id).values_list('points', flat=True).first()
+        if old:
+            UserPoints.objects.filter(user_id=user_id).update(points=0)
+            _move_users({old: -1})
+
+
+def rebuild_buckets():
+    """Пересобирает корзины по UserPoints"""
+    with transaction.atomic():
+        PointsBucket.objects.all().delete()
+        PointsBucket.objects.bulk_create([
+            PointsBucket(points=points, users=users)
+            for points, users in UserPoints.objects.filter(points__gt=0).values('points')
+            .annotate(users=Count('user')).order_by().values_list('points', 'users')
+        ])
+
+
+def recalculate(user_ids=None) -> int:
+    """Пересчитывает суммы по выданным достижениям (всем или для user_ids). Возвращает число строк."""
+    earned = UserAchievement.objects.all()
+    rows = UserPoints.objects.all()
+    if user_ids is not None:
+        earned = earned.filter(user_id__in=user_ids)
+        rows = rows.filter(user_id__in=user_ids)
+
+    with transaction.atomic():
+        old = dict(rows.select_for_update().values_list('user_id', 'points'))
+        totals = {
+            user_id: points or 0
+            for user_id, points in earned.values('user_id').annotate(points=Sum('achievement__points'))
+            .order_by().values_list('user_id', 'points')
+        }
+
+        # У пользователей без достижений строка обнуляется
+        rows.exclude(user_id__in=totals).update(points=0)
+        UserPoints.objects.bulk_create(
+            [UserPoints(user_id=user_id, points=points) for user_id, points in totals.items()],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['points', 'updated_at'],
+        )
+
+        if user_ids is None:
+            rebuild_buckets()
+        else:
+            changes = Counter()
+            for user_id in old.keys() | totals.keys():
+                old_points, new_points = old.get(user_id, 0), totals.get(user_id, 0)
+                if old_points != new_points:
+                    changes[old_points] -= 1
+                    changes[new_points] += 1
+            _move_users(changes)
+    return len(totals)
+
+
+def rank_for_points(points) -> int:
+    """Место для суммы очков: число пользователей с большей суммой + 1 (по корзинам выше)"""
+    above = PointsBucket.objects.filter(points__gt=points).aggregate(users=Sum('users'))['users']
+    return (above or 0) + 1
+
+
+def top(limit=DEFAULT_TOP_SIZE):
+    """Первые ``limit`` строк таблицы лидеров"""
+    entries = []
+    rows = (
+        UserPoints.objects.filter(points__gt=0).select_related('user')
+        .order_by('-points', 'user')[:min(max(limit, 1), MAX_TOP_SIZE)]
+    )
+    for position, row in enumerate(rows, start=1):
+        # Место совпадает с предыдущим при равных очках
+        rank = entries[-1]['rank'] if entries and entries[-1]['points'] == row.points else position
+        entries.append({
+            'rank': rank,
+            'user_id': row.user_id,
+            'username': row.user.username,
+            'points': row.points,
+        })
+    return entries
+
+
+def user_rank(user) -> dict:
+    """Очки и место пользователя"""
+    points = UserPoints.objects.filter(user=user).values_list('points', flat=True).first() or 0
+    total_users = rank_for_points(0) - 1
+    return {
+        'user_id': user.pk,
+        'username': user.username,
+        'points': points,
+        # Без очков пользователь ниже всех, кто их имеет
+        'rank': rank_for_points(points) if points else total_users + 1,
+        'total_users': total_users,
+    }
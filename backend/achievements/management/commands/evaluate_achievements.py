@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from achievements import engine
+from achievements.models import Achievement
+
+class Command(BaseCommand):
+    help = 'Award earned achievements to all users with grouped aggregate queries (e.g. after adding an achievement)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--achievement',
+            type=int,
+            action='append',
+            help='Only evaluate the achievement with this id (may be repeated)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Number of users evaluated per set of aggregate queries'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of awarded achievements inserted per query'
+        )
+        parser.add_argument(
+            '--start-after',
+            type=int,
+            default=0,
+            help='Resume after this user id (printed after every chunk)'
+        )
+    
+    def handle(self, *args, **options):
+        achievements = Achievement.objects.all()
+        if options['achievement']:
+            achievements = achievements.filter(id__in=options['achievement'])
+        achievements = list(achievements)
+        
+        users = get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+        last_user_id = options['start_after']
+        awarded = 0
+        
+        while True:
+            user_ids = list(users.filter(pk__gt=last_user_id)[:options['chunk_size']])
+            if not user_ids:
+                break
+            
+            # Повторная обработка чанка безопасна: выданные достижения пропускаются
+            awarded += engine.evaluate_users(user_ids, achievements, batch_size=options['batch_size'])
+            last_user_id = user_ids[-1]
+            self.stdout.write(f'Processed users up to id {last_user_id}, awarded so far: {awarded}')
+        
+        self.stdout.write(self.style.SUCCESS(f'Achievements awarded: {awarded}'))
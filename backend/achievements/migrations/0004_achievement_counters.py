@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('achievements', '0003_alter_achievement_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AchievementCounters',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='achievement_counters', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('books_read', models.IntegerField(default=0)),
+                ('books_rated', models.IntegerField(default=0)),
+                ('books_in_library', models.IntegerField(default=0)),
+                ('progress_marks', models.IntegerField(default=0)),
+                ('consecutive_days', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
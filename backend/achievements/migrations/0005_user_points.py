@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_user_points(apps, schema_editor):
+    UserAchievement = apps.get_model('achievements', 'UserAchievement')
+    UserPoints = apps.get_model('achievements', 'UserPoints')
+    db_alias = schema_editor.connection.alias
+
+    totals = (
+        UserAchievement.objects.using(db_alias).values('user_id')
+        .annotate(points=models.Sum('achievement__points')).order_by()
+    )
+    UserPoints.objects.using(db_alias).bulk_create(
+        [UserPoints(user_id=row['user_id'], points=row['points'] or 0) for row in totals.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('achievements', '0004_achievement_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPoints',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='achievement_points', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('points', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-points', 'user'],
+                'indexes': [models.Index(fields=['-points', 'user'], name='achievements_points_rank')],
+            },
+        ),
+        migrations.RunPython(fill_user_points, migrations.RunPython.noop),
+    ]
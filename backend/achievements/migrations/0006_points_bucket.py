@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+def fill_buckets(apps, schema_editor):
+    UserPoints = apps.get_model('achievements', 'UserPoints')
+    PointsBucket = apps.get_model('achievements', 'PointsBucket')
+    db_alias = schema_editor.connection.alias
+
+    buckets = (
+        UserPoints.objects.using(db_alias).filter(points__gt=0).values('points')
+        .annotate(users=models.Count('user')).order_by()
+    )
+    PointsBucket.objects.using(db_alias).bulk_create(
+        [PointsBucket(points=row['points'], users=row['users']) for row in buckets.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('achievements', '0005_user_points'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointsBucket',
+            fields=[
+                ('points', models.IntegerField(primary_key=True, serialize=False)),
+                ('users', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-points'],
+            },
+        ),
+        migrations.RunPython(fill_buckets, migrations.RunPython.noop),
+    ]
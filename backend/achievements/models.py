@@ -19,6 +19,13 @@ class Achievement(models.Model):
     
     def __str__(self):
         return self.title
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Исходные очки нужны сигналам, чтобы пересчитать таблицу лидеров при изменении
+        instance._original_points = instance.__dict__.get('points')
+        return instance
 
 class UserAchievement(models.Model):
     """User's earned achievement"""
@@ -31,3 +38,43 @@ class UserAchievement(models.Model):
     
     def __str__(self):
         return f"{self.user.username} - {self.achievement.title}"
+
+class AchievementCounters(models.Model):
+    """Per-user values of achievement requirements, updated by library and progress events"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='achievement_counters')
+    books_read = models.IntegerField(default=0)
+    books_rated = models.IntegerField(default=0)
+    books_in_library = models.IntegerField(default=0)
+    progress_marks = models.IntegerField(default=0)
+    consecutive_days = models.IntegerField(default=0)  # Самая длинная серия дней чтения
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Achievement counters of {self.user_id}"
+
+class UserPoints(models.Model):
+    """Materialized sum of achievement points of a user (leaderboard)"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='achievement_points')
+    points = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-points', 'user']
+        indexes = [
+            # Топ и место пользователя читаются по индексу, без суммирования UserAchievement
+            models.Index(fields=['-points', 'user'], name='achievements_points_rank'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.points} points"
+
+class PointsBucket(models.Model):
+    """How many users have exactly ``points`` achievement points (rank lookups)"""
+    points = models.IntegerField(primary_key=True)
+    users = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-points']
+    
+    def __str__(self):
+        return f"{self.points} points: {self.users} users"
@@ -0,0 +1,73 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from books.models import UserBook
+from books import reading_stats
+from books.signals import user_book_changed, user_book_removed, progress_saved
+from .models import Achievement, UserAchievement, UserPoints
+from . import engine, leaderboard
+
+
+@receiver(user_book_changed)
+def count_user_book_change(sender, user_book, created, old_status, old_rating, **kwargs):
+    """Library add, status change and rating of a book"""
+    completed = UserBook.Status.COMPLETED
+    engine.record(
+        user_book.user_id,
+        books_in_library=int(created),
+        books_read=(user_book.status == completed) - (old_status == completed),
+        books_rated=(user_book.rating is not None) - (old_rating is not None),
+    )
+
+
+@receiver(user_book_removed)
+def count_user_book_removal(sender, user_book, **kwargs):
+    engine.forget(
+        user_book.user_id,
+        books_in_library=1,
+        books_read=int(getattr(user_book, '_original_status', user_book.status) == UserBook.Status.COMPLETED),
+        books_rated=int(getattr(user_book, '_original_rating', user_book.rating) is not None),
+    )
+
+
+@receiver(progress_saved)
+def count_progress(sender, user_id, marks, books_added=0, books_uncompleted=0, **kwargs):
+    # Серия дней уже обновлена статистикой чтения в этой же транзакции
+    engine.record(
+        user_id,
+        highs={'consecutive_days': reading_stats.get_stats(user_id)['reading_streak']},
+        progress_marks=marks,
+        books_in_library=books_added,
+        books_read=-books_uncompleted,
+    )
+
+
+@receiver(post_save, sender=UserAchievement)
+def add_achievement_points(sender, instance, created=False, raw=False, **kwargs):
+    """Awards of the engine for an event and of the admin; evaluate_users inserts in bulk
+    and recalculates the totals itself"""
+    if raw or not created:
+        return
+    leaderboard.add_points(instance.user_id, instance.achievement.points)
+
+
+@receiver(post_delete, sender=UserAchievement)
+def remove_achievement_points(sender, instance, **kwargs):
+    points = Achievement.objects.filter(pk=instance.achievement_id).values_list('points', flat=True).first()
+    leaderboard.add_points(instance.user_id, -(points or 0))
+
+
+@receiver(pre_delete, sender=UserPoints)
+def remove_points_from_leaderboard(sender, instance, **kwargs):
+    """Deleting a user: pre_delete runs before the cascade revokes the user's achievements"""
+    leaderboard.forget_user(instance.user_id)
+
+
+@receiver(post_save, sender=Achievement)
+def update_points_of_holders(sender, instance, created=False, raw=False, **kwargs):
+    """Changing the points of an achievement changes the totals of everyone who earned it"""
+    if raw:
+        return
+    old_points = getattr(instance, '_original_points', None)
+    if not created and old_points is not None and old_points != instance.points:
+        leaderboard.recalculate(list(instance.users.values_list('user_id', flat=True)))
+    instance._original_points = instance.points
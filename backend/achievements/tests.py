@@ -1,3 +1,171 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from books.models import Author, Book, UserBook
+
+from . import engine, leaderboard
+from .models import Achievement, AchievementCounters, PointsBucket, UserAchievement, UserPoints
+
+
+def create_user(username):
+    return get_user_model().objects.create_user(username=username, email=f'{username}@example.com', password='pass')
+
+
+class AwardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        author = Author.objects.create(name='Author')
+        cls.books = [Book.objects.create(title=f'Book {i}', author=author) for i in range(3)]
+        cls.first_book = Achievement.objects.create(title='First book', description='', points=10,
+                                                    requirement={'books_in_library': 1})
+        cls.two_books = Achievement.objects.create(title='Two books', description='', points=5,
+                                                   requirement={'books_in_library': 2})
+        cls.first_read = Achievement.objects.create(title='First read', description='', points=20,
+                                                    requirement={'books_read': 1})
+        cls.unknown = Achievement.objects.create(title='Unknown', description='', points=50,
+                                                 requirement={'no_such_counter': 1})
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add(self, book, status=UserBook.Status.PLANNED):
+        self.client.post('/api/books/user-books/add_to_list/', {'book_id': book.pk, 'status': status})
+
+    def earned(self):
+        return set(UserAchievement.objects.filter(user=self.user).values_list('achievement__title', flat=True))
+
+    def points(self):
+        return UserPoints.objects.filter(user=self.user).values_list('points', flat=True).first() or 0
+
+    def test_events_award_crossed_thresholds_once(self):
+        self.add(self.books[0])
+        self.assertEqual(self.earned(), {'First book'})
+        self.assertEqual(self.points(), 10)
+
+        self.add(self.books[1], UserBook.Status.COMPLETED)
+        self.assertEqual(self.earned(), {'First book', 'Two books', 'First read'})
+        self.assertEqual(self.points(), 35)
+
+        # Повторное пересечение порога после удаления книги ничего не выдает
+        self.client.delete('/api/books/user-books/remove_from_list/', {'book_id': self.books[1].pk}, format='json')
+        self.add(self.books[2])
+        self.assertEqual(UserAchievement.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(self.points(), 35)
+
+    def test_counters_match_aggregates_after_revert(self):
+        self.add(self.books[0], UserBook.Status.COMPLETED)
+        self.client.post(f'/api/books/books/{self.books[1].pk}/rate/', {'rating': 4})
+        self.add(self.books[0], UserBook.Status.DROPPED)
+        self.client.delete('/api/books/user-books/remove_from_list/', {'book_id': self.books[1].pk}, format='json')
+
+        counters = AchievementCounters.objects.get(user=self.user)
+        keys = ('books_read', 'books_rated', 'books_in_library', 'progress_marks')
+        self.assertEqual({key: getattr(counters, key) for key in keys},
+                         engine.aggregate_values([self.user.pk], keys)[self.user.pk])
+        self.assertEqual((counters.books_read, counters.books_rated, counters.books_in_library), (0, 0, 1))
+
+    def test_award_credits_only_inserted_rows(self):
+        engine.build(self.user.pk)
+        meets = engine.meets
+
+        def racing_meets(requirement, values):
+            # Параллельный процесс выдает достижение после выбора кандидатов
+            if not UserAchievement.objects.filter(user=self.user, achievement=self.first_book).exists():
+                UserAchievement.objects.create(user=self.user, achievement=self.first_book)
+            return meets(requirement, values)
+
+        old_values = dict.fromkeys(engine.COUNTERS, 0)
+        with mock.patch.object(engine, 'meets', side_effect=racing_meets):
+            awarded = engine.award(self.user.pk, old_values, dict(old_values, books_in_library=2))
+
+        self.assertEqual([user_achievement.achievement for user_achievement in awarded], [self.two_books])
+        self.assertEqual(self.points(), 15)
+
+    def test_unknown_requirement_is_never_met(self):
+        self.assertFalse(engine.meets(self.unknown.requirement, dict.fromkeys(engine.COUNTERS, 100)))
+        self.assertFalse(engine.meets({}, dict.fromkeys(engine.COUNTERS, 100)))
+        self.assertTrue(engine.meets({'books_read': 2}, dict(dict.fromkeys(engine.COUNTERS, 0), books_read=2)))
+
+    def test_evaluate_users_awards_new_achievements(self):
+        self.add(self.books[0])
+        self.add(self.books[1])
+        late = Achievement.objects.create(title='Late', description='', points=7, requirement={'books_in_library': 2})
+
+        self.assertEqual(engine.evaluate_users([self.user.pk], [late]), 1)
+        self.assertEqual(engine.evaluate_users([self.user.pk], [late]), 0)
+        self.assertEqual(self.points(), 22)
+
+
+class LeaderboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(f'user{i}') for i in range(5)]
+        cls.small = Achievement.objects.create(title='Small', description='', points=5, requirement={'books_read': 1})
+        cls.big = Achievement.objects.create(title='Big', description='', points=10, requirement={'books_read': 2})
+
+    def award(self, user, *achievements):
+        for achievement in achievements:
+            UserAchievement.objects.create(user=user, achievement=achievement)
+
+    def assertBucketsMatchPoints(self):
+        buckets = dict(PointsBucket.objects.filter(users__gt=0).values_list('points', 'users'))
+        counted = {}
+        for points in UserPoints.objects.filter(points__gt=0).values_list('points', flat=True):
+            counted[points] = counted.get(points, 0) + 1
+        self.assertEqual(buckets, counted)
+
+    def test_ties_share_rank(self):
+        first, second, third, fourth, without_points = self.users
+        self.award(first, self.small, self.big)
+        self.award(second, self.big)
+        self.award(third, self.big)
+        self.award(fourth, self.small)
+
+        self.assertEqual([(entry['username'], entry['rank']) for entry in leaderboard.top()],
+                         [('user0', 1), ('user1', 2), ('user2', 2), ('user3', 4)])
+        self.assertEqual(leaderboard.user_rank(third)['rank'], 2)
+        self.assertEqual(leaderboard.user_rank(without_points), {
+            'user_id': without_points.pk, 'username': 'user4', 'points': 0, 'rank': 5, 'total_users': 4,
+        })
+        self.assertBucketsMatchPoints()
+
+    def test_points_follow_awards_and_achievement_changes(self):
+        user = self.users[0]
+        self.award(user, self.small, self.big)
+        self.assertEqual(leaderboard.user_rank(user)['points'], 15)
+
+        self.big.points = 30
+        self.big.save()
+        self.assertEqual(leaderboard.user_rank(user)['points'], 35)
+
+        UserAchievement.objects.get(user=user, achievement=self.small).delete()
+        self.assertEqual(leaderboard.user_rank(user)['points'], 30)
+
+        # Пересчет с нуля дает то же, что и инкрементальные изменения
+        UserPoints.objects.update(points=0)
+        leaderboard.recalculate()
+        self.assertEqual(leaderboard.user_rank(user)['points'], 30)
+        self.assertBucketsMatchPoints()
+
+    def test_rank_follows_point_changes(self):
+        first, second, third = self.users[:3]
+        self.award(first, self.small)
+        self.award(second, self.big)
+        self.award(third, self.big)
+        self.assertEqual([leaderboard.user_rank(user)['rank'] for user in (first, second, third)], [3, 1, 1])
+
+        # Пересчет части пользователей после изменения очков достижения
+        self.small.points = 20
+        self.small.save()
+        self.assertEqual([leaderboard.user_rank(user)['rank'] for user in (first, second, third)], [1, 2, 2])
+        self.assertBucketsMatchPoints()
 
-# Create your tests here.
+        second.delete()
+        self.assertEqual(leaderboard.user_rank(third)['rank'], 2)
+        self.assertEqual(leaderboard.user_rank(first)['total_users'], 2)
+        self.assertBucketsMatchPoints()
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AchievementViewSet, UserAchievementViewSet, CheckAchievementsView
+from .views import AchievementViewSet, UserAchievementViewSet, CheckAchievementsView, LeaderboardViewSet
 
 router = DefaultRouter()
 router.register(r'achievements', AchievementViewSet)
 router.register(r'user-achievements', UserAchievementViewSet, basename='user-achievement')
+router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 
 urlpatterns = [
     path('', include(router.urls)),
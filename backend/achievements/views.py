@@ -5,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.shortcuts import get_object_or_404
 from .models import Achievement, UserAchievement
 from .serializers import AchievementSerializer, UserAchievementSerializer
+from . import engine, leaderboard
 
 class AchievementViewSet(viewsets.ModelViewSet):
     """ViewSet for achievements"""
@@ -29,67 +30,32 @@ class UserAchievementViewSet(viewsets.ReadOnlyModelViewSet):
         ).select_related('achievement').order_by('-earned_at')
 
 class CheckAchievementsView(generics.GenericAPIView):
-    """View to check and award achievements"""
+    """Compatibility endpoint: achievements are awarded by library and progress events
+    (see achievements/engine.py), so there is nothing left to poll. The call only builds
+    the counters of a user who has had no events yet and returns what that awarded."""
     permission_classes = [IsAuthenticated]
     
     def post(self, request, *args, **kwargs):
-        user = request.user
-        awarded = []
-        
-        # Get all achievements that the user doesn't have yet
-        user_achievement_ids = UserAchievement.objects.filter(user=user).values_list('achievement_id', flat=True)
-        achievements = Achievement.objects.exclude(id__in=user_achievement_ids)
-        
-        # Check each achievement
-        for achievement in achievements:
-            if self.check_achievement_requirements(user, achievement):
-                # Award the achievement
-                user_achievement = UserAchievement.objects.create(
-                    user=user,
-                    achievement=achievement
-                )
-                awarded.append(UserAchievementSerializer(user_achievement).data)
+        _, awarded = engine.build(request.user.pk)
         
         return Response({
-            'awarded_achievements': awarded
+            'awarded_achievements': UserAchievementSerializer(awarded, many=True).data
         })
+
+class LeaderboardViewSet(viewsets.ViewSet):
+    """Achievement points leaderboard (materialized in UserPoints)"""
+    permission_classes = [IsAuthenticated]
     
-    def check_achievement_requirements(self, user, achievement):
-        """Check if user meets the requirements for an achievement"""
-        from books.models import UserBook, ReadingProgress
+    def list(self, request):
+        """Top users by points: ?limit=N (up to 100)"""
+        try:
+            limit = int(request.query_params.get('limit', leaderboard.DEFAULT_TOP_SIZE))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
         
-        requirement = achievement.requirement
-        category = achievement.category
-        
-        # Проверка достижений по чтению
-        if category in [Achievement.Category.READING, Achievement.Category.BOOKS, Achievement.Category.SOCIAL]:
-            if 'books_read' in requirement:
-                books_read = UserBook.objects.filter(
-                    user=user, 
-                    status=UserBook.Status.COMPLETED
-                ).count()
-                return books_read >= requirement['books_read']
-                
-            if 'progress_marks' in requirement:
-                progress_marks = ReadingProgress.objects.filter(
-                    user_book__user=user
-                ).count()
-                return progress_marks >= requirement['progress_marks']
-                
-            if 'books_rated' in requirement:
-                books_rated = UserBook.objects.filter(
-                    user=user,
-                    rating__isnull=False
-                ).count()
-                return books_rated >= requirement['books_rated']
-                
-            if 'books_in_library' in requirement:
-                books_in_library = UserBook.objects.filter(user=user).count()
-                return books_in_library >= requirement['books_in_library']
-        
-        # Пока что другие типы достижений не реализованы
-        if category == Achievement.Category.OTHER:
-            # Заглушка для специальных достижений
-            return False
-        
-        return False
+        return Response({'results': leaderboard.top(limit)})
+    
+    @action(detail=False, methods=['get'])
+    def me(self, request):
+        """Points and rank of the current user"""
+        return Response(leaderboard.user_rank(request.user))
@@ -5,7 +5,8 @@ from django.http import HttpResponse, JsonResponse
 from django.contrib import messages
 from django.core.management import call_command
 from django.utils.html import format_html
-from .models import Book, Author, UserBook, ReadingProgress, BookVote, WeeklyBook
+from django.db.models import OuterRef, Subquery
+from .models import Book, BookContent, BookChapter, ContentFetchJob, FailingContentSource, Author, Genre, UserBook, ReadingProgress, CurrentProgress, DailyReadingProgress, UserReadingStats, DailyReadingActivity, BookVote, WeeklyVoteTally, WeeklyBook
 import io
 import sys
 from contextlib import redirect_stdout, redirect_stderr
@@ -15,13 +16,80 @@ class AuthorAdmin(admin.ModelAdmin):
     list_display = ('name', 'id')
     search_fields = ('name',)
 
+@admin.register(Genre)
+class GenreAdmin(admin.ModelAdmin):
+    list_display = ('name', 'id')
+    search_fields = ('name',)
+
+class BookContentInline(admin.StackedInline):
+    """Read-only: text is written only through Book.save_content / BookContent.store,
+    which also update the word index, chapters and text metrics"""
+    model = BookContent
+    can_delete = False
+    fields = ('storage', 'char_count', 'word_count', 'version', 'updated_at')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+class BookChapterInline(admin.TabularInline):
+    model = BookChapter
+    extra = 0
+    can_delete = False
+    readonly_fields = ('number', 'title', 'level', 'start', 'end', 'start_word')
+
+@admin.register(ContentFetchJob)
+class ContentFetchJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'book', 'status', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('book__title',)
+    raw_id_fields = ('book',)
+    readonly_fields = ('created_at',)
+
+@admin.register(FailingContentSource)
+class FailingContentSourceAdmin(admin.ModelAdmin):
+    """Books whose text keeps failing to download from the external source"""
+    list_display = ('title', 'source_type', 'source_id', 'content_fetch_failures', 'content_retry_at', 'last_error')
+    list_filter = ('source_type',)
+    search_fields = ('title', 'source_id')
+    fields = list_display
+    readonly_fields = list_display
+    actions = ['retry_now']
+    
+    def get_queryset(self, request):
+        from .content_jobs import CHRONIC_FAILURES
+        
+        last_error = ContentFetchJob.objects.filter(
+            book=OuterRef('pk'), status=ContentFetchJob.Status.FAILED
+        ).order_by('-created_at').values('error')[:1]
+        return super().get_queryset(request).filter(
+            content_fetch_failures__gte=CHRONIC_FAILURES
+        ).annotate(last_fetch_error=Subquery(last_error)).order_by('-content_fetch_failures')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    @admin.display(description='Last error')
+    def last_error(self, obj):
+        return obj.last_fetch_error
+    
+    @admin.action(description='Retry on next read (reset backoff)')
+    def retry_now(self, request, queryset):
+        from .content_jobs import reset_backoff
+        
+        updated = reset_backoff(queryset)
+        self.message_user(request, f'Backoff reset for {updated} books')
+
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'vote_count', 'is_book_of_week', 'published_date', 'created_at')
-    list_filter = ('author', 'is_book_of_week', 'published_date')
+    list_display = ('title', 'author', 'age_category', 'content_status', 'vote_count', 'is_book_of_week', 'published_date', 'created_at')
+    list_filter = ('author', 'is_book_of_week', 'age_category', 'content_status', 'genres', 'published_date')
     search_fields = ('title', 'author__name', 'description')
     date_hierarchy = 'published_date'
-    readonly_fields = ('vote_count',)
+    # Связи с жанрами собираются из строки genre при сохранении книги
+    readonly_fields = ('genres', 'vote_count', 'rating_sum', 'rating_count', 'rating_avg', 'content_fetch_failures',
+                       'content_retry_at', 'word_count', 'char_count', 'estimated_pages', 'reading_minutes')
+    inlines = [BookContentInline, BookChapterInline]
     
     def get_urls(self):
         urls = super().get_urls()
@@ -177,6 +245,39 @@ class ReadingProgressAdmin(admin.ModelAdmin):
     search_fields = ('user_book__user__username', 'user_book__book__title')
     date_hierarchy = 'created_at'
 
+@admin.register(CurrentProgress)
+class CurrentProgressAdmin(admin.ModelAdmin):
+    list_display = ('user_book', 'current_page', 'total_pages', 'updated_at')
+    search_fields = ('user_book__user__username', 'user_book__book__title')
+    raw_id_fields = ('user_book',)
+
+@admin.register(DailyReadingProgress)
+class DailyReadingProgressAdmin(admin.ModelAdmin):
+    list_display = ('user_book', 'date', 'marks_count', 'max_page')
+    search_fields = ('user_book__user__username', 'user_book__book__title')
+    raw_id_fields = ('user_book',)
+    date_hierarchy = 'date'
+
+@admin.register(UserReadingStats)
+class UserReadingStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'books_read', 'pages_read', 'total_marks', 'reading_streak', 'last_read_date', 'updated_at')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+
+@admin.register(DailyReadingActivity)
+class DailyReadingActivityAdmin(admin.ModelAdmin):
+    list_display = ('user', 'date', 'marks_count')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+    date_hierarchy = 'date'
+
+@admin.register(WeeklyVoteTally)
+class WeeklyVoteTallyAdmin(admin.ModelAdmin):
+    list_display = ('book', 'week_start', 'votes')
+    search_fields = ('book__title',)
+    raw_id_fields = ('book',)
+    date_hierarchy = 'week_start'
+
 @admin.register(BookVote)
 class BookVoteAdmin(admin.ModelAdmin):
     list_display = ('user', 'book', 'created_at')
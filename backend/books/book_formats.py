@@ -0,0 +1,341 @@
+"""Потоковый разбор файлов книг (FB2, EPUB) в компактное структурное представление.
+
+Парсер не строит дерево документа целиком: lxml.etree.iterparse отдает
+элементы по мере чтения, каждый абзац превращается в строку сразу после
+закрывающего тега, а сам элемент и уже обработанные соседи удаляются из
+дерева. Поэтому память зависит от размера самого большого абзаца (или
+картинки в <binary>), а не от размера файла. EPUB читается главами в
+порядке spine из OPF, каждая глава распаковывается из zip потоком.
+
+Результат - ParsedBook: плоский список блоков (тип, уровень, текст).
+ParsedBook.render() за один проход выдает плоский текст для хранилища,
+индекс позиций слов для пагинации и оглавление.
+"""
+
+import io
+import posixpath
+import re
+import zipfile
+from array import array
+from urllib.parse import unquote
+from typing import List, NamedTuple, Optional, Tuple
+
+from lxml import etree
+
+from . import content_store
+
+# Типы блоков
+TITLE = 'title'
+PARAGRAPH = 'p'
+
+BLOCK_SEPARATOR = '\n\n'
+
+_SPACES_RE = re.compile(r'\s+')
+
+# Элементы FB2, текст которых выводится отдельным абзацем
+FB2_BLOCK_TAGS = frozenset(('p', 'v', 'subtitle', 'text-author'))
+# Служебные части файла, текст которых в книгу не попадает
+FB2_SKIPPED_TAGS = frozenset(('binary', 'description'))
+# Контейнеры, которые после закрытия можно выбросить из дерева
+FB2_CONTAINER_TAGS = frozenset(('section', 'stanza', 'poem', 'epigraph', 'cite', 'annotation', 'empty-line'))
+# Заголовки этих элементов попадают в оглавление (заголовки стихов - нет)
+FB2_TOC_PARENTS = frozenset(('body', 'section'))
+# Тела со сносками и комментариями в оглавление не попадают
+FB2_NOTES_BODIES = frozenset(('notes', 'comments'))
+
+# Элементы XHTML, текст которых выводится отдельным абзацем
+HTML_BLOCK_TAGS = frozenset((
+    'p', 'div', 'li', 'dt', 'dd', 'pre', 'blockquote', 'section', 'article', 'body',
+    'td', 'th', 'caption', 'figcaption', 'address', 'h4', 'h5', 'h6',
+))
+# Заголовки глав и их уровень в оглавлении
+HTML_TITLE_TAGS = {'h1': 1, 'h2': 2, 'h3': 3}
+HTML_SKIPPED_TAGS = frozenset(('head', 'script', 'style', 'nav'))
+
+EPUB_CONTAINER = 'META-INF/container.xml'
+EPUB_DOCUMENT_TYPES = frozenset(('application/xhtml+xml', 'text/html'))
+
+_ENCODING_RE = re.compile(rb'(?:encoding|charset)\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+
+
+class TocEntry(NamedTuple):
+    title: str
+    level: int
+    start: int        # позиция первого символа главы в тексте
+    end: int          # позиция сразу после последнего символа главы
+    start_word: int   # номер первого слова главы
+
+
+class RenderedBook(NamedTuple):
+    text: str
+    word_offsets: object  # array позиций слов, как у content_store.build_word_offsets
+    toc: List[TocEntry]
+
+
+class ParsedBook:
+    """Книга как последовательность блоков (тип, уровень вложенности, текст)"""
+
+    def __init__(self):
+        self.blocks: List[Tuple[str, int, str]] = []
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def add_title(self, level: int, text: str):
+        text = normalize_spaces(text)
+        if text:
+            self.blocks.append((TITLE, level, text))
+
+    def add_paragraph(self, text: str):
+        text = normalize_spaces(text)
+        if text:
+            self.blocks.append((PARAGRAPH, 0, text))
+
+    def render(self) -> RenderedBook:
+        """Плоский текст, индекс слов и оглавление за один проход по блокам"""
+        parts = []
+        word_offsets = array(content_store.WORD_INDEX_TYPECODE)
+        toc = []
+        open_entries = []  # индексы в toc, для которых еще не известен конец
+        position = 0
+
+        for kind, level, text in self.blocks:
+            if parts:
+                parts.append(BLOCK_SEPARATOR)
+                position += len(BLOCK_SEPARATOR)
+
+            if kind == TITLE:
+                # Новый заголовок закрывает главы того же и более глубокого уровня
+                while open_entries and toc[open_entries[-1]].level >= level:
+                    i = open_entries.pop()
+                    toc[i] = toc[i]._replace(end=_strip_end(position))
+                open_entries.append(len(toc))
+                toc.append(TocEntry(text, level, position, position, len(word_offsets)))
+
+            content_store.extend_word_offsets(word_offsets, text, position)
+            parts.append(text)
+            position += len(text)
+
+        for i in open_entries:
+            toc[i] = toc[i]._replace(end=position)
+
+        return RenderedBook(''.join(parts), word_offsets, toc)
+
+
+def _strip_end(position):
+    """Конец главы - перед разделителем, за которым начинается следующая"""
+    return max(0, position - len(BLOCK_SEPARATOR))
+
+
+def normalize_spaces(text: str) -> str:
+    return _SPACES_RE.sub(' ', text).strip()
+
+
+def _local_name(tag) -> str:
+    # Теги FB2 приходят с namespace: {http://www.gribuser.ru/xml/fictionbook/2.0}p
+    if not isinstance(tag, str):
+        return ''
+    return tag.rpartition('}')[2]
+
+
+def _release(element):
+    """Освобождает обработанный элемент и всех его уже разобранных соседей слева"""
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def parse_fb2(data: bytes) -> ParsedBook:
+    """Потоковый разбор FB2 из исходных байтов.
+
+    Кодировку берет из XML-декларации файла, поэтому байты не нужно
+    предварительно декодировать. Тексты заметок (<body name="notes">)
+    идут после основного текста, как в самом файле.
+    """
+    book = ParsedBook()
+    section_depth = 0
+    title_parts = None   # абзацы текущего <title>, пока он не закрыт
+    title_level = 0
+    skip_depth = 0       # внутри <binary>/<description> ничего не выводится
+    in_notes = False
+
+    events = etree.iterparse(
+        io.BytesIO(data),
+        events=('start', 'end'),
+        recover=True,
+        huge_tree=True,
+        resolve_entities=False,
+        no_network=True,
+    )
+    for event, element in events:
+        name = _local_name(element.tag)
+
+        if event == 'start':
+            if name in FB2_SKIPPED_TAGS:
+                skip_depth += 1
+            elif name == 'section':
+                section_depth += 1
+            elif name == 'body':
+                in_notes = element.get('name') in FB2_NOTES_BODIES
+            elif (name == 'title' and not skip_depth and not in_notes
+                  and _local_name(element.getparent().tag) in FB2_TOC_PARENTS):
+                title_parts = []
+                title_level = section_depth
+            continue
+
+        if name in FB2_SKIPPED_TAGS:
+            skip_depth -= 1
+            _release(element)
+        elif skip_depth:
+            continue
+        elif name in FB2_BLOCK_TAGS:
+            # itertext захватывает текст вложенных <emphasis>/<strong>/<a> и их хвосты
+            text = ''.join(element.itertext())
+            if title_parts is not None:
+                title_parts.append(text)
+            else:
+                book.add_paragraph(text)
+            _release(element)
+        elif name == 'title' and title_parts is not None:
+            book.add_title(title_level, ' '.join(title_parts))
+            title_parts = None
+            _release(element)
+        elif name in FB2_CONTAINER_TAGS:
+            if name == 'section':
+                section_depth -= 1
+            _release(element)
+
+    return book
+
+
+def _flush_inline_run(element, book):
+    """Текст родителя перед блоком (не обернутый в свой абзац) выводится отдельным абзацем"""
+    parent = element.getparent()
+    if parent is None:
+        return
+    preceding = list(element.itersiblings(preceding=True))
+    parts = [parent.text or '']
+    for sibling in reversed(preceding):
+        parts.extend(sibling.itertext())
+        parts.append(sibling.tail or '')
+    book.add_paragraph(''.join(parts))
+    parent.text = None
+    for sibling in preceding:
+        parent.remove(sibling)
+
+
+def _sniff_encoding(head: bytes) -> str:
+    match = _ENCODING_RE.search(head)
+    return match.group(1).decode('ascii') if match else 'utf-8'
+
+
+def parse_xhtml(stream, book: ParsedBook):
+    """Потоковый разбор одной главы EPUB (XHTML) с добавлением блоков в book"""
+    head = stream.read(1024)
+    stream.seek(0)
+    skip_depth = 0
+
+    # HTML-режим lxml прощает ошибки разметки и знает именованные сущности (&nbsp;)
+    events = etree.iterparse(
+        stream,
+        events=('start', 'end'),
+        html=True,
+        encoding=_sniff_encoding(head),
+        recover=True,
+        huge_tree=True,
+        no_network=True,
+    )
+    for event, element in events:
+        tag = element.tag if isinstance(element.tag, str) else ''
+
+        if event == 'start':
+            if tag in HTML_SKIPPED_TAGS:
+                skip_depth += 1
+            elif skip_depth:
+                pass
+            elif tag == 'br':
+                # Иначе слова по обе стороны <br/> склеятся
+                element.text = ' '
+            elif tag in HTML_BLOCK_TAGS or tag in HTML_TITLE_TAGS:
+                _flush_inline_run(element, book)
+            continue
+
+        if tag in HTML_SKIPPED_TAGS:
+            skip_depth -= 1
+            element.clear(keep_tail=True)
+        elif skip_depth:
+            continue
+        elif tag in HTML_TITLE_TAGS:
+            book.add_title(HTML_TITLE_TAGS[tag], ''.join(element.itertext()))
+            _release(element)
+        elif tag in HTML_BLOCK_TAGS:
+            book.add_paragraph(''.join(element.itertext()))
+            _release(element)
+
+    return book
+
+
+def _xml_children(element, name):
+    return [child for child in element.iter() if _local_name(child.tag) == name]
+
+
+def epub_spine(archive: zipfile.ZipFile) -> List[str]:
+    """Пути документов EPUB в порядке чтения (spine из OPF).
+
+    Если OPF не найден или испорчен, документы берутся в порядке архива.
+    """
+    names = archive.namelist()
+    try:
+        container = etree.fromstring(archive.read(EPUB_CONTAINER))
+        opf_path = _xml_children(container, 'rootfile')[0].get('full-path')
+        opf = etree.fromstring(archive.read(opf_path))
+    except (KeyError, IndexError, etree.XMLSyntaxError):
+        return [name for name in names if name.lower().endswith(('.xhtml', '.html', '.htm'))]
+
+    opf_dir = posixpath.dirname(opf_path)
+    manifest = {}
+    for item in _xml_children(opf, 'item'):
+        if item.get('media-type') not in EPUB_DOCUMENT_TYPES:
+            continue
+        # Оглавление EPUB 3 (nav) - служебный документ, не текст книги
+        if 'nav' in (item.get('properties') or '').split():
+            continue
+        href = unquote((item.get('href') or '').split('#')[0])
+        manifest[item.get('id')] = posixpath.normpath(posixpath.join(opf_dir, href))
+
+    existing = set(names)
+    spine = []
+    for itemref in _xml_children(opf, 'itemref'):
+        path = manifest.get(itemref.get('idref'))
+        if path in existing and path not in spine:
+            spine.append(path)
+    return spine
+
+
+def parse_epub(data: bytes) -> ParsedBook:
+    """Разбор EPUB из исходных байтов: главы в порядке spine, каждая - потоком"""
+    book = ParsedBook()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for path in epub_spine(archive):
+            with archive.open(path) as stream:
+                parse_xhtml(stream, book)
+    return book
+
+
+def parse_text(text: str) -> ParsedBook:
+    """Обычный текст: абзацы разделены пустыми строками"""
+    book = ParsedBook()
+    for paragraph in re.split(r'\n\s*\n', text):
+        book.add_paragraph(paragraph)
+    return book
+
+
+def parse_book(data: bytes, file_format: str) -> Optional[ParsedBook]:
+    """Разбор файла книги по формату; None для неподдерживаемых форматов"""
+    if file_format == 'fb2':
+        return parse_fb2(data)
+    if file_format == 'epub':
+        return parse_epub(data)
+    return None
@@ -0,0 +1,243 @@
+"""Фоновая загрузка текстов книг.
+
+Скачивание книги с Флибусты идет через Tor и с повторами может занимать
+минуты, поэтому HTTP-запрос его не ждет: представление ставит задачу
+ContentFetchJob и сразу отвечает 202 с id задачи, а сама загрузка
+выполняется в пуле потоков процесса (CONTENT_FETCH_IN_PROCESS) или
+командой ``manage.py run_content_jobs`` в отдельном воркере.
+
+Загрузка одной книги выполняется не более одного раза одновременно:
+частичный уникальный индекс разрешает книге только одну активную задачу,
+поэтому параллельные читатели (в том числе из разных процессов)
+получают id уже запущенной задачи и ждут ее результата.
+
+Задача, которая слишком долго висит в очереди или в работе (воркер упал
+или перезапустился, отправка в пул потерялась), считается зависшей:
+при следующем обращении к книге и при каждом проходе воркера она
+помечается неудачной, и загрузку можно поставить заново.
+
+Книги без внешнего источника (см. has_fetchable_source) в очередь не
+ставятся: скачивать их неоткуда, и читатель сразу получает запасной текст.
+
+Неудачи запоминаются в книге (negative cache): число неудач подряд и
+время следующей попытки растет экспоненциально, и до этого времени
+читатели сразу получают запасной текст без новой загрузки через Tor.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Book, BookContent, ContentFetchJob
+
+logger = logging.getLogger(__name__)
+
+# Текст короче этого считается неудачной загрузкой
+MIN_CONTENT_LENGTH = 100
+
+# Пауза после первой неудачи и ее верхний предел (секунды); каждая следующая неудача удваивает паузу
+RETRY_BASE_DELAY = getattr(settings, 'CONTENT_FETCH_RETRY_BASE_DELAY', 5 * 60)
+RETRY_MAX_DELAY = getattr(settings, 'CONTENT_FETCH_RETRY_MAX_DELAY', 24 * 60 * 60)
+# С какого числа неудач подряд источник считается хронически недоступным
+CHRONIC_FAILURES = getattr(settings, 'CONTENT_FETCH_CHRONIC_FAILURES', 3)
+# Через сколько секунд задача в очереди или в работе считается зависшей
+# (должно быть больше самой долгой загрузки через Tor со всеми повторами)
+STALE_AFTER = getattr(settings, 'CONTENT_FETCH_STALE_AFTER', 15 * 60)
+
+STALE_ERROR = 'Задача зависла (воркер остановлен или перезапущен)'
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'CONTENT_FETCH_WORKERS', 2),
+            thread_name_prefix='content-fetch',
+        )
+    return _executor
+
+
+def retry_delay(failures: int) -> timedelta:
+    """Пауза перед следующей попыткой после ``failures`` неудач подряд"""
+    if failures <= 0:
+        return timedelta(0)
+    return timedelta(seconds=min(RETRY_BASE_DELAY * 2 ** (failures - 1), RETRY_MAX_DELAY))
+
+
+def has_fetchable_source(book) -> bool:
+    """Есть ли откуда скачать текст: книга импортирована из внешнего каталога
+    (с Флибусты - по ее id, из остальных - поиском на Флибусте по названию и автору)"""
+    return bool(book.source_type)
+
+
+def in_backoff(book) -> bool:
+    """True, если после прошлой неудачи повторять загрузку еще рано"""
+    return book.content_retry_at is not None and book.content_retry_at > timezone.now()
+
+
+def reset_backoff(queryset):
+    """Сбрасывает счетчик неудач (например, после исправления источника в админке)"""
+    return queryset.update(content_fetch_failures=0, content_retry_at=None)
+
+
+def reap_stale_jobs(book=None, queued=True) -> int:
+    """Помечает зависшие задачи неудачными. Возвращает их число.
+
+    queued=False - только задачи в работе: очередь воркера (run_pending_jobs)
+    может законно ждать дольше STALE_AFTER.
+    """
+    cutoff = timezone.now() - timedelta(seconds=STALE_AFTER)
+    stale = Q(status=ContentFetchJob.Status.RUNNING, started_at__lt=cutoff)
+    if queued:
+        stale |= Q(status=ContentFetchJob.Status.QUEUED, created_at__lt=cutoff)
+
+    jobs = ContentFetchJob.objects.filter(stale)
+    if book is not None:
+        jobs = jobs.filter(book=book)
+    # Условный UPDATE: задача, которую воркер успел завершить, не трогается
+    reaped = jobs.update(status=ContentFetchJob.Status.FAILED, error=STALE_ERROR, finished_at=timezone.now())
+    if reaped:
+        logger.warning("Reaped %s stale content fetch jobs", reaped)
+    return reaped
+
+
+def get_active_job(book):
+    # Задача в очереди теряется только при отправке в пул процесса; очередь воркера - сама БД
+    reap_stale_jobs(book, queued=getattr(settings, 'CONTENT_FETCH_IN_PROCESS', True))
+    return ContentFetchJob.objects.filter(book=book, status__in=ContentFetchJob.ACTIVE_STATUSES).first()
+
+
+def enqueue(book) -> ContentFetchJob:
+    """Ставит загрузку текста книги в очередь (или возвращает уже активную задачу)"""
+    job = get_active_job(book)
+    if job is not None:
+        return job
+
+    try:
+        with transaction.atomic():
+            job = ContentFetchJob.objects.create(book=book)
+            Book.objects.filter(pk=book.pk).update(content_status=Book.ContentStatus.FETCHING)
+    except IntegrityError:
+        # Параллельный запрос успел поставить задачу первым - подписываемся на нее.
+        # Если она уже успела завершиться, отдаем ее результат
+        return get_active_job(book) or ContentFetchJob.objects.filter(book=book).first()
+
+    book.content_status = Book.ContentStatus.FETCHING
+
+    if getattr(settings, 'CONTENT_FETCH_IN_PROCESS', True):
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+    return job
+
+
+def _run_in_thread(job_id):
+    # У потока пула свое соединение с БД, его нужно закрывать самим
+    close_old_connections()
+    try:
+        run_job(job_id)
+    except Exception:
+        logger.exception("Content fetch job %s crashed", job_id)
+    finally:
+        close_old_connections()
+
+
+def run_job(job_id):
+    """Выполняет задачу, если она еще никем не взята.
+
+    Возвращает True/False - удалось ли получить текст, или None, если
+    задачу уже взял другой воркер.
+    """
+    claimed = ContentFetchJob.objects.filter(pk=job_id, status=ContentFetchJob.Status.QUEUED).update(
+        status=ContentFetchJob.Status.RUNNING,
+        started_at=timezone.now(),
+    )
+    if not claimed:
+        return None
+
+    job = ContentFetchJob.objects.select_related('book__author').get(pk=job_id)
+    error = ''
+    try:
+        # Текст мог появиться, пока задача ждала в очереди (импорт, предыдущая задача)
+        content_store = BookContent.for_book(job.book_id)
+        if content_store is not None and not content_store.is_placeholder:
+            loaded = True
+        else:
+            loaded = fetch_book_content(job.book)
+        if not loaded:
+            error = 'Текст книги не найден во внешних источниках'
+    except Exception as e:
+        logger.exception("Content fetch for book %s failed", job.book_id)
+        loaded = False
+        error = str(e)
+
+    job.status = ContentFetchJob.Status.DONE if loaded else ContentFetchJob.Status.FAILED
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+
+    if loaded:
+        Book.objects.filter(pk=job.book_id).update(
+            content_status=Book.ContentStatus.READY,
+            content_fetch_failures=0,
+            content_retry_at=None,
+        )
+    else:
+        failures = job.book.content_fetch_failures + 1
+        Book.objects.filter(pk=job.book_id).update(
+            content_status=Book.ContentStatus.FAILED,
+            content_fetch_failures=failures,
+            content_retry_at=job.finished_at + retry_delay(failures),
+        )
+    return loaded
+
+
+def fetch_book_content(book) -> bool:
+    """Скачивает и сохраняет текст книги. Возвращает True, если текст получен."""
+    from .external_sources import ExternalBookSources
+
+    external_sources = ExternalBookSources(use_tor_for_flibusta=True)
+
+    # Книга импортирована с Флибусты - качаем по ее id, иначе ищем по названию и автору
+    if book.source_type == 'flibusta' and book.source_id:
+        book_data = {
+            'source_id': book.source_id,
+            'title': book.title,
+            'download_links': []  # Будет получено через source_id
+        }
+    else:
+        search_results = external_sources.search_flibusta(f"{book.title} {book.author.name}", limit=1)
+        if not search_results:
+            return False
+        book_data = search_results[0]
+
+    parsed = external_sources.get_parsed_book(book_data, 'fb2')
+    rendered = parsed.render() if parsed else None
+    if not rendered or len(rendered.text) <= MIN_CONTENT_LENGTH:
+        return False
+
+    # Индекс слов и оглавление уже построены парсером, второй проход по тексту не нужен
+    book.save_content(rendered.text, word_offsets=rendered.word_offsets, toc=rendered.toc)
+    return True
+
+
+def run_pending_jobs(limit=None) -> int:
+    """Выполняет задачи из очереди в текущем процессе. Возвращает число выполненных."""
+    # Задачи, брошенные упавшим воркером, иначе навсегда заняли бы свои книги
+    reap_stale_jobs(queued=False)
+
+    job_ids = ContentFetchJob.objects.filter(status=ContentFetchJob.Status.QUEUED).order_by('created_at')
+    job_ids = job_ids.values_list('id', flat=True)
+    if limit:
+        job_ids = job_ids[:limit]
+
+    processed = 0
+    for job_id in list(job_ids):
+        if run_job(job_id) is not None:
+            processed += 1
+    return processed
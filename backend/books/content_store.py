@@ -0,0 +1,242 @@
+"""Сжатое хранилище текстов книг на диске.
+
+Каждая книга хранится в отдельном файле, разбитом на блоки примерно
+одинакового размера (CHUNK_CHARS символов, граница блока всегда
+попадает на пробел, поэтому слово никогда не разрезается). Каждый блок
+сжат zlib отдельно, а в начале файла лежит индекс блоков:
+
+    header:  magic, chunk_count, char_count, word_count
+    index:   chunk_count записей (byte_offset, byte_length, char_offset, word_offset)
+    data:    сжатые блоки в UTF-8
+
+Файл открывается через mmap, поэтому чтение страницы распаковывает
+только те блоки, в которые она попадает, а не весь текст книги.
+
+Рядом с текстом хранится индекс слов (<id>.idx) - массив array('I')
+с позициями начала каждого слова. По нему граница любой страницы при
+любом words_per_page находится за O(1), а позиция -> страница - бинарным
+поиском; индекс тоже читается через mmap и в память целиком не грузится.
+"""
+
+import mmap
+import os
+import re
+import struct
+import tempfile
+import zlib
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+
+from django.conf import settings
+
+MAGIC = b'BKC1'
+HEADER = struct.Struct('<4sIQQ')
+INDEX_ENTRY = struct.Struct('<QIQQ')
+
+CHUNK_CHARS = getattr(settings, 'BOOK_CONTENT_CHUNK_CHARS', 32 * 1024)
+COMPRESSION_LEVEL = 6
+
+_WHITESPACE_RE = re.compile(r'\s')
+_WORD_RE = re.compile(r'\S+')
+
+# Позиции слов хранятся как 32-битные беззнаковые числа
+WORD_INDEX_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+
+def get_content_root() -> Path:
+    return Path(getattr(settings, 'BOOK_CONTENT_ROOT', Path(settings.BASE_DIR) / 'book_texts'))
+
+
+def get_content_path(book_id) -> Path:
+    """Путь к файлу текста книги (книги раскладываются по подпапкам по 1000 штук)"""
+    return get_content_root() / f'{int(book_id) // 1000:04d}' / f'{book_id}.bkc'
+
+
+def get_index_path(book_id) -> Path:
+    """Путь к индексу позиций слов книги"""
+    return get_content_path(book_id).with_suffix('.idx')
+
+
+def _atomic_write(path, parts):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.writelines(parts)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def split_chunks(text: str, chunk_chars: int = CHUNK_CHARS):
+    """Режет текст на блоки по границам пробелов.
+
+    Возвращает список кортежей (chunk, char_offset, word_offset).
+    """
+    chunks = []
+    start = 0
+    words_before = 0
+    length = len(text)
+    while start < length:
+        cut = min(start + chunk_chars, length)
+        if cut < length:
+            match = _WHITESPACE_RE.search(text, cut)
+            cut = match.start() if match else length
+        chunk = text[start:cut]
+        chunks.append((chunk, start, words_before))
+        words_before += len(chunk.split())
+        start = cut
+    return chunks
+
+
+def write_text(path, text: str, chunk_chars: int = CHUNK_CHARS):
+    """Атомарно записывает текст в файл. Возвращает (char_count, word_count)."""
+    chunks = split_chunks(text, chunk_chars)
+    compressed = [zlib.compress(chunk.encode('utf-8'), COMPRESSION_LEVEL) for chunk, _, _ in chunks]
+    word_count = chunks[-1][2] + len(chunks[-1][0].split()) if chunks else 0
+
+    index = []
+    byte_offset = HEADER.size + INDEX_ENTRY.size * len(chunks)
+    for (_, char_offset, word_offset), data in zip(chunks, compressed):
+        index.append(INDEX_ENTRY.pack(byte_offset, len(data), char_offset, word_offset))
+        byte_offset += len(data)
+
+    _atomic_write(path, [HEADER.pack(MAGIC, len(chunks), len(text), word_count)] + index + compressed)
+    return len(text), word_count
+
+
+def build_word_offsets(text: str) -> array:
+    """Позиции начала всех слов текста (слово - последовательность не-пробелов)"""
+    return array(WORD_INDEX_TYPECODE, (match.start() for match in _WORD_RE.finditer(text)))
+
+
+def extend_word_offsets(offsets: array, text: str, base: int = 0):
+    """Дописывает в индекс позиции слов фрагмента, который начинается с позиции base"""
+    offsets.extend(base + match.start() for match in _WORD_RE.finditer(text))
+
+
+def write_word_index(path, offsets: array):
+    _atomic_write(path, [offsets.tobytes()])
+
+
+def delete_text(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class ChunkedText:
+    """Доступ только на чтение к сжатому тексту книги через mmap"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        magic, chunk_count, self.char_count, self.word_count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'Not a book content file: {path}')
+
+        self._index = [
+            INDEX_ENTRY.unpack_from(self._mm, HEADER.size + i * INDEX_ENTRY.size)
+            for i in range(chunk_count)
+        ]
+        self._char_offsets = [entry[2] for entry in self._index]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    @property
+    def chunk_count(self):
+        return len(self._index)
+
+    def read_chunk(self, i) -> str:
+        byte_offset, byte_length, _, _ = self._index[i]
+        return zlib.decompress(self._mm[byte_offset:byte_offset + byte_length]).decode('utf-8')
+
+    def read_text(self) -> str:
+        return ''.join(self.read_chunk(i) for i in range(self.chunk_count))
+
+    def read_range(self, start: int, end: int) -> str:
+        """Символы [start, end) текста; распаковываются только нужные блоки"""
+        start = max(0, start)
+        end = min(end, self.char_count)
+        if start >= end:
+            return ''
+        first = bisect_right(self._char_offsets, start) - 1
+        parts = []
+        i = first
+        while i < self.chunk_count and self._char_offsets[i] < end:
+            parts.append(self.read_chunk(i))
+            i += 1
+        base = self._char_offsets[first]
+        return ''.join(parts)[start - base:end - base]
+
+
+class WordIndex:
+    """Индекс позиций слов, открытый через mmap.
+
+    Поддерживает len() и доступ по номеру слова, поэтому по нему можно
+    делать bisect, не загружая массив целиком.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = None
+        self._view = None
+        self._offsets = ()
+        if os.fstat(self._file.fileno()).st_size:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mm)
+            self._offsets = self._view.cast(WORD_INDEX_TYPECODE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._mm is not None:
+            self._offsets.release()
+            self._view.release()
+            self._offsets = ()
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        return self._offsets[i]
+
+    def char_range(self, start_word: int, end_word: int, char_count: int):
+        """Символьный диапазон слов [start_word, end_word)"""
+        word_count = len(self._offsets)
+        start_word = max(0, start_word)
+        end_word = min(end_word, word_count)
+        if start_word >= end_word:
+            return 0, 0
+        start = self._offsets[start_word]
+        end = self._offsets[end_word] if end_word < word_count else char_count
+        return start, end
+
@@ -4,7 +4,7 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from bs4 import BeautifulSoup
 import time
 import random
@@ -20,6 +20,7 @@ from .external_config import (
     TOR_PROXY_CONFIG
 )
 from .cover_sources import get_book_cover_url
+from .book_formats import ParsedBook, RenderedBook, parse_book, parse_epub, parse_text
 from requests import Session
 import json
 import xml.etree.ElementTree as ET
@@ -869,6 +870,40 @@ class FlibustaTorClient:
     
     def download_book(self, book_data: Dict[str, Any], format_preference: str = 'fb2') -> Optional[str]:
         """Скачивание книги с Флибусты"""
+        downloaded = self._download_file(book_data, format_preference)
+        if not downloaded:
+            return None
+        
+        content, format_name = downloaded
+        title = book_data.get('title', 'Неизвестная книга')
+        
+        # Определяем кодировку и декодируем
+        print(f"🔄 Обрабатываем содержимое файла в формате {format_name}...")
+        result = self._decode_content(content, format_name)
+        
+        if result:
+            print(f"✅ Книга '{title}' успешно обработана и готова к использованию")
+        else:
+            print(f"❌ Ошибка обработки книги '{title}'")
+            
+        return result
+    
+    def download_book_file(self, book_data: Dict[str, Any], format_preference: str = 'fb2') -> Optional[Tuple[bytes, str]]:
+        """Скачивание книги без декодирования: (байты файла, формат).
+        
+        ZIP-архив распаковывается, возвращается файл книги из него.
+        """
+        downloaded = self._download_file(book_data, format_preference)
+        if not downloaded:
+            return None
+        
+        content, format_name = downloaded
+        if self._is_zip_archive(content) and not format_name.startswith('epub'):
+            return self._unpack_zip(content, format_name.split('+')[0])
+        return content, format_name.split('+')[0]
+    
+    def _download_file(self, book_data: Dict[str, Any], format_preference: str = 'fb2') -> Optional[Tuple[bytes, str]]:
+        """Скачивание файла книги с Флибусты: (байты, формат ссылки)"""
         try:
             title = book_data.get('title', 'Неизвестная книга')
             author = book_data.get('author', 'Неизвестный автор')
@@ -947,27 +982,17 @@ class FlibustaTorClient:
             
             # Получаем содержимое
             print(f"📦 Загружаем содержимое файла...")
-            content = b''
-            total_size = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                content += chunk
-                total_size += len(chunk)
-                if len(content) > EXTERNAL_SOURCES_CONFIG['max_file_size']:
+            buffer = io.BytesIO()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                buffer.write(chunk)
+                if buffer.tell() > EXTERNAL_SOURCES_CONFIG['max_file_size']:
                     self.logger.error("Превышен максимальный размер файла")
                     return None
             
-            print(f"✅ Файл загружен, размер: {total_size} байт")
+            content = buffer.getvalue()
+            print(f"✅ Файл загружен, размер: {len(content)} байт")
             
-            # Определяем кодировку и декодируем
-            print(f"🔄 Обрабатываем содержимое файла в формате {format_name}...")
-            result = self._decode_content(content, preferred_link.get('format', 'fb2'))
-            
-            if result:
-                print(f"✅ Книга '{title}' успешно обработана и готова к использованию")
-            else:
-                print(f"❌ Ошибка обработки книги '{title}'")
-                
-            return result
+            return content, preferred_link.get('format', 'fb2')
             
         except Exception as e:
             self.logger.error(f"Ошибка скачивания с Флибусты: {e}")
@@ -1060,8 +1085,8 @@ class FlibustaTorClient:
         try:
             print(f"🔍 Анализируем тип файла: {file_format}")
             
-            # Проверяем, является ли файл ZIP архивом
-            if self._is_zip_archive(content):
+            # Проверяем, является ли файл ZIP архивом (EPUB сам по себе zip, его не распаковываем)
+            if not file_format.startswith('epub') and self._is_zip_archive(content):
                 print(f"📦 Обнаружен ZIP архив, начинаем разархивирование...")
                 return self._extract_from_zip(content, file_format)
             else:
@@ -1090,14 +1115,14 @@ class FlibustaTorClient:
                 # В крайнем случае игнорируем ошибки
                 return content.decode('utf-8', errors='ignore')
             
-            elif file_format == 'epub':
+            elif file_format.startswith('epub'):
                 # Обработка EPUB файлов
                 return self._parse_epub(content)
             
             else:
-                # Для бинарных форматов возвращаем как есть (base64 или hex)
-                import base64
-                return base64.b64encode(content).decode('ascii')
+                # Бинарные форматы (pdf, mobi) в текст не конвертируются
+                self.logger.warning(f"Формат {file_format} не поддерживается для чтения")
+                return ''
                 
         except Exception as e:
             self.logger.error(f"Ошибка декодирования содержимого: {e}")
@@ -1112,6 +1137,22 @@ class FlibustaTorClient:
     
     def _extract_from_zip(self, content: bytes, expected_format: str) -> str:
         """Извлечение содержимого из ZIP архива"""
+        try:
+            extracted = self._unpack_zip(content, expected_format)
+            if not extracted:
+                return "Ошибка: в архиве не найдено подходящих файлов"
+            
+            # Рекурсивно обрабатываем извлеченный файл
+            print(f"🔄 Рекурсивно обрабатываем извлеченный файл...")
+            extracted_content, file_format = extracted
+            return self._decode_content(extracted_content, file_format)
+                    
+        except Exception as e:
+            self.logger.error(f"Ошибка извлечения из ZIP архива: {e}")
+            return f"Ошибка извлечения из архива: {e}"
+    
+    def _unpack_zip(self, content: bytes, expected_format: str) -> Optional[Tuple[bytes, str]]:
+        """Извлечение файла книги из ZIP архива: (байты файла, формат)"""
         try:
             with zipfile.ZipFile(io.BytesIO(content), 'r') as zip_file:
                 # Получаем список файлов в архиве
@@ -1170,56 +1211,21 @@ class FlibustaTorClient:
                     
                     print(f"📝 Определен формат файла: {file_format}")
                     self.logger.info(f"Извлечен файл {target_file} из архива, формат: {file_format}")
-                    
-                    # Рекурсивно обрабатываем извлеченный файл
-                    print(f"🔄 Рекурсивно обрабатываем извлеченный файл...")
-                    return self._decode_content(extracted_content, file_format)
+                    return extracted_content, file_format
                 else:
                     print(f"❌ В архиве не найдено подходящих файлов")
                     self.logger.error("В архиве не найдено подходящих файлов")
-                    return "Ошибка: в архиве не найдено подходящих файлов"
+                    return None
                     
         except Exception as e:
             self.logger.error(f"Ошибка извлечения из ZIP архива: {e}")
-            return f"Ошибка извлечения из архива: {e}"
+            return None
     
     def _parse_epub(self, content: bytes) -> str:
-        """Парсинг EPUB файла для извлечения текста"""
+        """Парсинг EPUB файла для извлечения текста (главы в порядке spine)"""
         try:
-            with zipfile.ZipFile(io.BytesIO(content), 'r') as epub_zip:
-                # Ищем файлы с текстом (обычно в формате XHTML)
-                text_parts = []
-                
-                for filename in epub_zip.namelist():
-                    if filename.endswith(('.xhtml', '.html', '.htm')):
-                        try:
-                            file_content = epub_zip.read(filename)
-                            # Парсим HTML/XHTML содержимое
-                            soup = BeautifulSoup(file_content, 'html.parser')
-                            
-                            # Удаляем скрипты и стили
-                            for script in soup(["script", "style"]):
-                                script.decompose()
-                            
-                            # Извлекаем текст
-                            text = soup.get_text()
-                            
-                            # Очищаем текст
-                            lines = (line.strip() for line in text.splitlines())
-                            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                            text = '\n'.join(chunk for chunk in chunks if chunk)
-                            
-                            if text.strip():
-                                text_parts.append(text)
-                                
-                        except Exception as e:
-                            self.logger.warning(f"Ошибка обработки файла {filename} в EPUB: {e}")
-                            continue
-                
-                if text_parts:
-                    return '\n\n'.join(text_parts)
-                else:
-                    return "Ошибка: не удалось извлечь текст из EPUB файла"
+            text = parse_epub(content).render().text
+            return text or "Ошибка: не удалось извлечь текст из EPUB файла"
                     
         except Exception as e:
             self.logger.error(f"Ошибка парсинга EPUB: {e}")
@@ -1251,16 +1257,34 @@ class ExternalBookSources:
             print(f"Ошибка получения аннотации книги: {e}")
             return None
     
-    def get_book_content(self, book_data: Dict[str, Any], format_type: str = 'fb2') -> Optional[str]:
-        """Получение содержимого книги из внешнего источника"""
+    def get_book_content(self, book_data: Dict[str, Any], format_type: str = 'fb2') -> Optional[RenderedBook]:
+        """Получение содержимого книги из внешнего источника: текст, индекс слов и оглавление.
+        
+        Сохранять результат нужно через Book.save_content(text, word_offsets=..., toc=...),
+        иначе у книги не будет глав.
+        """
+        parsed = self.get_parsed_book(book_data, format_type)
+        if parsed is None:
+            return None
+        return parsed.render()
+    
+    def get_parsed_book(self, book_data: Dict[str, Any], format_type: str = 'fb2') -> Optional[ParsedBook]:
+        """Скачивание и потоковый разбор книги в структурное представление"""
         try:
-            # Используем уже имеющиеся данные книги
-            content = self.flibusta.download_book(book_data, format_type)
-            if content:
-                # Конвертация из FB2/EPUB в текст
-                return self._convert_to_text(content, format_type)
+            downloaded = self.flibusta.download_book_file(book_data, format_type)
+            if not downloaded:
+                return None
             
-            return None
+            # Байты файла передаются в парсер как есть, без промежуточного декодирования
+            data, file_format = downloaded
+            parsed = parse_book(data, file_format)
+            if parsed is None and file_format == 'txt':
+                parsed = parse_text(self.flibusta._decode_content(data, file_format))
+            if parsed is None:
+                print(f"Формат {file_format} не поддерживается для чтения")
+                return None
+            
+            return parsed if len(parsed) else None
             
         except Exception as e:
             print(f"Ошибка получения содержимого книги: {e}")
@@ -1301,53 +1325,6 @@ class ExternalBookSources:
         except Exception as e:
             print(f"Ошибка получения обложки: {e}")
             return None
-    
-    def _convert_to_text(self, content: str, format_type: str) -> str:
-        """Конвертация содержимого книги в текст"""
-        try:
-            if format_type == 'txt':
-                return content
-            elif format_type == 'fb2':
-                # Парсинг FB2 XML
-                return self._parse_fb2(content.encode('utf-8'))
-            elif format_type == 'epub':
-                # Для EPUB файлов контент уже должен быть обработан в _decode_content
-                # Если это строка base64, декодируем и парсим
-                try:
-                    import base64
-                    epub_bytes = base64.b64decode(content)
-                    return self._parse_epub(epub_bytes)
-                except Exception:
-                    # Если не base64, возвращаем как есть
-                    return content
-            else:
-                return content
-        except Exception as e:
-            print(f"Ошибка конвертации: {e}")
-            return ""
-    
-    def _parse_fb2(self, fb2_content: bytes) -> str:
-        """Парсинг FB2 файла для извлечения текста"""
-        try:
-            root = ET.fromstring(fb2_content)
-            
-            # FB2 namespace
-            ns = {'fb': 'http://www.gribuser.ru/xml/fictionbook/2.0'}
-            
-            # Извлечение текста из секций
-            text_parts = []
-            
-            # Поиск всех параграфов
-            paragraphs = root.findall('.//fb:p', ns)
-            for p in paragraphs:
-                if p.text:
-                    text_parts.append(p.text.strip())
-            
-            return '\n\n'.join(text_parts)
-            
-        except Exception as e:
-            print(f"Ошибка парсинга FB2: {e}")
-            return ""
 
 
 # Функции для интеграции с Django
@@ -1377,9 +1354,11 @@ def search_external_books(query: str, sources: List[str] = None, use_tor: bool =
     return results
 
 
-def import_book_from_external_source(book_data: Dict[str, Any], source: str, download_format: str = 'fb2', use_tor: bool = True) -> Optional[str]:
+def import_book_from_external_source(book_data: Dict[str, Any], source: str, download_format: str = 'fb2', use_tor: bool = True) -> Optional[RenderedBook]:
     """Импорт книги из внешнего источника (только Флибуста)
     
+    Возвращает RenderedBook (текст, индекс слов и оглавление) или None.
+    
     Args:
         book_data: Данные книги
         source: Источник книги (только flibusta)
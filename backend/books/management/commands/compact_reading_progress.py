@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from books import progress
+
+class Command(BaseCommand):
+    help = 'Compact old reading progress events into daily rollups'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days',
+            type=int,
+            default=progress.DEFAULT_KEEP_DAYS,
+            help='Keep events newer than this many days as is'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of user books compacted per transaction'
+        )
+    
+    def handle(self, *args, **options):
+        compacted = progress.compact(keep_days=options['keep_days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Reading progress events compacted: {compacted}'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from books.models import BookContent
+
+class Command(BaseCommand):
+    help = 'Move stored book texts between the database and compressed file storage'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--to',
+            choices=[choice[0] for choice in BookContent.Storage.choices],
+            default=BookContent.Storage.FILE,
+            help='Target storage (default: file)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of books processed per batch'
+        )
+    
+    def handle(self, *args, **options):
+        target = options['to']
+        batch_size = options['batch_size']
+        
+        converted = 0
+        last_id = 0
+        while True:
+            batch = list(
+                BookContent.objects.exclude(storage=target)
+                .filter(book_id__gt=last_id)
+                .order_by('book_id')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].book_id
+            
+            for content in batch:
+                # Текст тот же, поэтому оглавление (toc не передается) остается как есть
+                BookContent.store(content.book_id, content.get_text(), storage=target)
+                converted += 1
+            
+            self.stdout.write(f'Converted {converted} books...')
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Done. {converted} books moved to "{target}" storage.')
+        )
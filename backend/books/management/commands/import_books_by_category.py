@@ -95,12 +95,12 @@ class Command(BaseCommand):
                     genre_name = category
                     
                     # Получаем содержимое книги
-                    content = book_source.get_book_content(
+                    rendered = book_source.get_book_content(
                         book_data=book_data,
                         format_type='fb2'
                     )
                     
-                    if not content:
+                    if not rendered:
                         self.stdout.write(
                             self.style.WARNING(f'Не удалось получить содержимое: {title} - {author_name}')
                         )
@@ -114,10 +114,10 @@ class Command(BaseCommand):
                         title=title,
                         author=author,
                         description=book_data.get('description', f'Книга "{title}" автора {author_name}'),
-                        content=content,
                         cover_url=cover_url or '',
-                        genre=genre_name
+                        genre=book_data.get('genre') or genre_name
                     )
+                    book.save_content(rendered.text, word_offsets=rendered.word_offsets, toc=rendered.toc)
                     
                     imported_count += 1
                     self.stdout.write(
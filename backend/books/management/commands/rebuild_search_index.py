@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from books import search
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all books'
+    
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(
+                self.style.WARNING('Full-text search index is not supported for this database backend.')
+            )
+            return
+        
+        count = search.rebuild_index()
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Search index rebuilt for {count} books.')
+        )
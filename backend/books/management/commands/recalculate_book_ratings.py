@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from books.models import Book
+
+class Command(BaseCommand):
+    help = 'Recalculate denormalized rating aggregates (sum, count, average) for all books'
+    
+    def handle(self, *args, **options):
+        Book.recalculate_ratings()
+        
+        rated_count = Book.objects.filter(rating_count__gt=0).count()
+        self.stdout.write(
+            self.style.SUCCESS(f'Rating aggregates recalculated. Books with ratings: {rated_count}')
+        )
@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from books import reading_stats
+
+class Command(BaseCommand):
+    help = 'Rebuild per-user reading statistics and daily activity from progress history'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Only rebuild statistics of the user with this username'
+        )
+    
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk')
+        if options['user']:
+            users = users.filter(username=options['user'])
+        
+        rebuilt = 0
+        for user in users.iterator():
+            reading_stats.rebuild(user)
+            rebuilt += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'Reading statistics rebuilt for {rebuilt} users'))
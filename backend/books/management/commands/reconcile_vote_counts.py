@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from books import votes
+
+class Command(BaseCommand):
+    help = 'Fix Book.vote_count values that drifted from the BookVote table'
+    
+    def handle(self, *args, **options):
+        fixed = votes.reconcile()
+        self.stdout.write(self.style.SUCCESS(f'Vote counts reconciled. Books fixed: {fixed}'))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from books import content_jobs
+
+class Command(BaseCommand):
+    help = 'Run queued background book content fetch jobs (worker for CONTENT_FETCH_IN_PROCESS=False)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Maximum number of jobs to run in one pass'
+        )
+        parser.add_argument(
+            '--watch',
+            type=int,
+            default=0,
+            help='Keep polling the queue every N seconds instead of exiting'
+        )
+    
+    def handle(self, *args, **options):
+        while True:
+            processed = content_jobs.run_pending_jobs(limit=options['limit'])
+            if processed:
+                self.stdout.write(self.style.SUCCESS(f'Content jobs processed: {processed}'))
+            
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
@@ -1,7 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import datetime, timedelta
-from books.models import Book, WeeklyBook, BookVote
+from books import votes
+from books.models import Book, WeeklyBook, BookVote, WeeklyVoteTally
 from django.db import transaction
 
 class Command(BaseCommand):
@@ -9,7 +10,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         # Получаем текущую дату
-        now = timezone.now().date()
+        now = timezone.localdate()
         
         # Находим понедельник текущей недели
         days_since_monday = now.weekday()
@@ -30,22 +31,20 @@ class Command(BaseCommand):
             )
             return
         
-        # Находим книгу с наибольшим количеством голосов
-        top_book = Book.objects.filter(
-            is_book_of_week=False
-        ).order_by('-vote_count').first()
+        # Находим книгу с наибольшим количеством голосов за прошлую неделю
+        voting_week = week_start - timedelta(days=7)
+        top_tally = WeeklyVoteTally.objects.filter(
+            week_start=voting_week,
+            book__is_book_of_week=False
+        ).select_related('book').order_by('-votes', 'book_id').first()
         
-        if not top_book:
+        if not top_tally or top_tally.votes <= 0:
             self.stdout.write(
-                self.style.ERROR('No books available for selection')
+                self.style.WARNING(f'No votes for the week of {voting_week}, skipping selection')
             )
             return
         
-        if top_book.vote_count == 0:
-            self.stdout.write(
-                self.style.WARNING('Top book has no votes, skipping selection')
-            )
-            return
+        top_book = top_tally.book
         
         # Выполняем операции в транзакции
         with transaction.atomic():
@@ -57,20 +56,25 @@ class Command(BaseCommand):
                 book=top_book,
                 week_start=week_start,
                 week_end=week_end,
-                votes_at_selection=top_book.vote_count
+                votes_at_selection=top_tally.votes
             )
             
             # Устанавливаем книгу как книгу недели
             top_book.is_book_of_week = True
-            top_book.save()
+            top_book.save(update_fields=['is_book_of_week'])
             
-            # Сбрасываем голоса у всех книг
-            BookVote.objects.all().delete()
-            Book.objects.all().update(vote_count=0)
+            # Сбрасываем голоса прошлых недель (итоги недель остаются в WeeklyVoteTally);
+            # голоса, отданные на этой неделе, идут в следующий выбор
+            BookVote.objects.filter(created_at__lt=self.week_start_moment(week_start)).delete()
+            votes.reconcile()
         
         self.stdout.write(
             self.style.SUCCESS(
                 f'Successfully selected "{top_book.title}" as book of the week '
                 f'for {week_start} - {week_end} with {weekly_book.votes_at_selection} votes'
             )
-        )
\ No newline at end of file
+        )
+    
+    def week_start_moment(self, week_start):
+        """Начало понедельника в текущем часовом поясе"""
+        return timezone.make_aware(datetime.combine(week_start, datetime.min.time()))
@@ -18,8 +18,8 @@ class Command(BaseCommand):
             new_content = get_real_book_content_from_external_sources(book.title, book.author.name)
             
             if new_content and new_content != book.content:
-                book.content = new_content
-                book.save()
+                # У нового текста нет разметки глав: прежнее оглавление к нему не относится
+                book.save_content(new_content, toc=[])
                 updated_count += 1
                 self.stdout.write(
                     self.style.SUCCESS(f'✓ Обновлено: {book.title} (длина: {len(new_content)} символов)')
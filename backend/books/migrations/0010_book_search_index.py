@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from books import search
+
+    conn = schema_editor.connection
+    if not search.is_supported(conn):
+        return
+    search.create_index(conn)
+
+    Book = apps.get_model('books', 'Book')
+    rows = Book.objects.using(conn.alias).order_by('id').values_list('id', 'title', 'author__name', 'description')
+    for book_id, title, author_name, description in rows.iterator(chunk_size=500):
+        search.index_book(book_id, title, author_name, description, conn=conn)
+
+
+def drop_search_index(apps, schema_editor):
+    from books import search
+
+    search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_readingprogress_current_page_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
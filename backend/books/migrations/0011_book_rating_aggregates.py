@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:20
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    UserBook = apps.get_model('books', 'UserBook')
+    stats = UserBook.objects.filter(rating__isnull=False).values('book_id').annotate(
+        total=Sum('rating'), count=Count('rating')
+    )
+    for row in stats:
+        Book.objects.filter(pk=row['book_id']).update(
+            rating_sum=row['total'],
+            rating_count=row['count'],
+            rating_avg=row['total'] / row['count']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_book_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_avg',
+            field=models.FloatField(db_index=True, default=0.0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
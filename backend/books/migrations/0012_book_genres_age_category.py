@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+def populate_genres(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Genre = apps.get_model('books', 'Genre')
+    genre_cache = {}
+    books = Book.objects.exclude(genre__isnull=True).exclude(genre='').only('id', 'genre')
+    for book in books.iterator(chunk_size=500):
+        names = []
+        for name in book.genre.split(','):
+            name = name.strip()[:255]
+            if name and name not in names:
+                names.append(name)
+        genre_ids = []
+        for name in names:
+            if name not in genre_cache:
+                genre_cache[name] = Genre.objects.get_or_create(name=name)[0].pk
+            genre_ids.append(genre_cache[name])
+        book.genres.set(genre_ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_book_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='age_category',
+            field=models.CharField(blank=True, choices=[('0+', '0+'), ('6+', '6+'), ('12+', '12+'), ('16+', '16+'), ('18+', '18+')], db_index=True, default='', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='genres',
+            field=models.ManyToManyField(blank=True, related_name='books', to='books.genre'),
+        ),
+        migrations.RunPython(populate_genres, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+BACKFILL_BATCH_SIZE = 200
+
+
+def copy_content_in_batches(apps, schema_editor):
+    """Copy Book.content into BookContent batch by batch.
+
+    The migration is non-atomic, so every batch is committed on its own and
+    the books table is never locked for the whole copy. Already copied books
+    are skipped, so the migration can be safely re-run after an interruption.
+    """
+    Book = apps.get_model('books', 'Book')
+    BookContent = apps.get_model('books', 'BookContent')
+    db_alias = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        batch = list(
+            Book.objects.using(db_alias)
+            .filter(id__gt=last_id)
+            .order_by('id')
+            .values_list('id', 'content')[:BACKFILL_BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+        with transaction.atomic(using=db_alias):
+            existing = set(
+                BookContent.objects.using(db_alias)
+                .filter(book_id__in=[book_id for book_id, _ in batch])
+                .values_list('book_id', flat=True)
+            )
+            BookContent.objects.using(db_alias).bulk_create([
+                BookContent(book_id=book_id, text=content or '')
+                for book_id, content in batch
+                if book_id not in existing
+            ])
+
+
+def copy_content_back(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    BookContent = apps.get_model('books', 'BookContent')
+    db_alias = schema_editor.connection.alias
+
+    for book_id, text in BookContent.objects.using(db_alias).values_list('book_id', 'text').iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        Book.objects.using(db_alias).filter(id=book_id).update(content=text)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('books', '0012_book_genres_age_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookContent',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='content_store', serialize=False, to='books.book')),
+                ('text', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(copy_content_in_batches, copy_content_back),
+    ]
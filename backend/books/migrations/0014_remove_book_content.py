@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_bookcontent'),
+    ]
+
+    operations = [
+        # Делаем поле необязательным, чтобы откат миграции мог вернуть колонку
+        migrations.AlterField(
+            model_name='book',
+            name='content',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RemoveField(
+            model_name='book',
+            name='content',
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:24
+
+from django.db import migrations, models, transaction
+
+
+def fill_text_counts(apps, schema_editor):
+    BookContent = apps.get_model('books', 'BookContent')
+    db_alias = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        batch = list(
+            BookContent.objects.using(db_alias)
+            .filter(book_id__gt=last_id)
+            .order_by('book_id')
+            .values_list('book_id', 'text')[:200]
+        )
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        with transaction.atomic(using=db_alias):
+            for book_id, text in batch:
+                BookContent.objects.using(db_alias).filter(book_id=book_id).update(
+                    char_count=len(text), word_count=len(text.split())
+                )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('books', '0014_remove_book_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookcontent',
+            name='char_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bookcontent',
+            name='storage',
+            field=models.CharField(choices=[('db', 'Database'), ('file', 'Compressed file')], default='db', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='bookcontent',
+            name='word_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_text_counts, migrations.RunPython.noop),
+    ]
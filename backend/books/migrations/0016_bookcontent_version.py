@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0015_bookcontent_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookcontent',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
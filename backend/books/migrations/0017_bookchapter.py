@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0016_bookcontent_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookChapter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=500)),
+                ('level', models.PositiveSmallIntegerField(default=1)),
+                ('start', models.IntegerField()),
+                ('end', models.IntegerField()),
+                ('start_word', models.IntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chapters', to='books.book')),
+            ],
+            options={
+                'ordering': ['book', 'number'],
+                'unique_together': {('book', 'number')},
+            },
+        ),
+    ]
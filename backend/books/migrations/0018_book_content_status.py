@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_ready_books(apps, schema_editor):
+    # Книги, у которых уже есть не пустой текст, считаются загруженными
+    Book = apps.get_model('books', 'Book')
+    BookContent = apps.get_model('books', 'BookContent')
+    db_alias = schema_editor.connection.alias
+
+    loaded = BookContent.objects.using(db_alias).filter(char_count__gte=100).values('book_id')
+    Book.objects.using(db_alias).filter(id__in=loaded).update(content_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0017_bookchapter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='content_status',
+            field=models.CharField(choices=[('missing', 'No text yet'), ('fetching', 'Fetching'), ('ready', 'Ready'), ('failed', 'Fetch failed')], default='missing', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='ContentFetchJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='content_jobs', to='books.book')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.RunPython(mark_ready_books, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0018_book_content_status'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='contentfetchjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('book',), name='books_one_active_content_job'),
+        ),
+    ]
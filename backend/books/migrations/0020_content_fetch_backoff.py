@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0019_content_job_single_flight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailingContentSource',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'failing content source',
+                'verbose_name_plural': 'failing content sources',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('books.book',),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='content_fetch_failures',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='content_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
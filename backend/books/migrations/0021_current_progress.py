@@ -0,0 +1,69 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_current_progress(apps, schema_editor):
+    # Текущая позиция = последнее событие прогресса каждой книги пользователя
+    ReadingProgress = apps.get_model('books', 'ReadingProgress')
+    CurrentProgress = apps.get_model('books', 'CurrentProgress')
+    db_alias = schema_editor.connection.alias
+
+    user_book_ids = list(
+        ReadingProgress.objects.using(db_alias).order_by('user_book_id')
+        .values_list('user_book_id', flat=True).distinct()
+    )
+    for i in range(0, len(user_book_ids), 500):
+        batch = user_book_ids[i:i + 500]
+        latest = {}
+        events = ReadingProgress.objects.using(db_alias).filter(user_book_id__in=batch).order_by('created_at', 'id')
+        for event in events.iterator():
+            latest[event.user_book_id] = event
+        CurrentProgress.objects.using(db_alias).bulk_create([
+            CurrentProgress(
+                user_book_id=event.user_book_id,
+                position=event.position,
+                current_page=event.current_page,
+                total_pages=event.total_pages,
+            )
+            for event in latest.values()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0020_content_fetch_backoff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentProgress',
+            fields=[
+                ('position', models.IntegerField()),
+                ('current_page', models.IntegerField(default=1)),
+                ('total_pages', models.IntegerField(default=1)),
+                ('user_book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='current_progress', serialize=False, to='books.userbook')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyReadingProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('marks_count', models.IntegerField(default=0)),
+                ('max_page', models.IntegerField(default=1)),
+                ('user_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_progress', to='books.userbook')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('user_book', 'date')},
+            },
+        ),
+        migrations.RunPython(fill_current_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0001_initial'),
+        ('books', '0021_current_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserReadingStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reading_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('books_read', models.IntegerField(default=0)),
+                ('pages_read', models.IntegerField(default=0)),
+                ('total_marks', models.IntegerField(default=0)),
+                ('reading_streak', models.IntegerField(default=0)),
+                ('last_read_date', models.DateField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyReadingActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('marks_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reading_activity', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('user', 'date')},
+            },
+        ),
+    ]
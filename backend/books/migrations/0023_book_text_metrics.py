@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+# Значения на момент миграции (books.models.STANDARD_WORDS_PER_PAGE, READING_WORDS_PER_MINUTE)
+WORDS_PER_PAGE = 300
+WORDS_PER_MINUTE = 200
+
+
+def fill_text_metrics(apps, schema_editor):
+    # Метрики считаются по уже записанным счетчикам текста, сам текст не читается
+    Book = apps.get_model('books', 'Book')
+    BookContent = apps.get_model('books', 'BookContent')
+    db_alias = schema_editor.connection.alias
+
+    for book_id, char_count, word_count in BookContent.objects.using(db_alias).values_list(
+        'book_id', 'char_count', 'word_count'
+    ).iterator():
+        Book.objects.using(db_alias).filter(pk=book_id).update(
+            word_count=word_count,
+            char_count=char_count,
+            estimated_pages=-(-word_count // WORDS_PER_PAGE),
+            reading_minutes=-(-word_count // WORDS_PER_MINUTE),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0022_reading_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='char_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='estimated_pages',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='reading_minutes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_text_metrics, migrations.RunPython.noop),
+    ]
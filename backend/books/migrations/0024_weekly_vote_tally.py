@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_weekly_tallies(apps, schema_editor):
+    # Итоги по неделям для уже отданных голосов
+    from collections import Counter
+    from datetime import timedelta
+    from django.utils import timezone
+
+    BookVote = apps.get_model('books', 'BookVote')
+    WeeklyVoteTally = apps.get_model('books', 'WeeklyVoteTally')
+    db_alias = schema_editor.connection.alias
+
+    tallies = Counter()
+    for book_id, created_at in BookVote.objects.using(db_alias).values_list('book_id', 'created_at').iterator():
+        day = timezone.localdate(created_at)
+        tallies[(book_id, day - timedelta(days=day.weekday()))] += 1
+
+    WeeklyVoteTally.objects.using(db_alias).bulk_create(
+        [WeeklyVoteTally(book_id=book_id, week_start=week, votes=votes) for (book_id, week), votes in tallies.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0023_book_text_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyVoteTally',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week_start', models.DateField()),
+                ('votes', models.IntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_tallies', to='books.book')),
+            ],
+            options={
+                'ordering': ['-week_start', '-votes'],
+                'indexes': [models.Index(fields=['week_start', '-votes'], name='books_weekly_votes_top')],
+                'unique_together': {('book', 'week_start')},
+            },
+        ),
+        migrations.RunPython(fill_weekly_tallies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:00
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_counted_pages(apps, schema_editor):
+    # Прочитанные книги уже учтены в pages_read с текущей оценкой страниц книги
+    Book = apps.get_model('books', 'Book')
+    UserBook = apps.get_model('books', 'UserBook')
+    db_alias = schema_editor.connection.alias
+
+    UserBook.objects.using(db_alias).filter(status='completed').update(
+        counted_pages=Subquery(Book.objects.filter(pk=OuterRef('book_id')).values('estimated_pages')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0024_weekly_vote_tally'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbook',
+            name='counted_pages',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counted_pages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:05
+
+from django.db import migrations
+
+
+def fill_age_category(apps, schema_editor):
+    # 0012 перенесла жанры в Genre, но возрастную категорию существующим книгам не проставила
+    from books.models import guess_age_category, split_genres
+
+    Book = apps.get_model('books', 'Book')
+    db_alias = schema_editor.connection.alias
+
+    books = Book.objects.using(db_alias).filter(age_category='').only('id', 'genre').prefetch_related('genres')
+    updates = {}
+    for book in books.iterator(chunk_size=500):
+        names = split_genres(book.genre) + [genre.name for genre in book.genres.all()]
+        age_category = guess_age_category(names)
+        if age_category:
+            updates.setdefault(age_category, []).append(book.pk)
+
+    for age_category, book_ids in updates.items():
+        for start in range(0, len(book_ids), 500):
+            Book.objects.using(db_alias).filter(pk__in=book_ids[start:start + 500]).update(age_category=age_category)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0025_userbook_counted_pages'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_age_category, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0026_backfill_age_category'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'id'], name='books_book_title_id'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-vote_count', 'id'], name='books_book_votes_id'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-rating_avg', 'id'], name='books_book_rating_id'),
+        ),
+    ]
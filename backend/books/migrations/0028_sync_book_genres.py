@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:10
+
+from django.db import migrations
+
+
+def sync_genres(apps, schema_editor):
+    # Книги из скриптов импорта, админки и ORM после 0012 остались без связей с Genre
+    from books.models import split_genres
+
+    Book = apps.get_model('books', 'Book')
+    Genre = apps.get_model('books', 'Genre')
+    db_alias = schema_editor.connection.alias
+
+    genre_ids = dict(Genre.objects.using(db_alias).values_list('name', 'id'))
+    books = Book.objects.using(db_alias).only('id', 'genre').prefetch_related('genres')
+    for book in books.iterator(chunk_size=500):
+        names = split_genres(book.genre)
+        if [genre.name for genre in book.genres.all()] == sorted(names):
+            continue
+        for name in names:
+            if name not in genre_ids:
+                genre_ids[name] = Genre.objects.using(db_alias).get_or_create(name=name)[0].pk
+        book.genres.set([genre_ids[name] for name in names])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0027_book_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(sync_genres, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:15
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def fill_read_at(apps, schema_editor):
+    # До этой миграции позиция записывалась в момент чтения
+    CurrentProgress = apps.get_model('books', 'CurrentProgress')
+    CurrentProgress.objects.using(schema_editor.connection.alias).update(read_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0028_sync_book_genres'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currentprogress',
+            name='read_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='readingprogress',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(fill_read_at, migrations.RunPython.noop),
+    ]
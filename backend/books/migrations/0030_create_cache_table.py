@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:25
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # Без REDIS_URL общий кеш хранится в таблице БД; существующие установки
+    # получают ее вместе с migrate, без отдельного createcachetable
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0029_progress_read_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
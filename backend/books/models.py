@@ -1,5 +1,46 @@
-from django.db import models
+from bisect import bisect_right
+from django.db import models, transaction
+from django.db.models import F, Value, FloatField, Count, Sum
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.conf import settings
+from django.utils import timezone
+
+# Плотность страницы и скорость чтения для метрик текста, хранимых в книге
+STANDARD_WORDS_PER_PAGE = 300
+READING_WORDS_PER_MINUTE = 200
+
+# Плотности страницы, которые может запросить читалка: каждая дает свой набор
+# ключей в кеше страниц, поэтому произвольные значения не принимаются
+WORDS_PER_PAGE_CHOICES = range(100, 1001, 50)
+
+# Жанры Флибусты, по которым можно определить возрастную категорию
+AGE_CATEGORY_GENRE_HINTS = {
+    '18+': ('эрот', 'erotica', 'love_hard', 'порно'),
+    '0+': ('сказк', 'child_tale', 'child_verse', 'для малышей'),
+    '6+': ('детск', 'child_', 'children'),
+    '12+': ('подростк', 'young adult', 'teen'),
+}
+
+
+def split_genres(genre_string):
+    """Split a source genre string ("Фантастика, Боевик") into unique names"""
+    if not genre_string:
+        return []
+    names = []
+    for name in genre_string.split(','):
+        name = name.strip()[:255]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def guess_age_category(genre_names):
+    """Best-effort age category from genre names, '' when unknown"""
+    lowered = [name.lower() for name in genre_names]
+    for age_category, hints in AGE_CATEGORY_GENRE_HINTS.items():
+        if any(hint in name for name in lowered for hint in hints):
+            return age_category
+    return ''
 
 class Author(models.Model):
     """Author model"""
@@ -12,25 +53,401 @@ class Author(models.Model):
     def __str__(self):
         return self.name
 
+class Genre(models.Model):
+    """Genre model (populated from Flibusta categories on import)"""
+    name = models.CharField(max_length=255, unique=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
+
 class Book(models.Model):
     """Book model"""
+    class AgeCategory(models.TextChoices):
+        ALL = '0+', '0+'
+        CHILDREN = '6+', '6+'
+        TEENS = '12+', '12+'
+        YOUNG_ADULTS = '16+', '16+'
+        ADULTS = '18+', '18+'
+    
+    class ContentStatus(models.TextChoices):
+        MISSING = 'missing', 'No text yet'
+        FETCHING = 'fetching', 'Fetching'
+        READY = 'ready', 'Ready'
+        FAILED = 'failed', 'Fetch failed'
+    
     title = models.CharField(max_length=255)
     author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='books')
     cover_url = models.URLField(max_length=500, null=True, blank=True)
     description = models.TextField(blank=True, null=True)
-    content = models.TextField()
-    genre = models.CharField(max_length=255, blank=True, null=True)
+    genre = models.CharField(max_length=255, blank=True, null=True)  # Исходная строка жанров из источника
+    genres = models.ManyToManyField(Genre, blank=True, related_name='books')
+    age_category = models.CharField(max_length=3, choices=AgeCategory.choices, blank=True, default='', db_index=True)
     published_date = models.DateField(null=True, blank=True)
     vote_count = models.IntegerField(default=0)
+    # Денормализованные агрегаты оценок пользователей (UserBook.rating)
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    rating_avg = models.FloatField(default=0.0, db_index=True)
     is_book_of_week = models.BooleanField(default=False)
     gutenberg_id = models.IntegerField(null=True, blank=True, unique=True)
     source_id = models.CharField(max_length=255, null=True, blank=True)  # ID книги во внешнем источнике (Флибуста, LibGen)
     source_type = models.CharField(max_length=50, null=True, blank=True)  # Тип источника: flibusta, libgen, google_books
+    content_status = models.CharField(max_length=10, choices=ContentStatus.choices, default=ContentStatus.MISSING)
+    # Неудачные загрузки текста подряд и время, раньше которого повторять не нужно
+    content_fetch_failures = models.PositiveIntegerField(default=0, db_index=True)
+    content_retry_at = models.DateTimeField(null=True, blank=True)
+    # Метрики текста, считаются один раз при записи текста (BookContent.store)
+    word_count = models.PositiveIntegerField(default=0)
+    char_count = models.PositiveIntegerField(default=0)
+    estimated_pages = models.PositiveIntegerField(default=0)  # При STANDARD_WORDS_PER_PAGE слов на странице
+    reading_minutes = models.PositiveIntegerField(default=0)  # При READING_WORDS_PER_MINUTE слов в минуту
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        # Порядки курсорной пагинации каталога (books/pagination.py CURSOR_SORTS): сортировка
+        # и условие "после курсора" идут по индексу, с id для равных значений
+        indexes = [
+            models.Index(fields=['title', 'id'], name='books_book_title_id'),
+            models.Index(fields=['-vote_count', 'id'], name='books_book_votes_id'),
+            models.Index(fields=['-rating_avg', 'id'], name='books_book_rating_id'),
+        ]
+    
     def __str__(self):
         return self.title
+    
+    @property
+    def content(self):
+        """Full text of the book, loaded lazily from BookContent"""
+        if hasattr(self, '_pending_content'):
+            return self._pending_content
+        if self.pk is None:
+            return ''
+        try:
+            return self.content_store.get_text()
+        except BookContent.DoesNotExist:
+            return ''
+    
+    @content.setter
+    def content(self, value):
+        # Текст сохраняется в BookContent при следующем save()
+        self._pending_content = value or ''
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Исходная строка жанров: связи с Genre пересобираются, только если она изменилась
+        if 'genre' in instance.__dict__:
+            instance._original_genre = instance.genre
+        return instance
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding:
+            genre_changed = bool(self.genre)
+        else:
+            genre_changed = (
+                hasattr(self, '_original_genre')
+                and (update_fields is None or 'genre' in update_fields)
+                and self._original_genre != self.genre
+            )
+        super().save(*args, **kwargs)
+        if genre_changed:
+            self.sync_genres()
+        if hasattr(self, '_pending_content'):
+            self.save_content(self._pending_content)
+    
+    def save_content(self, text, word_offsets=None, toc=None):
+        """Store the full text without rewriting the book row"""
+        self.__dict__.pop('_pending_content', None)
+        self.content_store = BookContent.store(self.pk, text, word_offsets=word_offsets, toc=toc)
+        for field, value in self.text_metrics(self.content_store.char_count, self.content_store.word_count).items():
+            setattr(self, field, value)
+    
+    @staticmethod
+    def text_metrics(char_count, word_count):
+        """Stored text metrics for a text of the given size"""
+        return {
+            'word_count': word_count,
+            'char_count': char_count,
+            'estimated_pages': -(-word_count // STANDARD_WORDS_PER_PAGE),
+            'reading_minutes': -(-word_count // READING_WORDS_PER_MINUTE),
+        }
+    
+    def page_count(self, words_per_page=STANDARD_WORDS_PER_PAGE):
+        """Number of reader pages at the given density (same as BookContent.total_pages)"""
+        return max(1, (self.word_count + words_per_page - 1) // words_per_page)
+    
+    @property
+    def primary_genre(self):
+        """First genre of the source ``genre`` string (the linked genres mirror it)"""
+        names = split_genres(self.genre)
+        return names[0] if names else ''
+    
+    def sync_genres(self):
+        """Link the book to the Genre rows parsed from its ``genre`` string.
+        
+        Called by save() whenever the string changes, so filtering by
+        ``genres__name`` always matches what primary_genre shows.
+        """
+        names = split_genres(self.genre)
+        genres = [Genre.objects.get_or_create(name=name)[0] for name in names]
+        self.genres.set(genres)
+        self._original_genre = self.genre
+        
+        if not self.age_category:
+            age_category = guess_age_category(names)
+            if age_category:
+                self.age_category = age_category
+                Book.objects.filter(pk=self.pk).update(age_category=age_category)
+    
+    @classmethod
+    def apply_rating_change(cls, book_id, old_rating=None, new_rating=None):
+        """Incrementally update rating aggregates when a user's rating changes"""
+        sum_delta = (new_rating or 0) - (old_rating or 0)
+        count_delta = (new_rating is not None) - (old_rating is not None)
+        if not sum_delta and not count_delta:
+            return
+        
+        new_sum = F('rating_sum') + sum_delta
+        new_count = F('rating_count') + count_delta
+        cls.objects.filter(pk=book_id).update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating_avg=Coalesce(
+                Cast(new_sum, FloatField()) / NullIf(new_count, 0),
+                Value(0.0)
+            )
+        )
+    
+    @classmethod
+    def recalculate_ratings(cls, queryset=None):
+        """Recompute rating aggregates from UserBook rows (backfill/repair)"""
+        queryset = cls.objects.all() if queryset is None else queryset
+        stats = UserBook.objects.filter(
+            book__in=queryset, rating__isnull=False
+        ).values('book_id').annotate(total=Sum('rating'), count=Count('rating'))
+        
+        for row in stats:
+            cls.objects.filter(pk=row['book_id']).update(
+                rating_sum=row['total'],
+                rating_count=row['count'],
+                rating_avg=row['total'] / row['count']
+            )
+        queryset.exclude(user_books__rating__isnull=False).update(rating_sum=0, rating_count=0, rating_avg=0.0)
+
+class BookContent(models.Model):
+    """Full text of a book, kept out of the books table so catalog queries stay small"""
+    class Storage(models.TextChoices):
+        DATABASE = 'db', 'Database'
+        FILE = 'file', 'Compressed file'
+    
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='content_store')
+    storage = models.CharField(max_length=10, choices=Storage.choices, default=Storage.DATABASE)
+    text = models.TextField(blank=True, default='')  # Используется только для storage=db
+    char_count = models.IntegerField(default=0)
+    word_count = models.IntegerField(default=0)
+    version = models.PositiveIntegerField(default=1)  # Увеличивается при каждой записи текста
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Content of {self.book_id}"
+    
+    @classmethod
+    def for_book(cls, book_id):
+        """Content row without the text column (loaded lazily only if needed)"""
+        return cls.objects.defer('text').filter(book_id=book_id).first()
+    
+    @classmethod
+    def store(cls, book_id, text, storage=None, word_offsets=None, toc=None):
+        """Write the text with the configured backend and return the BookContent row.
+        
+        ``word_offsets`` and ``toc`` may be passed when the parser already built
+        them while producing the text (see book_formats.ParsedBook.render).
+        Chapters are replaced only when ``toc`` is passed (an empty list clears
+        them): the same text rewritten without it, e.g. moved to another
+        storage, keeps its table of contents.
+        """
+        from . import content_store
+        
+        text = text or ''
+        storage = storage or getattr(settings, 'BOOK_CONTENT_STORAGE', cls.Storage.DATABASE)
+        
+        # Индекс позиций слов строится один раз при записи текста
+        if word_offsets is None:
+            word_offsets = content_store.build_word_offsets(text)
+        content_store.write_word_index(content_store.get_index_path(book_id), word_offsets)
+        
+        if storage == cls.Storage.FILE:
+            content_store.write_text(content_store.get_content_path(book_id), text)
+            stored_text = ''
+        else:
+            stored_text = text
+            content_store.delete_text(content_store.get_content_path(book_id))
+        
+        with transaction.atomic():
+            instance, created = cls.objects.update_or_create(
+                book_id=book_id,
+                defaults={
+                    'storage': storage,
+                    'text': stored_text,
+                    'char_count': len(text),
+                    'word_count': len(word_offsets),
+                }
+            )
+            if not created:
+                # Новая версия делает недействительными закешированные страницы
+                cls.objects.filter(pk=book_id).update(version=F('version') + 1)
+                instance.refresh_from_db(fields=['version'])
+            if toc is not None:
+                BookChapter.replace_for_book(book_id, toc)
+            content_status = Book.ContentStatus.MISSING if instance.is_placeholder else Book.ContentStatus.READY
+            Book.objects.filter(pk=book_id).update(
+                content_status=content_status,
+                **Book.text_metrics(instance.char_count, instance.word_count)
+            )
+        return instance
+    
+    def open_file(self):
+        """Memory-mapped reader for file storage"""
+        from . import content_store
+        return content_store.ChunkedText(content_store.get_content_path(self.book_id))
+    
+    def get_text(self):
+        if self.storage == self.Storage.FILE:
+            with self.open_file() as reader:
+                return reader.read_text()
+        return self.text
+    
+    def read_range(self, start, end):
+        """Characters [start, end) of the text; file storage decompresses only the needed chunks"""
+        if self.storage == self.Storage.FILE:
+            with self.open_file() as reader:
+                return reader.read_range(start, end)
+        return self.text[start:end]
+    
+    def open_word_index(self):
+        """Memory-mapped word offset index, built from the text on first use"""
+        from . import content_store
+        
+        path = content_store.get_index_path(self.book_id)
+        if not path.exists():
+            content_store.write_word_index(path, content_store.build_word_offsets(self.get_text()))
+        return content_store.WordIndex(path)
+    
+    def read_words(self, start, end):
+        """Words [start, end) of the text located through the word offset index"""
+        with self.open_word_index() as word_index:
+            char_start, char_end = word_index.char_range(start, end, self.char_count)
+        return self.read_range(char_start, char_end).split()
+    
+    def total_pages(self, words_per_page):
+        return max(1, (self.word_count + words_per_page - 1) // words_per_page)
+    
+    def position_for_page(self, page, words_per_page):
+        """Character position of the first word on the page"""
+        if page < 1:
+            return 0
+        start_word = (page - 1) * words_per_page
+        if start_word >= self.word_count:
+            return self.char_count
+        with self.open_word_index() as word_index:
+            return word_index[start_word]
+    
+    def page_for_position(self, position, words_per_page):
+        """Page containing the character position (binary search over word offsets)"""
+        if position <= 0:
+            return 1
+        with self.open_word_index() as word_index:
+            # Слово, в котором (или после которого) стоит позиция
+            word = bisect_right(word_index, position) - 1
+        return max(word, 0) // words_per_page + 1
+    
+    @property
+    def is_placeholder(self):
+        """True when there is no real text yet (empty or a short stub)"""
+        if self.char_count >= 4096:
+            return False
+        return len(self.get_text().strip()) < 100
+
+class BookChapter(models.Model):
+    """Table of contents entry: a chapter and its place in the book text"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='chapters')
+    number = models.PositiveIntegerField()  # Порядковый номер в оглавлении, с 1
+    title = models.CharField(max_length=500)
+    level = models.PositiveSmallIntegerField(default=1)  # Вложенность: часть > глава > подглава
+    start = models.IntegerField()  # Позиция первого символа главы в тексте
+    end = models.IntegerField()  # Позиция сразу после последнего символа главы
+    start_word = models.IntegerField()  # Номер первого слова главы (для перехода на страницу)
+    
+    class Meta:
+        unique_together = ('book', 'number')
+        ordering = ['book', 'number']
+    
+    def __str__(self):
+        return f"{self.book_id} #{self.number}: {self.title}"
+    
+    def page(self, words_per_page):
+        """Page the chapter starts on"""
+        return self.start_word // words_per_page + 1
+    
+    @classmethod
+    def replace_for_book(cls, book_id, toc):
+        """Replace the chapters of a book with book_formats.TocEntry items"""
+        cls.objects.filter(book_id=book_id).delete()
+        cls.objects.bulk_create([
+            cls(
+                book_id=book_id,
+                number=number,
+                title=entry.title[:500],
+                level=entry.level,
+                start=entry.start,
+                end=entry.end,
+                start_word=entry.start_word,
+            )
+            for number, entry in enumerate(toc, start=1)
+        ])
+
+class FailingContentSource(Book):
+    """Books whose text keeps failing to download (admin list)"""
+    class Meta:
+        proxy = True
+        verbose_name = 'failing content source'
+        verbose_name_plural = 'failing content sources'
+
+class ContentFetchJob(models.Model):
+    """Background download of a book text (see books/content_jobs.py)"""
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+    
+    ACTIVE_STATUSES = (Status.QUEUED, Status.RUNNING)
+    
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='content_jobs')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED, db_index=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # Single-flight: у книги не больше одной задачи в очереди или в работе
+            models.UniqueConstraint(
+                fields=['book'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='books_one_active_content_job',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Content job {self.pk} for {self.book_id}: {self.status}"
 
 class UserBook(models.Model):
     """User's book with status"""
@@ -44,6 +461,9 @@ class UserBook(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='user_books')
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.PLANNED)
     rating = models.IntegerField(null=True, blank=True)
+    # Сколько страниц книга добавила в pages_read при завершении (см. reading_stats):
+    # при выходе из "прочитано" вычитается ровно это число, даже если текст книги изменился
+    counted_pages = models.PositiveIntegerField(default=0, editable=False)
     added_at = models.DateTimeField(auto_now_add=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -53,17 +473,23 @@ class UserBook(models.Model):
     
     def __str__(self):
         return f"{self.user.username} - {self.book.title} ({self.status})"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходные оценку и статус, чтобы сигналы могли посчитать дельту
+        instance._original_rating = instance.__dict__.get('rating')
+        instance._original_status = instance.__dict__.get('status')
+        return instance
 
-class ReadingProgress(models.Model):
-    """Reading progress for a user book"""
-    user_book = models.ForeignKey(UserBook, on_delete=models.CASCADE, related_name='progress_marks')
+class PageProgress(models.Model):
+    """Position of a reader in a book"""
     position = models.IntegerField()  # Position in the text (character position)
     current_page = models.IntegerField(default=1)  # Current page number
     total_pages = models.IntegerField(default=1)  # Total pages in book
-    created_at = models.DateTimeField(auto_now_add=True)
     
-    def __str__(self):
-        return f"{self.user_book.user.username} - {self.user_book.book.title} - Page: {self.current_page}/{self.total_pages}"
+    class Meta:
+        abstract = True
     
     @property
     def progress_percentage(self):
@@ -72,6 +498,63 @@ class ReadingProgress(models.Model):
             return 0
         return min(100, (self.current_page / self.total_pages) * 100)
 
+class ReadingProgress(PageProgress):
+    """Reading progress event (history; old events are compacted into DailyReadingProgress)"""
+    user_book = models.ForeignKey(UserBook, on_delete=models.CASCADE, related_name='progress_marks')
+    created_at = models.DateTimeField(default=timezone.now)  # Когда читали (для офлайн-пачек - время клиента)
+    
+    def __str__(self):
+        return f"{self.user_book.user.username} - {self.user_book.book.title} - Page: {self.current_page}/{self.total_pages}"
+
+class CurrentProgress(PageProgress):
+    """Latest reading position, one row per user book (serves all "where am I" reads)"""
+    user_book = models.OneToOneField(UserBook, on_delete=models.CASCADE, primary_key=True, related_name='current_progress')
+    read_at = models.DateTimeField(default=timezone.now)  # Когда читатель был на этой позиции (время клиента для пачек)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user_book_id} - Page: {self.current_page}/{self.total_pages}"
+
+class DailyReadingProgress(models.Model):
+    """Daily rollup of compacted ReadingProgress events"""
+    user_book = models.ForeignKey(UserBook, on_delete=models.CASCADE, related_name='daily_progress')
+    date = models.DateField()
+    marks_count = models.IntegerField(default=0)  # Сколько событий прогресса было за день
+    max_page = models.IntegerField(default=1)  # Самая дальняя страница за день
+    
+    class Meta:
+        unique_together = ('user_book', 'date')
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"{self.user_book_id} {self.date}: {self.marks_count} marks"
+
+class UserReadingStats(models.Model):
+    """Reading statistics of a user, kept up to date by progress and status writes"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='reading_stats')
+    books_read = models.IntegerField(default=0)
+    pages_read = models.IntegerField(default=0)
+    total_marks = models.IntegerField(default=0)  # Сколько раз сохранялся прогресс
+    reading_streak = models.IntegerField(default=0)  # Дней чтения подряд до last_read_date включительно
+    last_read_date = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.books_read} books, {self.pages_read} pages"
+
+class DailyReadingActivity(models.Model):
+    """How many progress marks a user made on a given day"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='reading_activity')
+    date = models.DateField()
+    marks_count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('user', 'date')
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"{self.user_id} {self.date}: {self.marks_count} marks"
+
 class BookVote(models.Model):
     """User vote for a book"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='book_votes')
@@ -84,6 +567,23 @@ class BookVote(models.Model):
     def __str__(self):
         return f"{self.user.username} voted for {self.book.title}"
 
+class WeeklyVoteTally(models.Model):
+    """Votes a book got during one ISO week (maintained on vote and unvote)"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='weekly_tallies')
+    week_start = models.DateField()  # Понедельник недели
+    votes = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('book', 'week_start')
+        ordering = ['-week_start', '-votes']
+        indexes = [
+            # Топ книг недели читается по индексу
+            models.Index(fields=['week_start', '-votes'], name='books_weekly_votes_top'),
+        ]
+    
+    def __str__(self):
+        return f"{self.book_id} week of {self.week_start}: {self.votes} votes"
+
 class WeeklyBook(models.Model):
     """Book of the week model"""
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='weekly_selections')
@@ -0,0 +1,130 @@
+"""Кеш отрендеренных страниц читалки.
+
+Популярные страницы (особенно у книги недели) читают тысячи людей, а
+format_page_content каждый раз гоняет цепочку регулярных выражений.
+Готовые страницы кешируются по ключу (книга, версия текста,
+words_per_page, страница): сначала в ограниченном LRU внутри процесса,
+затем в общем для всех воркеров кеше Django. Версия текста (BookContent.version)
+меняется при каждой записи текста, поэтому старые страницы просто
+перестают находиться и вытесняются сами.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import paginate_stored_content
+
+CACHE_PREFIX = 'books:page'
+STATS_PREFIX = 'books:page_cache_stats'
+STATS_KEYS = ('local_hits', 'shared_hits', 'misses')
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кеш ограниченного размера"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local_cache = LRUCache(getattr(settings, 'READER_PAGE_CACHE_SIZE', 512))
+_local_stats = dict.fromkeys(STATS_KEYS, 0)
+_pending_stats = dict.fromkeys(STATS_KEYS, 0)
+_stats_lock = threading.Lock()
+
+# Общие счетчики обновляются пачками, чтобы попадание в локальный LRU
+# не требовало обращения к кешу Django
+STATS_FLUSH_EVERY = 50
+
+
+def _count(stat):
+    with _stats_lock:
+        _local_stats[stat] += 1
+        _pending_stats[stat] += 1
+        if sum(_pending_stats.values()) < STATS_FLUSH_EVERY:
+            return
+        pending = dict(_pending_stats)
+        for key in _pending_stats:
+            _pending_stats[key] = 0
+    _flush_stats(pending)
+
+
+def _flush_stats(pending):
+    # Общие счетчики приблизительные: incr атомарен в Redis, но в кеше в БД
+    # это чтение и запись, и параллельные сбросы могут потерять часть
+    # попаданий. Для статистики этого достаточно.
+    for stat, value in pending.items():
+        if not value:
+            continue
+        key = f'{STATS_PREFIX}:{stat}'
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            # Ключ успели вытеснить между add и incr
+            cache.set(key, value, timeout=None)
+
+
+def page_cache_key(book_id, version, words_per_page, page):
+    return f'{CACHE_PREFIX}:{book_id}:{version}:{words_per_page}:{page}'
+
+
+def get_page(content_store, page: int = 1, words_per_page: int = 300) -> dict:
+    """Страница книги в формате paginate_stored_content, по возможности из кеша"""
+    page = min(max(page, 1), content_store.total_pages(words_per_page))
+    key = page_cache_key(content_store.book_id, content_store.version, words_per_page, page)
+
+    data = _local_cache.get(key)
+    if data is not None:
+        _count('local_hits')
+        return data
+
+    data = cache.get(key)
+    if data is not None:
+        _count('shared_hits')
+    else:
+        _count('misses')
+        data = paginate_stored_content(content_store, page, words_per_page)
+        cache.set(key, data, getattr(settings, 'READER_PAGE_CACHE_TIMEOUT', 60 * 60))
+
+    _local_cache.set(key, data)
+    return data
+
+
+def get_stats() -> dict:
+    """Счетчики попаданий/промахов: этого процесса и суммарно по всем воркерам
+    (общие счетчики отстают не более чем на STATS_FLUSH_EVERY событий на воркер)"""
+    with _stats_lock:
+        process_stats = dict(_local_stats)
+    process_stats['local_size'] = len(_local_cache)
+
+    shared = cache.get_many([f'{STATS_PREFIX}:{stat}' for stat in STATS_KEYS])
+    shared_stats = {stat: shared.get(f'{STATS_PREFIX}:{stat}', 0) for stat in STATS_KEYS}
+
+    return {'process': process_stats, 'shared': shared_stats}
@@ -0,0 +1,104 @@
+"""Keyset (cursor) pagination for the book catalog.
+
+Instead of COUNT(*) + OFFSET, every page is fetched with a WHERE on the
+sort key of the last book seen, so deep pages cost the same as page 1.
+Cursors are opaque url-safe base64 strings with the sort mode, the sort
+key and the id of the last book on the previous page.
+"""
+
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Q
+
+# sortBy -> (field, descending); id always breaks ties
+CURSOR_SORTS = {
+    'newest': ('id', True),
+    'alphabet': ('title', False),
+    'rating': ('rating_avg', True),
+    'votes': ('vote_count', True),
+}
+DEFAULT_CURSOR_SORT = 'newest'
+
+# How long the total count of a filtered catalog is cached (seconds)
+TOTAL_COUNT_CACHE_TIMEOUT = 60
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor can't be decoded or doesn't match the sort"""
+
+
+def encode_cursor(sort_by, key, book_id):
+    payload = json.dumps({'s': sort_by, 'k': key, 'i': book_id}, separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        key, book_id = payload['k'], int(payload['i'])
+    except (ValueError, KeyError, TypeError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+    if payload.get('s') != sort_by:
+        raise InvalidCursor('Cursor does not match sortBy')
+    return key, book_id
+
+
+def get_sort_by(sort_by):
+    return sort_by if sort_by in CURSOR_SORTS else DEFAULT_CURSOR_SORT
+
+
+def order_queryset(queryset, sort_by):
+    field, descending = CURSOR_SORTS[sort_by]
+    if field == 'id':
+        return queryset.order_by('-id' if descending else 'id')
+    return queryset.order_by(f'-{field}' if descending else field, 'id')
+
+
+def _after_cursor(sort_by, key, book_id):
+    field, descending = CURSOR_SORTS[sort_by]
+    if field == 'id':
+        return Q(id__lt=book_id) if descending else Q(id__gt=book_id)
+    lookup = 'lt' if descending else 'gt'
+    return Q(**{f'{field}__{lookup}': key}) | Q(**{field: key, 'id__gt': book_id})
+
+
+def cached_total_count(queryset):
+    """Total number of rows for this filtered queryset, cached for a short time"""
+    sql, params = queryset.order_by().query.sql_with_params()
+    digest = hashlib.md5(f'{sql}|{params}'.encode('utf-8')).hexdigest()
+    cache_key = f'books:catalog_count:{digest}'
+    total = cache.get(cache_key)
+    if total is None:
+        total = queryset.count()
+        cache.set(cache_key, total, TOTAL_COUNT_CACHE_TIMEOUT)
+    return total
+
+
+def paginate_by_cursor(queryset, sort_by, cursor=None, limit=12):
+    """Return one page of the catalog as (books, next_cursor, total).
+
+    ``cursor`` is the value returned as next_cursor by the previous page
+    (empty for the first page). Raises InvalidCursor for a broken cursor.
+    """
+    sort_by = get_sort_by(sort_by)
+    total = cached_total_count(queryset)
+
+    queryset = order_queryset(queryset, sort_by)
+    if cursor:
+        key, book_id = decode_cursor(cursor, sort_by)
+        queryset = queryset.filter(_after_cursor(sort_by, key, book_id))
+
+    # One extra row tells us whether there is a next page
+    books = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(books) > limit:
+        books = books[:limit]
+        last = books[-1]
+        field = CURSOR_SORTS[sort_by][0]
+        next_cursor = encode_cursor(sort_by, getattr(last, field), last.id)
+
+    return books, next_cursor, total
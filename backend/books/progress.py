@@ -0,0 +1,228 @@
+"""Прогресс чтения: текущая позиция, история событий и дневные сводки.
+
+Каждое сохранение прогресса обновляет единственную строку CurrentProgress
+для UserBook (по ней отвечают все запросы "где я остановился") и добавляет
+событие в историю ReadingProgress. Периодическая задача
+(``manage.py compact_reading_progress``) сворачивает старые события в
+DailyReadingProgress - по строке на книгу пользователя за день, - так что
+история больше не растет без ограничений, а счетчики и серии дней чтения
+считаются по сводкам и недавним событиям вместе.
+
+Запись прогресса также обновляет готовую статистику пользователя
+(books/reading_stats.py).
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import reading_stats, signals
+from .models import Book, BookContent, CurrentProgress, DailyReadingProgress, ReadingProgress, UserBook
+
+# Сколько дней события хранятся как есть, прежде чем свернуться в дневную сводку
+DEFAULT_KEEP_DAYS = 7
+
+
+def update_current(user_book, position, current_page, total_pages):
+    """Обновляет текущую позицию читателя в книге"""
+    current, _ = CurrentProgress.objects.update_or_create(
+        user_book=user_book,
+        defaults={
+            'position': position,
+            'current_page': current_page,
+            'total_pages': total_pages,
+            'read_at': timezone.now(),
+        }
+    )
+    return current
+
+
+def record(user_book, position, current_page, total_pages):
+    """Сохраняет прогресс: событие в историю и новую текущую позицию"""
+    with transaction.atomic():
+        old_page = CurrentProgress.objects.filter(user_book=user_book).values_list('current_page', flat=True).first()
+        ReadingProgress.objects.create(
+            user_book=user_book,
+            position=position,
+            current_page=current_page,
+            total_pages=total_pages
+        )
+        current = update_current(user_book, position, current_page, total_pages)
+        mark_saved(user_book, old_page, current_page)
+        return current
+
+
+def mark_saved(user_book, old_page, new_page):
+    """Новая отметка прогресса уже записана: статистика и событие для достижений"""
+    reading_stats.on_progress(user_book, old_page, new_page)
+    signals.progress_saved.send(sender=UserBook, user_id=user_book.user_id, marks=1)
+
+
+def record_batch(user, events):
+    """Сохраняет пачку событий прогресса одного пользователя за одну транзакцию.
+
+    ``events`` - словари с book_id, current_page, total_pages, words_per_page
+    и client_timestamp. Из событий по одной книге применяется только самое
+    позднее по client_timestamp и только если оно новее сохраненной позиции
+    (CurrentProgress.read_at): запоздавшая офлайн-пачка не затирает то, что
+    уже прочитано дальше, а повторно отправленная не считается дважды.
+    Отметки засчитываются дням, когда читали, а не дню отправки. Без
+    total_pages число страниц берется из метрик книги. Возвращает (список
+    CurrentProgress всех книг пачки, id книг, которых нет в каталоге).
+    """
+    now = timezone.now()
+    latest = {}
+    for event in events:
+        # Часы клиента могут спешить: событие "из будущего" считается текущим
+        event = dict(event, client_timestamp=min(event['client_timestamp'], now))
+        seen = latest.get(event['book_id'])
+        if seen is None or event['client_timestamp'] >= seen['client_timestamp']:
+            latest[event['book_id']] = event
+
+    word_counts = dict(Book.objects.filter(id__in=latest).values_list('id', 'word_count'))
+    book_ids = set(word_counts)
+    missing = sorted(set(latest) - book_ids)
+    if not book_ids:
+        return [], missing
+
+    # Позиции в тексте считаются по индексу слов; сам текст не загружается
+    content_stores = {
+        content.book_id: content
+        for content in BookContent.objects.defer('text').filter(book_id__in=book_ids)
+    }
+    positions = {}
+    for book_id in book_ids:
+        event = latest[book_id]
+        content_store = content_stores.get(book_id)
+        positions[book_id] = (
+            content_store.position_for_page(event['current_page'], event['words_per_page'])
+            if content_store else 0
+        )
+
+    current_progress = CurrentProgress.objects.filter(user_book__user=user, user_book__book_id__in=book_ids)
+    with transaction.atomic():
+        read_at = dict(current_progress.select_for_update().values_list('user_book__book_id', 'read_at'))
+        book_ids = {
+            book_id for book_id in book_ids
+            if book_id not in read_at or latest[book_id]['client_timestamp'] > read_at[book_id]
+        }
+        if book_ids:
+            _apply_batch(user, latest, book_ids, positions, word_counts)
+
+    return list(current_progress.order_by('user_book__book_id')), missing
+
+
+def _apply_batch(user, latest, book_ids, positions, word_counts):
+    """Записывает события пачки, которые новее сохраненных позиций"""
+    # Состояние до записи - для дельты статистики (bulk-операции не шлют сигналы)
+    previous = {
+        book_id: (old_status, old_page, counted_pages)
+        for book_id, old_status, old_page, counted_pages in UserBook.objects.filter(user=user, book_id__in=book_ids)
+        .values_list('book_id', 'status', 'current_progress__current_page', 'counted_pages')
+    }
+
+    UserBook.objects.bulk_create(
+        [UserBook(user=user, book_id=book_id, status=UserBook.Status.READING) for book_id in book_ids],
+        ignore_conflicts=True,
+    )
+    user_books = UserBook.objects.filter(user=user, book_id__in=book_ids)
+    user_book_ids = dict(user_books.values_list('book_id', 'id'))
+    user_books.exclude(status=UserBook.Status.READING).update(status=UserBook.Status.READING, counted_pages=0)
+
+    rows = {
+        book_id: {
+            'user_book_id': user_book_ids[book_id],
+            'position': positions[book_id],
+            'current_page': latest[book_id]['current_page'],
+            'total_pages': latest[book_id].get('total_pages') or Book(
+                word_count=word_counts[book_id]
+            ).page_count(latest[book_id]['words_per_page']),
+        }
+        for book_id in sorted(book_ids)
+    }
+    ReadingProgress.objects.bulk_create([
+        ReadingProgress(**row, created_at=latest[book_id]['client_timestamp']) for book_id, row in rows.items()
+    ])
+    CurrentProgress.objects.bulk_create(
+        [CurrentProgress(**row, read_at=latest[book_id]['client_timestamp']) for book_id, row in rows.items()],
+        update_conflicts=True,
+        unique_fields=['user_book'],
+        update_fields=['position', 'current_page', 'total_pages', 'read_at', 'updated_at'],
+    )
+
+    books_read = pages_read = 0
+    marks_by_day = {}
+    for book_id in book_ids:
+        old_status, old_page, counted_pages = previous.get(book_id, (None, None, 0))
+        books_read -= old_status == UserBook.Status.COMPLETED
+        pages_read += (reading_stats.contribution(UserBook.Status.READING, latest[book_id]['current_page'])
+                       - reading_stats.contribution(old_status, old_page, counted_pages))
+        day = timezone.localdate(latest[book_id]['client_timestamp'])
+        marks_by_day[day] = marks_by_day.get(day, 0) + 1
+
+    reading_stats.apply(user.pk, books_read=books_read, pages_read=pages_read)
+    for day, marks in sorted(marks_by_day.items()):
+        reading_stats.apply(user.pk, marks=marks, day=day)
+    signals.progress_saved.send(
+        sender=UserBook,
+        user_id=user.pk,
+        marks=len(rows),
+        books_added=len(book_ids) - len(previous),
+        books_uncompleted=-books_read,
+    )
+
+
+def compact(keep_days=DEFAULT_KEEP_DAYS, batch_size=1000) -> int:
+    """Сворачивает события старше keep_days в дневные сводки. Возвращает число событий."""
+    cutoff = timezone.now() - timedelta(days=keep_days)
+    compacted = 0
+
+    while True:
+        with transaction.atomic():
+            # Пачка книг пользователей, у которых есть старые события
+            user_book_ids = list(
+                ReadingProgress.objects.filter(created_at__lt=cutoff)
+                .order_by('user_book_id').values_list('user_book_id', flat=True).distinct()[:batch_size]
+            )
+            if not user_book_ids:
+                break
+
+            events = ReadingProgress.objects.filter(user_book_id__in=user_book_ids, created_at__lt=cutoff)
+            rows = list(
+                events.annotate(date=TruncDate('created_at'))
+                .values('user_book_id', 'date')
+                .annotate(marks_count=Count('id'), max_page=Max('current_page'))
+                .order_by()
+            )
+
+            existing = {
+                (rollup.user_book_id, rollup.date): rollup
+                for rollup in DailyReadingProgress.objects.select_for_update().filter(
+                    user_book_id__in=user_book_ids,
+                    date__in={row['date'] for row in rows},
+                )
+            }
+            to_create, to_update = [], []
+            for row in rows:
+                rollup = existing.get((row['user_book_id'], row['date']))
+                if rollup is None:
+                    to_create.append(DailyReadingProgress(
+                        user_book_id=row['user_book_id'],
+                        date=row['date'],
+                        marks_count=row['marks_count'],
+                        max_page=row['max_page'],
+                    ))
+                else:
+                    rollup.marks_count += row['marks_count']
+                    rollup.max_page = max(rollup.max_page, row['max_page'])
+                    to_update.append(rollup)
+
+            DailyReadingProgress.objects.bulk_create(to_create)
+            DailyReadingProgress.objects.bulk_update(to_update, ['marks_count', 'max_page'])
+            deleted, _ = events.delete()
+            compacted += deleted
+
+    return compacted
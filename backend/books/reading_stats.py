@@ -0,0 +1,215 @@
+"""Статистика чтения пользователя, обновляемая инкрементально.
+
+Строка UserReadingStats хранит готовые books_read, pages_read, total_marks
+и текущую серию дней чтения, а DailyReadingActivity - сколько раз
+пользователь отмечал прогресс в каждый день. Обе таблицы обновляются
+при записи прогресса и смене статуса книги (см. books/progress.py и
+books/signals.py), поэтому запрос статистики - это чтение одной строки.
+
+pages_read складывается из вкладов книг пользователя: прочитанная книга
+дает оценку числа своих страниц, читаемая - текущую страницу, остальные -
+ноль. При любой записи к счетчику прибавляется разница вкладов до и после.
+Вклад прочитанной книги запоминается в UserBook.counted_pages в момент
+завершения, и при выходе из "прочитано" вычитается именно он: оценка
+страниц книги могла измениться вместе с ее текстом.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    Book, CurrentProgress, DailyReadingActivity, DailyReadingProgress,
+    ReadingProgress, UserBook, UserReadingStats,
+)
+
+# 4 отметки прогресса = 1 час чтения
+MARKS_PER_HOUR = 4
+
+
+def estimated_pages(book_id) -> int:
+    """Оценка числа страниц книги (0, если текста нет) - хранится в самой книге"""
+    return Book.objects.filter(pk=book_id).values_list('estimated_pages', flat=True).first() or 0
+
+
+def contribution(status, current_page, counted_pages=0) -> int:
+    """Сколько страниц книга пользователя добавляет в pages_read (counted_pages - для прочитанной)"""
+    if status == UserBook.Status.COMPLETED:
+        return counted_pages or 0
+    if status == UserBook.Status.READING:
+        return current_page or 0
+    return 0
+
+
+def _current_page(user_book_id):
+    return CurrentProgress.objects.filter(user_book_id=user_book_id).values_list('current_page', flat=True).first()
+
+
+def _streak(days):
+    """(серия, последний день чтения): число подряд идущих дней, заканчивающихся последним"""
+    reading_streak = 0
+    last_read_date = None
+    for day in sorted(days, reverse=True):
+        if last_read_date is None:
+            last_read_date = day
+            reading_streak = 1
+        elif day == last_read_date - timedelta(days=reading_streak):
+            reading_streak += 1
+        else:
+            break
+    return reading_streak, last_read_date
+
+
+def apply(user_id, books_read=0, pages_read=0, marks=0, day=None):
+    """Прибавляет дельты к статистике пользователя; отметки засчитываются дню ``day``
+    (по умолчанию - сегодняшнему).
+
+    Строка статистики здесь не создается: ее строит rebuild() при первом
+    чтении, так что до этого момента достаточно вести дневную активность.
+    """
+    with transaction.atomic():
+        if marks:
+            day = day or timezone.localdate()
+            activity, created = DailyReadingActivity.objects.get_or_create(
+                user_id=user_id, date=day, defaults={'marks_count': marks}
+            )
+            if not created:
+                DailyReadingActivity.objects.filter(pk=activity.pk).update(marks_count=F('marks_count') + marks)
+
+        stats = UserReadingStats.objects.select_for_update().filter(user_id=user_id).first()
+        if stats is None:
+            return
+
+        stats.books_read += books_read
+        stats.pages_read += pages_read
+        stats.total_marks += marks
+        if marks:
+            # Серия продолжается, если вчера тоже читали
+            if stats.last_read_date == day:
+                pass
+            elif stats.last_read_date == day - timedelta(days=1):
+                stats.reading_streak += 1
+                stats.last_read_date = day
+            elif stats.last_read_date is None or stats.last_read_date < day:
+                stats.reading_streak = 1
+                stats.last_read_date = day
+            else:
+                # Отметка задним числом (офлайн-пачка) может соединить две серии
+                stats.reading_streak, stats.last_read_date = _streak(
+                    DailyReadingActivity.objects.filter(user_id=user_id).values_list('date', flat=True)
+                )
+        stats.save()
+
+
+def on_status_change(user_book, old_status, new_status):
+    """Смена статуса книги пользователя (в том числе добавление и удаление)"""
+    if old_status == new_status:
+        return
+    page = _current_page(user_book.pk) if user_book.pk else None
+    old_counted = user_book.counted_pages
+    new_counted = estimated_pages(user_book.book_id) if new_status == UserBook.Status.COMPLETED else 0
+    if new_status is not None and new_counted != old_counted:
+        UserBook.objects.filter(pk=user_book.pk).update(counted_pages=new_counted)
+        user_book.counted_pages = new_counted
+    apply(
+        user_book.user_id,
+        books_read=(new_status == UserBook.Status.COMPLETED) - (old_status == UserBook.Status.COMPLETED),
+        pages_read=(contribution(new_status, page, new_counted)
+                    - contribution(old_status, page, old_counted)),
+    )
+
+
+def _marks_by_day(**filters) -> dict:
+    """Отметки прогресса по дням: недавние события и свернутые сводки (см. progress.compact)"""
+    activity = dict(
+        ReadingProgress.objects.filter(**filters)
+        .annotate(date=TruncDate('created_at')).values('date')
+        .annotate(marks=Count('id')).order_by().values_list('date', 'marks')
+    )
+    for day, marks in (
+        DailyReadingProgress.objects.filter(**filters).values('date')
+        .annotate(marks=Sum('marks_count')).order_by().values_list('date', 'marks')
+    ):
+        activity[day] = activity.get(day, 0) + marks
+    return activity
+
+
+def on_remove(user_book):
+    """Книга удаляется из библиотеки вместе со своей историей прогресса"""
+    on_status_change(user_book, getattr(user_book, '_original_status', user_book.status), None)
+
+    removed = _marks_by_day(user_book=user_book)
+    if not removed:
+        return
+    with transaction.atomic():
+        for day, marks in removed.items():
+            DailyReadingActivity.objects.filter(user_id=user_book.user_id, date=day).update(
+                marks_count=F('marks_count') - marks
+            )
+        DailyReadingActivity.objects.filter(user_id=user_book.user_id, marks_count__lte=0).delete()
+        UserReadingStats.objects.filter(user_id=user_book.user_id).update(
+            total_marks=F('total_marks') - sum(removed.values())
+        )
+
+
+def on_progress(user_book, old_page, new_page, marks=1):
+    """Новая отметка прогресса в книге"""
+    pages_read = 0
+    if user_book.status == UserBook.Status.READING:
+        pages_read = (new_page or 0) - (old_page or 0)
+    apply(user_book.user_id, pages_read=pages_read, marks=marks)
+
+
+def rebuild(user) -> UserReadingStats:
+    """Полностью пересчитывает статистику и дневную активность пользователя (объект или id)"""
+    user_id = getattr(user, 'pk', user)
+    with transaction.atomic():
+        activity = _marks_by_day(user_book__user_id=user_id)
+
+        DailyReadingActivity.objects.filter(user_id=user_id).delete()
+        DailyReadingActivity.objects.bulk_create([
+            DailyReadingActivity(user_id=user_id, date=day, marks_count=marks)
+            for day, marks in activity.items()
+        ])
+
+        pages_read = CurrentProgress.objects.filter(
+            user_book__user_id=user_id, user_book__status=UserBook.Status.READING
+        ).aggregate(pages=Sum('current_page'))['pages'] or 0
+        completed = UserBook.objects.filter(user_id=user_id, status=UserBook.Status.COMPLETED)
+        pages_read += completed.aggregate(pages=Sum('counted_pages'))['pages'] or 0
+
+        reading_streak, last_read_date = _streak(activity)
+
+        stats, _ = UserReadingStats.objects.update_or_create(
+            user_id=user_id,
+            defaults={
+                'books_read': completed.count(),
+                'pages_read': pages_read,
+                'total_marks': sum(activity.values()),
+                'reading_streak': reading_streak,
+                'last_read_date': last_read_date,
+            }
+        )
+    return stats
+
+
+def get_stats(user) -> dict:
+    """Статистика для профиля и страницы статистики (одна строка из БД); user - объект или id"""
+    stats = UserReadingStats.objects.filter(user_id=getattr(user, 'pk', user)).first() or rebuild(user)
+
+    # Серия прерывается, если последний день чтения раньше вчерашнего
+    today = timezone.localdate()
+    reading_streak = stats.reading_streak
+    if stats.last_read_date is None or (today - stats.last_read_date).days > 1:
+        reading_streak = 0
+
+    return {
+        'books_read': stats.books_read,
+        'pages_read': stats.pages_read,
+        'reading_streak': reading_streak,
+        'total_hours': max(0, stats.total_marks // MARKS_PER_HOUR),
+        'total_marks': stats.total_marks,
+    }
@@ -0,0 +1,170 @@
+"""Полнотекстовый поиск по каталогу книг.
+
+Индекс хранится на стороне БД: в SQLite это виртуальная таблица FTS5,
+в PostgreSQL - таблица с колонкой tsvector и GIN-индексом. Индекс
+покрывает название книги, имя автора и аннотацию и синхронизируется
+сигналами при сохранении книги/автора (см. books/signals.py).
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q, Value
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'books_book_search'
+
+# Слова запроса: буквы/цифры любых алфавитов
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported(conn=None) -> bool:
+    """Есть ли для текущей БД реализация поискового индекса"""
+    conn = conn or connection
+    return conn.vendor in ('sqlite', 'postgresql')
+
+
+def create_index(conn=None):
+    """Создает таблицу поискового индекса (используется миграцией)"""
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                "title, author, description, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        elif conn.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                "book_id bigint PRIMARY KEY REFERENCES books_book(id) ON DELETE CASCADE, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx "
+                f"ON {SEARCH_TABLE} USING GIN (document)"
+            )
+
+
+def drop_index(conn=None):
+    """Удаляет таблицу поискового индекса"""
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def _document_params(title, author, description):
+    return [title or '', author or '', description or '']
+
+
+def index_book(book_id, title, author, description, conn=None):
+    """Добавляет или обновляет запись книги в поисковом индексе"""
+    conn = conn or connection
+    params = _document_params(title, author, description)
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [book_id])
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, title, author, description) VALUES (%s, %s, %s, %s)",
+                [book_id] + params
+            )
+        elif conn.vendor == 'postgresql':
+            # Название весит больше автора, автор - больше аннотации
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (book_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'B') || "
+                "setweight(to_tsvector('simple', %s), 'C')) "
+                "ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document",
+                [book_id] + params
+            )
+
+
+def remove_book(book_id, conn=None):
+    """Удаляет книгу из поискового индекса"""
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    column = 'rowid' if conn.vendor == 'sqlite' else 'book_id'
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE {column} = %s", [book_id])
+
+
+def index_book_instance(book):
+    """Индексирует экземпляр Book (автор подтягивается одним запросом)"""
+    if not is_supported():
+        return
+    author_name = book.author.name if book.author_id else ''
+    index_book(book.pk, book.title, author_name, book.description)
+
+
+def rebuild_index(batch_size=500):
+    """Полностью перестраивает индекс по всем книгам. Возвращает число книг."""
+    from .models import Book
+
+    if not is_supported():
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+    count = 0
+    rows = Book.objects.order_by('id').values_list('id', 'title', 'author__name', 'description')
+    for book_id, title, author_name, description in rows.iterator(chunk_size=batch_size):
+        index_book(book_id, title, author_name, description)
+        count += 1
+    return count
+
+
+def build_match_query(search: str, vendor: str) -> str:
+    """Строит безопасный запрос MATCH/tsquery из пользовательской строки.
+
+    Каждое слово ищется как префикс, слова объединяются через AND -
+    так поиск работает "по мере набора" в строке поиска.
+    """
+    tokens = _TOKEN_RE.findall(search.lower())
+    if not tokens:
+        return ''
+    if vendor == 'postgresql':
+        return ' & '.join(f"{token}:*" for token in tokens)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def filter_queryset(queryset, search: str):
+    """Ограничивает queryset книгами, найденными в индексе, и добавляет
+    аннотацию ``search_rank`` (меньше - релевантнее).
+
+    Сам индекс возвращает только id, поэтому объекты Book загружаются
+    лишь для той страницы, которую вернет пагинатор.
+    """
+    vendor = connection.vendor
+    if not is_supported():
+        return queryset.filter(
+            Q(title__icontains=search) |
+            Q(author__name__icontains=search) |
+            Q(description__icontains=search)
+        ).annotate(search_rank=Value(0))
+
+    match = build_match_query(search, vendor)
+    if not match:
+        return queryset.annotate(search_rank=Value(0)).none()
+
+    if vendor == 'sqlite':
+        # bm25 с весами колонок: название, автор, аннотация
+        rank_sql = (
+            f"SELECT bm25({SEARCH_TABLE}, 10.0, 5.0, 1.0) FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = books_book.id"
+        )
+        ids_sql = f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+    else:
+        rank_sql = (
+            f"SELECT -ts_rank(document, to_tsquery('simple', %s)) FROM {SEARCH_TABLE} "
+            f"WHERE book_id = books_book.id"
+        )
+        ids_sql = f"SELECT book_id FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('simple', %s)"
+
+    return queryset.filter(id__in=RawSQL(ids_sql, [match])).annotate(
+        search_rank=RawSQL(rank_sql, [match])
+    )
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Book, Author, UserBook, ReadingProgress
+from .models import Book, BookChapter, Author, UserBook, ReadingProgress, STANDARD_WORDS_PER_PAGE, WORDS_PER_PAGE_CHOICES
 
 class AuthorSerializer(serializers.ModelSerializer):
     """Serializer for the Author model"""
@@ -15,6 +15,8 @@ class BookSerializer(serializers.ModelSerializer):
         source='author',
         write_only=True
     )
+    # Текст хранится в BookContent, Book.content - ленивое свойство
+    content = serializers.CharField(required=False, allow_blank=True)
     
     class Meta:
         model = Book
@@ -28,8 +30,9 @@ class BookListSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Book
-        fields = ['id', 'title', 'author', 'cover_url', 'description', 'published_date']
-        read_only_fields = ['id']
+        fields = ['id', 'title', 'author', 'cover_url', 'description', 'published_date',
+                  'word_count', 'estimated_pages', 'reading_minutes']
+        read_only_fields = ['id', 'word_count', 'estimated_pages', 'reading_minutes']
 
 class BookFrontendSerializer(serializers.ModelSerializer):
     """Serializer for frontend compatibility"""
@@ -41,40 +44,30 @@ class BookFrontendSerializer(serializers.ModelSerializer):
     rating = serializers.SerializerMethodField()
     vote_count = serializers.IntegerField(read_only=True)
     is_book_of_week = serializers.BooleanField(read_only=True)
+    # Метрики текста хранятся в книге, текст для карточки не читается
+    word_count = serializers.IntegerField(read_only=True)
+    estimated_pages = serializers.IntegerField(read_only=True)
+    reading_minutes = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Book
         fields = ['id', 'title', 'author', 'cover', 'genre', 'ageCategory', 
-                  'description', 'isPremium', 'rating', 'vote_count', 'is_book_of_week']
+                  'description', 'isPremium', 'rating', 'vote_count', 'is_book_of_week',
+                  'word_count', 'estimated_pages', 'reading_minutes']
     
     def get_genre(self, obj):
-        # Возвращаем разные жанры для разнообразия
-        genres = [
-            "Художественная литература",
-            "Фантастика", 
-            "Детектив",
-            "Роман",
-            "Классика",
-            "Приключения",
-            "Драма",
-            "Фэнтези"
-        ]
-        return genres[obj.id % len(genres)]
+        return obj.primary_genre
     
     def get_ageCategory(self, obj):
-        # Возвращаем разные возрастные категории для разнообразия
-        age_categories = ["0+", "6+", "12+", "16+", "18+"]
-        return age_categories[obj.id % len(age_categories)]
+        return obj.age_category
     
     def get_isPremium(self, obj):
         # Возвращаем False по умолчанию, можно добавить поле в модель позже
         return False
     
     def get_rating(self, obj):
-        # Вычисляем средний рейтинг на основе пользовательских оценок
-        from django.db.models import Avg
-        avg_rating = obj.user_books.filter(rating__isnull=False).aggregate(Avg('rating'))['rating__avg']
-        return round(avg_rating, 1) if avg_rating else 0.0
+        # Средний рейтинг хранится в книге и обновляется при каждой оценке
+        return round(obj.rating_avg, 1)
 
 class UserBookSerializer(serializers.ModelSerializer):
     """Serializer for the UserBook model"""
@@ -102,4 +95,23 @@ class ReadingProgressSerializer(serializers.ModelSerializer):
     class Meta:
         model = ReadingProgress
         fields = ['id', 'user_book', 'position', 'current_page', 'total_pages', 'progress_percentage', 'created_at']
-        read_only_fields = ['id', 'progress_percentage', 'created_at']
\ No newline at end of file
+        read_only_fields = ['id', 'progress_percentage', 'created_at']
+
+class ProgressEventSerializer(serializers.Serializer):
+    """One page turn sent by the reader in a batch"""
+    book_id = serializers.IntegerField()
+    current_page = serializers.IntegerField(min_value=1)
+    total_pages = serializers.IntegerField(min_value=1, required=False)  # По умолчанию - из метрик книги
+    words_per_page = serializers.ChoiceField(choices=list(WORDS_PER_PAGE_CHOICES), default=STANDARD_WORDS_PER_PAGE)
+    client_timestamp = serializers.DateTimeField()
+
+class BookChapterSerializer(serializers.ModelSerializer):
+    """Serializer for table of contents entries; page depends on words_per_page in context"""
+    page = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = BookChapter
+        fields = ['number', 'title', 'level', 'start', 'end', 'page']
+    
+    def get_page(self, obj):
+        return obj.page(self.context.get('words_per_page', 300))
@@ -0,0 +1,98 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import Signal, receiver
+from .models import Book, BookContent, Author, UserBook
+from . import search, content_store, reading_stats
+
+# Domain events of the user library for other apps (e.g. achievements).
+# They are sent synchronously from the model signals of the write. Library and
+# progress views and books.progress wrap their writes in transaction.atomic(),
+# so there the handlers commit or roll back together with the write; elsewhere
+# (admin, shell) each handler only has its own atomic block.
+# user_book, created, old_status, old_rating
+user_book_changed = Signal()
+# user_book (sent before the row and its progress are deleted)
+user_book_removed = Signal()
+# user_id, marks, books_added, books_uncompleted (books created or moved
+# out of "completed" by bulk progress writes, which do not send the above)
+progress_saved = Signal()
+
+
+@receiver(post_save, sender=Book)
+def update_book_search_index(sender, instance, raw=False, **kwargs):
+    """Keep the full-text search index in sync with the book"""
+    if raw:
+        return
+    search.index_book_instance(instance)
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_search_index(sender, instance, **kwargs):
+    search.remove_book(instance.pk)
+
+
+@receiver(post_save, sender=Author)
+def update_author_books_search_index(sender, instance, created=False, raw=False, **kwargs):
+    """Author name is part of the search document of every author's book"""
+    if raw or created or not search.is_supported():
+        return
+    for book_id, title, description in instance.books.values_list('id', 'title', 'description'):
+        search.index_book(book_id, title, instance.name, description)
+
+
+@receiver(post_save, sender=UserBook)
+def update_book_rating_on_save(sender, instance, raw=False, **kwargs):
+    """Apply the rating delta of this UserBook to the book aggregates"""
+    if raw:
+        return
+    old_rating = getattr(instance, '_original_rating', None)
+    Book.apply_rating_change(instance.book_id, old_rating, instance.rating)
+
+
+@receiver(post_delete, sender=UserBook)
+def update_book_rating_on_delete(sender, instance, **kwargs):
+    old_rating = getattr(instance, '_original_rating', instance.rating)
+    Book.apply_rating_change(instance.book_id, old_rating, None)
+
+
+@receiver(post_save, sender=UserBook)
+def update_reading_stats_on_save(sender, instance, created=False, raw=False, **kwargs):
+    """Books read and pages read change with the status of a UserBook"""
+    if raw:
+        return
+    old_status = None if created else getattr(instance, '_original_status', instance.status)
+    reading_stats.on_status_change(instance, old_status, instance.status)
+
+
+@receiver(post_save, sender=UserBook)
+def send_user_book_changed(sender, instance, created=False, raw=False, **kwargs):
+    """Runs after the receivers above: they read the original values reset here.
+    
+    The event is sent in the caller's transaction, if there is one; the library
+    views open it with transaction.atomic() around the write.
+    """
+    if raw:
+        return
+    user_book_changed.send(
+        sender=UserBook,
+        user_book=instance,
+        created=created,
+        old_status=None if created else getattr(instance, '_original_status', instance.status),
+        old_rating=None if created else getattr(instance, '_original_rating', None),
+    )
+    instance._original_rating = instance.rating
+    instance._original_status = instance.status
+
+
+@receiver(pre_delete, sender=UserBook)
+def update_reading_stats_on_delete(sender, instance, **kwargs):
+    # pre_delete: текущая страница и история прогресса удаляются каскадом вместе с книгой
+    reading_stats.on_remove(instance)
+    user_book_removed.send(sender=UserBook, user_book=instance)
+
+
+@receiver(post_delete, sender=BookContent)
+def delete_book_content_file(sender, instance, **kwargs):
+    content_store.delete_text(content_store.get_index_path(instance.book_id))
+    if instance.storage == BookContent.Storage.FILE:
+        content_store.delete_text(content_store.get_content_path(instance.book_id))
+    Book.objects.filter(pk=instance.book_id).update(**Book.text_metrics(0, 0))
@@ -1,3 +1,803 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import content_jobs, content_store, page_cache, progress, reading_stats, vote_stream
+from . import search as book_search
+from . import votes as book_votes
+from .book_formats import parse_epub, parse_fb2
+from .models import (
+    Author, Book, BookContent, BookVote, ContentFetchJob, CurrentProgress, DailyReadingActivity, DailyReadingProgress,
+    ReadingProgress, UserBook, WeeklyBook,
+)
+from .pagination import order_queryset, paginate_by_cursor
+
+
+def words(count, prefix='w'):
+    """Text of ``count`` words of different lengths"""
+    return ' '.join(f'{prefix}{i}' * (i % 3 + 1) for i in range(count))
+
+
+class TempContentRootMixin:
+    """Book texts and word indexes are written to a temporary directory"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.content_root = tempfile.mkdtemp()
+        cls.content_settings = override_settings(BOOK_CONTENT_ROOT=Path(cls.content_root))
+        cls.content_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.content_settings.disable()
+        shutil.rmtree(cls.content_root, ignore_errors=True)
+
+
+class ChunkedTextTests(TempContentRootMixin, SimpleTestCase):
+    def setUp(self):
+        self.text = words(500)
+        self.path = Path(self.content_root) / 'chunked.bkc'
+        self.chunks = content_store.split_chunks(self.text, chunk_chars=64)
+
+    def test_chunks_end_on_whitespace(self):
+        self.assertGreater(len(self.chunks), 10)
+        self.assertEqual(''.join(chunk for chunk, _, _ in self.chunks), self.text)
+        for chunk, char_offset, word_offset in self.chunks[1:]:
+            self.assertTrue(self.text[char_offset].isspace())
+            self.assertEqual(word_offset, len(self.text[:char_offset].split()))
+
+    def test_write_text_counts(self):
+        char_count, word_count = content_store.write_text(self.path, self.text, chunk_chars=64)
+
+        self.assertEqual(char_count, len(self.text))
+        self.assertEqual(word_count, 500)
+        with content_store.ChunkedText(self.path) as reader:
+            self.assertEqual(reader.chunk_count, len(self.chunks))
+            self.assertEqual((reader.char_count, reader.word_count), (char_count, word_count))
+            self.assertEqual(reader.read_text(), self.text)
+
+    def test_read_range_across_chunk_boundaries(self):
+        content_store.write_text(self.path, self.text, chunk_chars=64)
+        boundaries = [char_offset for _, char_offset, _ in self.chunks[1:]]
+
+        with content_store.ChunkedText(self.path) as reader:
+            for boundary in boundaries:
+                for start, end in ((boundary - 1, boundary + 1), (boundary, boundary + 1),
+                                   (boundary - 5, boundary), (boundary - 70, boundary + 70)):
+                    self.assertEqual(reader.read_range(start, end), self.text[max(0, start):end])
+            # Диапазон через несколько блоков и весь текст
+            self.assertEqual(reader.read_range(boundaries[1] - 3, boundaries[5] + 3),
+                             self.text[boundaries[1] - 3:boundaries[5] + 3])
+            self.assertEqual(reader.read_range(0, len(self.text)), self.text)
+
+    def test_read_range_clamps_to_text(self):
+        content_store.write_text(self.path, self.text, chunk_chars=64)
+
+        with content_store.ChunkedText(self.path) as reader:
+            self.assertEqual(reader.read_range(-10, 5), self.text[:5])
+            self.assertEqual(reader.read_range(len(self.text) - 3, len(self.text) + 100), self.text[-3:])
+            self.assertEqual(reader.read_range(20, 20), '')
+            self.assertEqual(reader.read_range(30, 10), '')
+
+    def test_empty_text(self):
+        self.assertEqual(content_store.write_text(self.path, ''), (0, 0))
+        with content_store.ChunkedText(self.path) as reader:
+            self.assertEqual(reader.read_text(), '')
+            self.assertEqual(reader.read_range(0, 10), '')
+
+
+class PagePositionTests(TempContentRootMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Author')
+
+    def store(self, storage, text):
+        book = Book.objects.create(title=f'Book {storage}', author=self.author)
+        return BookContent.store(book.pk, text, storage=storage)
+
+    def test_round_trip(self):
+        text = words(1000)
+        starts = content_store.build_word_offsets(text)
+        for storage in BookContent.Storage.values:
+            content = self.store(storage, text)
+            for words_per_page in (1, 7, 300):
+                total_pages = content.total_pages(words_per_page)
+                with self.subTest(storage=storage, words_per_page=words_per_page):
+                    for page in range(1, total_pages + 1):
+                        position = content.position_for_page(page, words_per_page)
+                        self.assertEqual(position, starts[(page - 1) * words_per_page])
+                        self.assertEqual(content.page_for_position(position, words_per_page), page)
+                        # Позиция внутри первого слова страницы - та же страница
+                        self.assertEqual(content.page_for_position(position + 1, words_per_page), page)
+
+    def test_page_boundaries(self):
+        content = self.store(BookContent.Storage.FILE, words(10))
+
+        self.assertEqual(content.position_for_page(0, 3), 0)
+        self.assertEqual(content.position_for_page(5, 3), content.char_count)
+        self.assertEqual(content.page_for_position(0, 3), 1)
+        self.assertEqual(content.page_for_position(content.char_count, 3), content.total_pages(3))
+
+    def test_page_text_matches_word_range(self):
+        text = words(100)
+        content = self.store(BookContent.Storage.FILE, text)
+
+        start = content.position_for_page(3, 10)
+        end = content.position_for_page(4, 10)
+        self.assertEqual(content.read_range(start, end).split(), text.split()[20:30])
+
+
+class ParserTests(SimpleTestCase):
+    FB2 = '''<?xml version="1.0" encoding="windows-1251"?>
+<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" xmlns:l="http://www.w3.org/1999/xlink">
+<description><title-info><book-title>Описание</book-title></title-info></description>
+<body>
+<section><title><p>Часть первая</p></title>
+<section><title><p>Глава 1</p></title><p>Первый абзац<a l:href="#n1" type="note">[1]</a> текста.</p>
+<poem><title><p>Стих</p></title><stanza><v>Строка стиха</v></stanza></poem></section>
+<section><title><p>Глава 2</p></title><p>Второй   абзац.</p></section>
+</section>
+<section><title><p>Часть вторая</p></title><p>Конец.</p></section>
+</body>
+<body name="notes"><title><p>Примечания</p></title><section id="n1"><title><p>1</p></title><p>Текст сноски.</p></section></body>
+<binary id="cover.jpg" content-type="image/jpeg">AAAA</binary>
+</FictionBook>'''.encode('cp1251')
+
+    def assertTocMatchesText(self, rendered):
+        for entry in rendered.toc:
+            self.assertEqual(rendered.text[entry.start:entry.start + len(entry.title)], entry.title)
+            self.assertEqual(rendered.word_offsets[entry.start_word], entry.start)
+            self.assertLessEqual(entry.start, entry.end)
+        self.assertEqual(list(rendered.word_offsets), list(content_store.build_word_offsets(rendered.text)))
+
+    def test_fb2_toc(self):
+        rendered = parse_fb2(self.FB2).render()
+
+        self.assertEqual(
+            [(entry.title, entry.level) for entry in rendered.toc],
+            [('Часть первая', 1), ('Глава 1', 2), ('Глава 2', 2), ('Часть вторая', 1)],
+        )
+        self.assertTocMatchesText(rendered)
+        part_one, chapter_one, chapter_two, part_two = rendered.toc
+        # Глава заканчивается перед заголовком следующей главы того же или более высокого уровня
+        self.assertEqual(rendered.text[chapter_one.start:chapter_one.end],
+                         'Глава 1\n\nПервый абзац[1] текста.\n\nСтих\n\nСтрока стиха')
+        self.assertEqual(chapter_two.end, part_one.end)
+        self.assertEqual(rendered.text[part_one.end:part_two.start], '\n\n')
+
+    def test_fb2_notes_and_service_parts(self):
+        rendered = parse_fb2(self.FB2).render()
+
+        # Сноски идут после основного текста и в оглавление не попадают
+        self.assertTrue(rendered.text.endswith('Примечания\n\n1\n\nТекст сноски.'))
+        self.assertLess(rendered.text.index('Конец.'), rendered.text.index('Текст сноски.'))
+        self.assertNotIn('Примечания', [entry.title for entry in rendered.toc])
+        # Заголовок стиха - текст, но не глава; ссылка на сноску остается в абзаце
+        self.assertIn('Стих', rendered.text)
+        self.assertNotIn('Стих', [entry.title for entry in rendered.toc])
+        self.assertIn('Первый абзац[1] текста.', rendered.text)
+        self.assertIn('Второй абзац.', rendered.text)
+        self.assertNotIn('Описание', rendered.text)
+        self.assertNotIn('AAAA', rendered.text)
+
+    def build_epub(self):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            archive.writestr('mimetype', 'application/epub+zip')
+            archive.writestr('META-INF/container.xml', (
+                '<?xml version="1.0"?><container xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                '</rootfiles></container>'
+            ))
+            archive.writestr('OEBPS/content.opf', (
+                '<?xml version="1.0"?><package xmlns="http://www.idpf.org/2007/opf"><manifest>'
+                '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+                '<item id="c1" href="text/ch1.xhtml" media-type="application/xhtml+xml"/>'
+                '<item id="c2" href="text/ch2.xhtml" media-type="application/xhtml+xml"/>'
+                '</manifest><spine><itemref idref="nav"/><itemref idref="c1"/><itemref idref="c2"/></spine></package>'
+            ))
+            # Порядок в архиве отличается от порядка чтения
+            archive.writestr('OEBPS/text/ch2.xhtml', '<html><body><h1>Chapter 2</h1><p>Second&nbsp;chapter.</p></body></html>')
+            archive.writestr('OEBPS/nav.xhtml', '<html><body><nav><ol><li>Chapter 1</li></ol></nav></body></html>')
+            archive.writestr('OEBPS/text/ch1.xhtml', (
+                '<html><head><title>Title</title><style>p {}</style></head><body>'
+                '<h1>Chapter 1</h1><h2>Section</h2><p>One<br/>two <em>three</em></p>Loose text<div>Block</div>'
+                '</body></html>'
+            ))
+        return data.getvalue()
+
+    def test_epub_spine_order_and_toc(self):
+        rendered = parse_epub(self.build_epub()).render()
+
+        self.assertEqual(
+            rendered.text,
+            'Chapter 1\n\nSection\n\nOne two three\n\nLoose text\n\nBlock\n\nChapter 2\n\nSecond chapter.',
+        )
+        self.assertEqual(
+            [(entry.title, entry.level) for entry in rendered.toc],
+            [('Chapter 1', 1), ('Section', 2), ('Chapter 2', 1)],
+        )
+        self.assertTocMatchesText(rendered)
+        self.assertEqual(rendered.toc[1].end, rendered.toc[0].end)
+        self.assertEqual(rendered.toc[2].end, len(rendered.text))
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author')
+        for votes in (2, 2, 5, 2, 5, 2, 0, 2):
+            Book.objects.create(title='Same title', author=author, vote_count=votes, rating_avg=votes / 2)
+
+    def walk(self, sort_by, limit=3):
+        seen, cursor = [], None
+        while True:
+            books, cursor, _ = paginate_by_cursor(Book.objects.all(), sort_by, cursor, limit)
+            seen.extend(book.id for book in books)
+            if cursor is None:
+                return seen
+
+    def test_ties_are_neither_skipped_nor_repeated(self):
+        for sort_by in ('newest', 'alphabet', 'rating', 'votes'):
+            with self.subTest(sort_by=sort_by):
+                expected = list(order_queryset(Book.objects.all(), sort_by).values_list('id', flat=True))
+                self.assertEqual(self.walk(sort_by), expected)
+
+    def test_new_tied_book_does_not_shift_pages(self):
+        first_page, cursor, _ = paginate_by_cursor(Book.objects.all(), 'votes', None, 3)
+        Book.objects.create(title='Same title', author=Author.objects.get(), vote_count=2)
+
+        rest = []
+        while cursor:
+            books, cursor, _ = paginate_by_cursor(Book.objects.all(), 'votes', cursor, 3)
+            rest.extend(book.id for book in books)
+
+        seen = [book.id for book in first_page] + rest
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(seen, list(order_queryset(Book.objects.all(), 'votes').values_list('id', flat=True)))
+
+
+class CounterDeltaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.first = User.objects.create_user(username='first', email='first@example.com', password='pass')
+        cls.second = User.objects.create_user(username='second', email='second@example.com', password='pass')
+        cls.book = Book.objects.create(title='Book', author=Author.objects.create(name='Author'))
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def assertRating(self, rating_sum, rating_count, rating_avg):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count, self.book.rating_avg),
+                         (rating_sum, rating_count, rating_avg))
+
+    def test_rate_rerate_and_unrate(self):
+        first, second = self.client_for(self.first), self.client_for(self.second)
+
+        self.assertEqual(first.post(f'/api/books/books/{self.book.pk}/rate/', {'rating': 5}).status_code, 200)
+        second.post(f'/api/books/books/{self.book.pk}/rate/', {'rating': 3})
+        self.assertRating(8, 2, 4.0)
+
+        first.post(f'/api/books/books/{self.book.pk}/rate/', {'rating': 1})
+        self.assertRating(4, 2, 2.0)
+
+        self.assertEqual(first.post(f'/api/books/books/{self.book.pk}/rate/', {'rating': 7}).status_code, 400)
+        self.assertRating(4, 2, 2.0)
+
+        user_book = UserBook.objects.get(user=self.first, book=self.book)
+        response = first.patch(f'/api/books/user-books/{user_book.pk}/', {'rating': None}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertRating(3, 1, 3.0)
+
+        second.delete('/api/books/user-books/remove_from_list/', {'book_id': self.book.pk}, format='json')
+        self.assertRating(0, 0, 0.0)
+
+    def test_vote_and_unvote(self):
+        first, second = self.client_for(self.first), self.client_for(self.second)
+        vote_url = f'/api/books/books/{self.book.pk}/vote/'
+        remove_url = f'/api/books/books/{self.book.pk}/remove_vote/'
+
+        self.assertEqual(first.post(vote_url).data['vote_count'], 1)
+        self.assertEqual(first.post(vote_url).status_code, 400)
+        self.assertEqual(second.post(vote_url).data['vote_count'], 2)
+        self.assertEqual(book_votes.top_of_week(), [(self.book.pk, 2)])
+
+        self.assertEqual(first.delete(remove_url).data['vote_count'], 1)
+        self.assertEqual(first.delete(remove_url).status_code, 400)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.vote_count, 1)
+        self.assertEqual(book_votes.top_of_week(), [(self.book.pk, 1)])
+        # Счетчик совпадает с таблицей голосов
+        self.assertEqual(book_votes.reconcile(), 0)
+
+
+class ReadingStatsTests(TempContentRootMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='reader', email='reader@example.com', password='pass')
+        author = Author.objects.create(name='Author')
+        cls.long_book = Book.objects.create(title='Long', author=author)
+        cls.short_book = Book.objects.create(title='Short', author=author)
+
+    def setUp(self):
+        self.long_book.save_content(words(1000))   # 4 страницы
+        self.short_book.save_content(words(700))   # 3 страницы
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        reading_stats.get_stats(self.user)
+
+    def stats(self):
+        """Incremental statistics; they must match a full rebuild"""
+        incremental = reading_stats.get_stats(self.user)
+        rebuilt = reading_stats.rebuild(self.user)
+        self.assertEqual(
+            (incremental['books_read'], incremental['pages_read'], incremental['total_marks']),
+            (rebuilt.books_read, rebuilt.pages_read, rebuilt.total_marks),
+        )
+        return incremental['books_read'], incremental['pages_read'], incremental['total_marks']
+
+    def set_status(self, book, status):
+        response = self.client.post('/api/books/user-books/add_to_list/', {'book_id': book.pk, 'status': status})
+        self.assertEqual(response.status_code, 200)
+
+    def test_status_changes_are_reverted_exactly(self):
+        self.set_status(self.long_book, UserBook.Status.COMPLETED)
+        self.assertEqual(self.stats(), (1, 4, 0))
+
+        self.client.post('/api/books/reading-progress/save_page_progress/', {'book_id': self.short_book.pk, 'current_page': 2})
+        self.assertEqual(self.stats(), (1, 6, 1))
+
+        self.set_status(self.long_book, UserBook.Status.DROPPED)
+        self.assertEqual(self.stats(), (0, 2, 1))
+
+        self.set_status(self.short_book, UserBook.Status.COMPLETED)
+        self.assertEqual(self.stats(), (1, 3, 1))
+
+        self.client.delete('/api/books/user-books/remove_from_list/', {'book_id': self.short_book.pk}, format='json')
+        self.client.delete('/api/books/user-books/remove_from_list/', {'book_id': self.long_book.pk}, format='json')
+        self.assertEqual(self.stats(), (0, 0, 0))
+
+    def test_uncompleting_subtracts_the_applied_pages(self):
+        self.set_status(self.long_book, UserBook.Status.COMPLETED)
+        self.assertEqual(self.stats(), (1, 4, 0))
+
+        # Текст заменили: оценка страниц книги изменилась после завершения
+        self.long_book.save_content(words(3000))
+        self.set_status(self.long_book, UserBook.Status.PLANNED)
+        self.assertEqual(self.stats(), (0, 0, 0))
+
+    def test_batch_progress_reverts_completion(self):
+        self.set_status(self.long_book, UserBook.Status.COMPLETED)
+        self.long_book.save_content(words(3000))
+
+        response = self.client.post('/api/books/reading-progress/save_progress_batch/', {'events': [
+            {'book_id': self.long_book.pk, 'current_page': 3, 'words_per_page': 300,
+             'client_timestamp': '2026-01-01T10:00:00Z'},
+            {'book_id': self.short_book.pk, 'current_page': 1, 'words_per_page': 300,
+             'client_timestamp': '2026-01-01T10:00:00Z'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stats(), (0, 4, 2))
+        self.assertEqual(UserBook.objects.get(user=self.user, book=self.long_book).counted_pages, 0)
+
+    def save_batch(self, *events):
+        response = self.client.post('/api/books/reading-progress/save_progress_batch/', {'events': [
+            {'book_id': book.pk, 'current_page': page, 'words_per_page': 300, 'client_timestamp': read_at.isoformat()}
+            for book, page, read_at in events
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return {saved['book_id']: saved['current_page'] for saved in response.data['saved']}
+
+    def test_stale_batch_events_are_skipped(self):
+        self.client.post('/api/books/reading-progress/save_page_progress/', {'book_id': self.long_book.pk, 'current_page': 3})
+        yesterday = timezone.now() - timedelta(days=1)
+
+        # Позиция с другого устройства новее офлайн-события - в ответе она и остается
+        self.assertEqual(self.save_batch((self.long_book, 1, yesterday)), {self.long_book.pk: 3})
+        self.assertEqual(self.stats(), (0, 3, 1))
+
+        # Повторно отправленная пачка не засчитывается дважды
+        batch = ((self.short_book, 2, yesterday),)
+        self.assertEqual(self.save_batch(*batch), {self.short_book.pk: 2})
+        self.assertEqual(self.save_batch(*batch), {self.short_book.pk: 2})
+        self.assertEqual(self.stats(), (0, 5, 2))
+
+    def test_batch_marks_count_for_the_day_they_were_read(self):
+        now = timezone.now()
+        self.save_batch((self.long_book, 1, now - timedelta(days=3)))
+        self.save_batch((self.short_book, 1, now - timedelta(days=1)))
+        self.assertEqual(reading_stats.get_stats(self.user)['reading_streak'], 1)
+
+        # Отметка задним числом заполняет пропущенный день и соединяет серию
+        self.save_batch((self.long_book, 2, now - timedelta(days=2)))
+        self.assertEqual(reading_stats.get_stats(self.user)['reading_streak'], 3)
+        self.assertEqual(
+            set(DailyReadingActivity.objects.filter(user=self.user).values_list('date', flat=True)),
+            {timezone.localdate(now - timedelta(days=days)) for days in (1, 2, 3)},
+        )
+        self.assertEqual(reading_stats.rebuild(self.user).reading_streak, 3)
+
+
+class ProgressCompactionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='reader', email='reader@example.com', password='pass')
+        book = Book.objects.create(title='Book', author=Author.objects.create(name='Author'))
+        cls.user_book = UserBook.objects.create(user=cls.user, book=book, status=UserBook.Status.READING)
+
+    def test_old_events_roll_up_and_current_stays_single(self):
+        for page in (1, 2, 5, 3):
+            progress.record(self.user_book, page * 10, page, 10)
+        self.assertEqual(CurrentProgress.objects.get(user_book=self.user_book).current_page, 3)
+
+        three_days_ago = timezone.now() - timedelta(days=3)
+        ReadingProgress.objects.filter(current_page__in=(1, 2, 5)).update(created_at=three_days_ago)
+        stats = reading_stats.get_stats(self.user)
+
+        self.assertEqual(progress.compact(keep_days=1), 3)
+        self.assertEqual(progress.compact(keep_days=1), 0)
+        rollup = DailyReadingProgress.objects.get(user_book=self.user_book)
+        self.assertEqual((rollup.date, rollup.marks_count, rollup.max_page), (timezone.localdate(three_days_ago), 3, 5))
+        self.assertEqual(ReadingProgress.objects.filter(user_book=self.user_book).count(), 1)
+        self.assertEqual(CurrentProgress.objects.filter(user_book=self.user_book).count(), 1)
+
+        # Свернутые события по-прежнему учитываются в статистике
+        rebuilt = reading_stats.rebuild(self.user)
+        self.assertEqual((rebuilt.total_marks, rebuilt.pages_read), (stats['total_marks'], stats['pages_read']))
+        self.assertEqual(rebuilt.total_marks, 4)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tolstoy = Author.objects.create(name='Лев Толстой')
+        cls.war = Book.objects.create(title='Война и мир', author=cls.tolstoy, description='Роман-эпопея')
+        cls.anna = Book.objects.create(title='Анна Каренина', author=cls.tolstoy, description='Роман о семье')
+        cls.about_war = Book.objects.create(title='Записки', author=Author.objects.create(name='Другой'),
+                                            description='Книга о войне и мире')
+
+    def search(self, query):
+        return list(
+            book_search.filter_queryset(Book.objects.all(), query).order_by('search_rank', '-id')
+            .values_list('id', flat=True)
+        )
+
+    def test_prefix_words_are_combined_with_and(self):
+        self.assertEqual(self.search('карен'), [self.anna.pk])
+        self.assertEqual(set(self.search('толст')), {self.war.pk, self.anna.pk})
+        self.assertEqual(self.search('толстой анна'), [self.anna.pk])
+        self.assertEqual(self.search('толстой записки'), [])
+
+    def test_title_match_ranks_above_description(self):
+        self.assertEqual(self.search('войн'), [self.war.pk, self.about_war.pk])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('(анна) "карен*'), [self.anna.pk])
+        self.assertEqual(self.search('*** ---'), [])
+        self.assertEqual(book_search.build_match_query('Анна "OR" мир*', 'sqlite'), '"анна"* "or"* "мир"*')
+
+    def test_index_follows_book_and_author_changes(self):
+        self.tolstoy.name = 'Л. Н. Толстой'
+        self.tolstoy.save()
+        self.anna.title = 'Anna Karenina'
+        self.anna.save()
+
+        self.assertEqual(self.search('карен'), [])
+        self.assertEqual(self.search('karenina н'), [self.anna.pk])
+
+        self.war.delete()
+        self.assertEqual(self.search('войн'), [self.about_war.pk])
+
+    def test_list_endpoint_orders_by_relevance(self):
+        response = APIClient().get('/api/books/books/', {'search': 'войн'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([book['id'] for book in response.data['books']], [self.war.pk, self.about_war.pk])
+        self.assertEqual(response.data['total'], 2)
+
+
+class GenreSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Author')
+
+    def genre_filter(self, genre):
+        response = APIClient().get('/api/books/books/', {'genre': genre})
+        return [(book['id'], book['genre']) for book in response.data['books']]
+
+    def test_genre_string_is_linked_on_save(self):
+        book = Book.objects.create(title='Book', author=self.author, genre='Роман, Классика')
+
+        self.assertEqual(self.genre_filter('Роман'), [(book.pk, 'Роман')])
+        self.assertEqual(self.genre_filter('Классика'), [(book.pk, 'Роман')])
+
+        book = Book.objects.get(pk=book.pk)
+        book.genre = 'Сказки'
+        book.save()
+        self.assertEqual(self.genre_filter('Роман'), [])
+        self.assertEqual(self.genre_filter('Сказки'), [(book.pk, 'Сказки')])
+        self.assertEqual(Book.objects.get(pk=book.pk).age_category, '0+')
+
+    def test_other_saves_keep_links(self):
+        book = Book.objects.create(title='Book', author=self.author, genre='Роман')
+
+        partial = Book.objects.only('id', 'title').get(pk=book.pk)
+        partial.title = 'Renamed'
+        partial.save()
+        Book.objects.get(pk=book.pk).save(update_fields=['title'])
+
+        self.assertEqual(list(book.genres.values_list('name', flat=True)), ['Роман'])
+
+
+class PageCacheTests(TempContentRootMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Book', author=Author.objects.create(name='Author'))
+
+    def setUp(self):
+        self.book.save_content(words(1000))
+        page_cache._local_cache.clear()
+        cache.clear()
+
+    def get_page(self, page, **params):
+        return APIClient().get(f'/api/books/books/{self.book.pk}/content_paginated/', dict(params, page=page))
+
+    def test_pages_are_cached_per_text_version(self):
+        first = self.get_page(2)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data['total_pages'], 4)
+        self.assertEqual(self.get_page(2).data['content'], first.data['content'])
+        self.assertEqual(page_cache.get_stats()['process']['local_size'], 1)
+
+        # Новая версия текста: старая страница из кеша больше не отдается
+        self.book.save_content(words(1000, prefix='new'))
+        second = self.get_page(2)
+        self.assertNotEqual(second.data['content'], first.data['content'])
+        self.assertTrue(second.data['content'].startswith('new'))
+
+    def test_words_per_page_outside_allowed_range_is_rejected(self):
+        for words_per_page in ('0', '-300', '301', '5000', 'abc'):
+            with self.subTest(words_per_page=words_per_page):
+                response = self.get_page(1, words_per_page=words_per_page)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('words_per_page', response.data['error'])
+
+        self.assertEqual(self.get_page(1, words_per_page=500).data['total_pages'], 2)
+        self.assertEqual(self.get_page('x').status_code, 400)
+        self.assertEqual(len(page_cache._local_cache), 1)
+
+
+class ChapterStorageTests(TempContentRootMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Book', author=Author.objects.create(name='Author'))
+
+    def setUp(self):
+        rendered = parse_fb2(ParserTests.FB2).render()
+        self.book.save_content(rendered.text, word_offsets=rendered.word_offsets, toc=rendered.toc)
+
+    def chapters(self):
+        response = APIClient().get(f'/api/books/books/{self.book.pk}/toc/')
+        return [(chapter['title'], chapter['start']) for chapter in response.data['chapters']]
+
+    def test_rewrites_without_toc_keep_chapters(self):
+        chapters = self.chapters()
+        self.assertEqual([title for title, _ in chapters], ['Часть первая', 'Глава 1', 'Глава 2', 'Часть вторая'])
+
+        self.book.description = 'Edited'
+        self.book.save()
+        call_command('convert_book_content', '--to', BookContent.Storage.DATABASE, stdout=io.StringIO())
+        self.assertEqual(BookContent.for_book(self.book.pk).storage, BookContent.Storage.DATABASE)
+        self.assertEqual(self.chapters(), chapters)
+
+        # Пустое оглавление передано явно - главы удаляются
+        self.book.save_content(words(10), toc=[])
+        self.assertEqual(self.chapters(), [])
+
+
+@override_settings(CONTENT_FETCH_IN_PROCESS=False)
+class ContentFetchTests(TempContentRootMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author')
+        cls.book = Book.objects.create(title='Book', author=author, source_type='flibusta', source_id='42')
+        cls.local_book = Book.objects.create(title='Local', author=author)
+
+    def get_content(self, book):
+        return APIClient().get(f'/api/books/books/{book.pk}/content_paginated/')
+
+    def fetch(self, loaded=True):
+        """Runs queued jobs; the download itself is replaced by storing a text"""
+        def fetch_book_content(book):
+            if loaded:
+                book.save_content(words(400))
+            return loaded
+
+        with mock.patch.object(content_jobs, 'fetch_book_content', side_effect=fetch_book_content) as fetch:
+            content_jobs.run_pending_jobs()
+        return fetch.call_count
+
+    def test_text_is_fetched_in_background(self):
+        response = self.get_content(self.book)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['content_status'], Book.ContentStatus.FETCHING)
+
+        self.assertEqual(self.fetch(), 1)
+        job = APIClient().get(f'/api/books/books/{self.book.pk}/content_jobs/{response.data["job_id"]}/')
+        self.assertEqual((job.data['job_status'], job.data['content_status']),
+                         (ContentFetchJob.Status.DONE, Book.ContentStatus.READY))
+
+        response = self.get_content(self.book)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_pages'], 2)
+
+    def test_book_without_source_gets_fallback_text(self):
+        response = self.get_content(self.local_book)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['content'])
+        self.assertFalse(ContentFetchJob.objects.exists())
+
+    def test_concurrent_readers_share_one_job(self):
+        first = self.get_content(self.book).data['job_id']
+        self.assertEqual(self.get_content(self.book).data['job_id'], first)
+
+        # Параллельный запрос не увидел активную задачу, но уникальный индекс не дает создать вторую
+        with mock.patch.object(content_jobs, 'get_active_job', side_effect=[None, ContentFetchJob.objects.get()]):
+            self.assertEqual(content_jobs.enqueue(self.book).pk, first)
+
+        self.assertEqual(ContentFetchJob.objects.count(), 1)
+        self.assertEqual(self.fetch(), 1)
+        self.assertIsNone(content_jobs.run_job(first))
+
+    def test_failures_back_off_exponentially(self):
+        self.get_content(self.book)
+        self.assertEqual(self.fetch(loaded=False), 1)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.content_status, self.book.content_fetch_failures),
+                         (Book.ContentStatus.FAILED, 1))
+        first_delay = self.book.content_retry_at - ContentFetchJob.objects.get().finished_at
+        self.assertEqual(first_delay, content_jobs.retry_delay(1))
+
+        # Во время паузы читатель сразу получает запасной текст без новой загрузки
+        response = self.get_content(self.book)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ContentFetchJob.objects.count(), 1)
+
+        Book.objects.filter(pk=self.book.pk).update(content_retry_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.get_content(self.book).status_code, 200)
+        self.assertEqual(self.fetch(loaded=False), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.content_fetch_failures, 2)
+        self.assertEqual(content_jobs.retry_delay(2), 2 * first_delay)
+
+    def test_stale_job_is_reaped_and_requeued(self):
+        job = content_jobs.enqueue(self.book)
+        ContentFetchJob.objects.filter(pk=job.pk).update(
+            status=ContentFetchJob.Status.RUNNING,
+            started_at=timezone.now() - timedelta(seconds=content_jobs.STALE_AFTER + 1),
+        )
+
+        new_job = content_jobs.enqueue(self.book)
+        self.assertNotEqual(new_job.pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (ContentFetchJob.Status.FAILED, content_jobs.STALE_ERROR))
+        self.assertEqual(self.fetch(), 1)
+
+
+class WeeklyTallyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create_user(username=f'voter{i}', email=f'voter{i}@example.com', password='pass')
+                     for i in range(3)]
+        author = Author.objects.create(name='Author')
+        cls.first = Book.objects.create(title='First', author=author)
+        cls.second = Book.objects.create(title='Second', author=author)
+
+    def vote_last_week(self, user, book):
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() - timedelta(days=7)):
+            book_votes.cast(user, book.pk)
+
+    def test_votes_count_for_the_week_they_were_cast(self):
+        this_week, last_week = book_votes.week_start(), book_votes.week_start() - timedelta(days=7)
+        for user in self.users:
+            self.vote_last_week(user, self.first)
+        book_votes.cast(self.users[0], self.second.pk)
+
+        self.assertEqual(book_votes.top_of_week(last_week), [(self.first.pk, 3)])
+        self.assertEqual(book_votes.top_of_week(this_week), [(self.second.pk, 1)])
+
+        # Снятый на этой неделе голос прошлой недели уменьшает итог прошлой недели
+        book_votes.retract(self.users[1], self.first.pk)
+        self.assertEqual(book_votes.top_of_week(last_week), [(self.first.pk, 2)])
+        self.assertEqual(book_votes.top_of_week(this_week), [(self.second.pk, 1)])
+
+        response = APIClient().get('/api/books/books/weekly_leaderboard/', {'week': str(last_week + timedelta(days=3))})
+        self.assertEqual([(row['book_id'], row['votes']) for row in response.data['results']], [(self.first.pk, 2)])
+        self.assertEqual(APIClient().get('/api/books/books/weekly_leaderboard/', {'week': 'soon'}).status_code, 400)
+
+    def test_book_of_week_is_selected_from_last_week(self):
+        for user in self.users[:2]:
+            self.vote_last_week(user, self.first)
+        self.vote_last_week(self.users[2], self.second)
+        book_votes.cast(self.users[0], self.second.pk)
+
+        call_command('select_book_of_week', stdout=io.StringIO())
+
+        weekly = WeeklyBook.objects.get()
+        self.assertEqual((weekly.book, weekly.votes_at_selection), (self.first, 2))
+        self.assertTrue(Book.objects.get(pk=self.first.pk).is_book_of_week)
+        # Голоса прошлой недели сброшены, итоги недель и голоса этой недели остались
+        self.assertEqual(list(BookVote.objects.values_list('book_id', flat=True)), [self.second.pk])
+        self.assertEqual(Book.objects.get(pk=self.second.pk).vote_count, 1)
+        self.assertEqual(book_votes.top_of_week(book_votes.week_start() - timedelta(days=7)),
+                         [(self.first.pk, 2), (self.second.pk, 1)])
+
+
+@mock.patch.object(vote_stream, 'POLL_INTERVAL', 0.05)
+class VoteStreamTests(TransactionTestCase):
+    # Голос должен быть закоммичен: его видит поток опроса, а on_commit отмечает изменение
+    def setUp(self):
+        cache.clear()
+        vote_stream._local_snapshot = None
+        self.user = get_user_model().objects.create_user(username='voter', email='voter@example.com', password='pass')
+        author = Author.objects.create(name='Author')
+        self.first = Book.objects.create(title='First', author=author)
+        self.second = Book.objects.create(title='Second', author=author)
+        book_votes.cast(self.user, self.first.pk)
+
+    def open_stream(self):
+        response = APIClient().get('/api/books/books/vote_stream/')
+        self.addCleanup(response.close)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return iter(response.streaming_content)
+
+    def test_stream_sends_snapshot_then_delta(self):
+        first_stream, second_stream = self.open_stream(), self.open_stream()
+        for stream in (first_stream, second_stream):
+            self.assertTrue(next(stream).decode().startswith('retry: '))
+            event = next(stream).decode()
+            self.assertTrue(event.startswith('event: snapshot\n'))
+            self.assertIn(f'"book_id": {self.first.pk}', event)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post(f'/api/books/books/{self.second.pk}/vote/').status_code, 200)
+
+        # Оба потока получают изменение от одного потока опроса
+        for stream in (first_stream, second_stream):
+            event = next(stream).decode()
+            self.assertTrue(event.startswith('event: delta\n'))
+            self.assertIn(f'"book_id": {self.second.pk}', event)
+            self.assertIn('"removed": []', event)
+        self.assertEqual(vote_stream._poller.subscribers, 2)
+
+    def test_poller_stops_without_subscribers(self):
+        response = APIClient().get('/api/books/books/vote_stream/')
+        next(iter(response.streaming_content))
+        poller_thread = vote_stream._poller.thread
+        self.assertTrue(poller_thread.is_alive())
+
+        # Отключение клиента закрывает генератор
+        response.close()
+        self.assertEqual(vote_stream._poller.subscribers, 0)
+        poller_thread.join(timeout=1)
+        self.assertFalse(poller_thread.is_alive())
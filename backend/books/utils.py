@@ -21,7 +21,8 @@ def get_real_book_content_from_external_sources(book_title, author_name):
         if search_results:
             book_data = search_results[0]
             # Пытаемся загрузить содержимое
-            content = sources.get_book_content(book_data, 'fb2')
+            rendered = sources.get_book_content(book_data, 'fb2')
+            content = rendered.text if rendered else None
             
             if content and len(content.strip()) > 100:  # Проверяем что контент не пустой
                 return format_book_content(book_title, author_name, content)
@@ -153,6 +154,42 @@ def paginate_book_content(content: str, page: int = 1, words_per_page: int = 300
         'has_previous': page > 1
     }
 
+def paginate_stored_content(content_store, page: int = 1, words_per_page: int = 300) -> dict:
+    """
+    Возвращает страницу текста из BookContent, не загружая книгу целиком
+    
+    Args:
+        content_store: Объект BookContent
+        page: Номер запрашиваемой страницы (начиная с 1)
+        words_per_page: Количество слов на странице
+    
+    Returns:
+        Dict с данными о странице (тот же формат, что у paginate_book_content)
+    """
+    total_words = content_store.word_count if content_store else 0
+    if total_words == 0:
+        return {
+            'current_page': 1,
+            'total_pages': 1,
+            'content': 'Содержимое книги недоступно.',
+            'has_next': False,
+            'has_previous': False
+        }
+    
+    total_pages = content_store.total_pages(words_per_page)
+    page = min(max(page, 1), total_pages)
+    
+    start_word_index = (page - 1) * words_per_page
+    page_words = content_store.read_words(start_word_index, start_word_index + words_per_page)
+    
+    return {
+        'current_page': page,
+        'total_pages': total_pages,
+        'content': format_page_content(' '.join(page_words)),
+        'has_next': page < total_pages,
+        'has_previous': page > 1
+    }
+
 def format_page_content(content: str) -> str:
     """
     Улучшает форматирование текста страницы
@@ -180,54 +217,3 @@ def format_page_content(content: str) -> str:
     content = re.sub(r'\n{3,}', '\n\n', content)
     
     return content.strip()
-
-def calculate_reading_position(content: str, page: int, words_per_page: int = 300) -> int:
-    """
-    Вычисляет позицию в тексте (в символах) для заданной страницы
-    
-    Args:
-        content: Полный текст книги
-        page: Номер страницы
-        words_per_page: Количество слов на странице
-    
-    Returns:
-        Позиция в символах
-    """
-    if not content or page < 1:
-        return 0
-    
-    words = content.split()
-    start_word_index = (page - 1) * words_per_page
-    
-    if start_word_index >= len(words):
-        return len(content)
-    
-    # Находим позицию первого слова на странице в исходном тексте
-    words_before = words[:start_word_index]
-    chars_before = sum(len(word) + 1 for word in words_before)  # +1 для пробела
-    
-    return max(0, chars_before - 1)  # -1 чтобы убрать последний пробел
-
-def get_page_from_position(content: str, position: int, words_per_page: int = 300) -> int:
-    """
-    Определяет номер страницы по позиции в тексте
-    
-    Args:
-        content: Полный текст книги
-        position: Позиция в символах
-        words_per_page: Количество слов на странице
-    
-    Returns:
-        Номер страницы
-    """
-    if not content or position <= 0:
-        return 1
-    
-    # Получаем текст до указанной позиции
-    text_before = content[:position]
-    words_before = len(text_before.split())
-    
-    # Вычисляем номер страницы
-    page = (words_before // words_per_page) + 1
-    
-    return max(1, page)
\ No newline at end of file
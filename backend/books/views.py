@@ -1,15 +1,64 @@
+import json
 from rest_framework import viewsets, generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BaseRenderer
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.models import Q
 from django.db.models.functions import Lower
-from .models import Book, Author, UserBook, ReadingProgress, BookVote, WeeklyBook
-from .serializers import BookSerializer, BookListSerializer, BookFrontendSerializer, AuthorSerializer, UserBookSerializer, ReadingProgressSerializer
+from .models import Book, BookContent, BookChapter, ContentFetchJob, Author, Genre, UserBook, ReadingProgress, CurrentProgress, BookVote, WeeklyBook, STANDARD_WORDS_PER_PAGE, WORDS_PER_PAGE_CHOICES
+from .serializers import BookSerializer, BookListSerializer, BookFrontendSerializer, AuthorSerializer, UserBookSerializer, ReadingProgressSerializer, BookChapterSerializer, ProgressEventSerializer
 # Google Books импорт удален - используем только Флибусту
 from .external_sources import search_external_books, import_book_from_external_source, FlibustaTorClient
+from . import search as book_search
+from . import pagination as book_pagination
+from . import progress as book_progress
+from . import reading_stats
+from . import votes as book_votes
+
+# Maximum number of page turns accepted by save_progress_batch
+PROGRESS_BATCH_MAX_EVENTS = 500
+
+BOOK_CONTENT_UNAVAILABLE = 'Содержимое книги пока недоступно. Не удалось загрузить текст.'
+
+WORDS_PER_PAGE_ERROR = (
+    f'words_per_page must be a multiple of {WORDS_PER_PAGE_CHOICES.step} '
+    f'from {WORDS_PER_PAGE_CHOICES.start} to {WORDS_PER_PAGE_CHOICES.stop - 1}'
+)
+
+def get_words_per_page(params):
+    """words_per_page of a request, or None when it is not one of WORDS_PER_PAGE_CHOICES"""
+    try:
+        words_per_page = int(params.get('words_per_page', STANDARD_WORDS_PER_PAGE))
+    except (TypeError, ValueError):
+        return None
+    return words_per_page if words_per_page in WORDS_PER_PAGE_CHOICES else None
+
+def is_cursor_pagination(request):
+    """Whether the client asked for keyset pagination instead of page numbers"""
+    return request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params
+
+def cursor_paginated_response(serializer_class, queryset, sort_by, request, limit):
+    """Serialize one keyset page of the catalog"""
+    try:
+        books, next_cursor, total = book_pagination.paginate_by_cursor(
+            queryset, sort_by, request.query_params.get('cursor', ''), limit
+        )
+    except book_pagination.InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = serializer_class(books, many=True, context={'request': request})
+    return Response({
+        'books': serializer.data,
+        'total': total,
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None
+    })
 
 class IsAdminOrReadOnly(permissions.BasePermission):
     """Custom permission to only allow admins to edit objects"""
@@ -18,9 +67,18 @@ class IsAdminOrReadOnly(permissions.BasePermission):
             return True
         return request.user and request.user.is_staff
 
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF content negotiation accept EventSource requests (Accept: text/event-stream)"""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode() if data is not None else b''
+
+
 class BookViewSet(viewsets.ModelViewSet):
     """ViewSet for books"""
-    queryset = Book.objects.all().select_related('author')
+    queryset = Book.objects.all().select_related('author').prefetch_related('genres')
     permission_classes = [permissions.AllowAny]
     
     def get_serializer_class(self):
@@ -47,49 +105,18 @@ class BookViewSet(viewsets.ModelViewSet):
         limit = int(request.query_params.get('limit', 12))
         
         # Apply filters
-        search = request.query_params.get('search', '')
+        search = request.query_params.get('search', '').strip()
         if search:
-            search_lower = search.lower()
-            # Filter books where title or author name contains search term (case-insensitive)
-            filtered_books = []
-            for book in queryset:
-                if (search_lower in book.title.lower() or 
-                    search_lower in book.author.name.lower()):
-                    filtered_books.append(book.id)
-            
-            if filtered_books:
-                queryset = queryset.filter(id__in=filtered_books)
-            else:
-                queryset = queryset.none()
+            # Full-text index lookup over title, author name and description
+            queryset = book_search.filter_queryset(queryset, search)
         
         genre = request.query_params.get('genre', '')
         if genre:
-            # Filter by genre using the same logic as in serializer
-            genres = [
-                "Художественная литература",
-                "Фантастика", 
-                "Детектив",
-                "Роман",
-                "Классика",
-                "Приключения",
-                "Драма",
-                "Фэнтези"
-            ]
-            if genre in genres:
-                genre_index = genres.index(genre)
-                # Filter books where id % len(genres) == genre_index
-                filtered_ids = [book.id for book in queryset if book.id % len(genres) == genre_index]
-                queryset = queryset.filter(id__in=filtered_ids)
+            queryset = queryset.filter(genres__name=genre)
         
         age_category = request.query_params.get('ageCategory', '')
         if age_category:
-            # Filter by age category using the same logic as in serializer
-            age_categories = ["0+", "6+", "12+", "16+", "18+"]
-            if age_category in age_categories:
-                age_index = age_categories.index(age_category)
-                # Filter books where id % len(age_categories) == age_index
-                filtered_ids = [book.id for book in queryset if book.id % len(age_categories) == age_index]
-                queryset = queryset.filter(id__in=filtered_ids)
+            queryset = queryset.filter(age_category=age_category)
         
         # Filter by rating
         rating = request.query_params.get('rating', '')
@@ -97,38 +124,31 @@ class BookViewSet(viewsets.ModelViewSet):
             try:
                 min_rating = float(rating)
                 # Filter books with average rating >= min_rating
-                from django.db.models import Avg
-                filtered_ids = []
-                for book in queryset:
-                    avg_rating = book.user_books.filter(rating__isnull=False).aggregate(Avg('rating'))['rating__avg']
-                    if avg_rating and avg_rating >= min_rating:
-                        filtered_ids.append(book.id)
-                queryset = queryset.filter(id__in=filtered_ids)
+                queryset = queryset.filter(rating_count__gt=0, rating_avg__gte=min_rating)
             except ValueError:
                 pass  # Invalid rating value, ignore
         
-        # Apply sorting
         sort_by = request.query_params.get('sortBy', '')
+        
+        # Opt-in keyset pagination: ?pagination=cursor[&cursor=...]
+        if is_cursor_pagination(request):
+            return cursor_paginated_response(self.get_serializer_class(), queryset, sort_by, request, limit)
+        
+        # Apply sorting
         if sort_by == 'rating':
-            # Sort all books by average rating
-            from django.db.models import Avg
-            queryset_list = list(queryset)
-            def get_avg_rating(book):
-                avg_rating = book.user_books.filter(rating__isnull=False).aggregate(Avg('rating'))['rating__avg']
-                return avg_rating if avg_rating else 0.0
-            queryset_list.sort(key=get_avg_rating, reverse=True)
-            # Create a new queryset with sorted IDs
-            sorted_ids = [book.id for book in queryset_list]
-            # Use a custom ordering to preserve the sort
-            from django.db.models import Case, When, IntegerField
-            preserved = Case(*[When(pk=pk, then=pos) for pos, pk in enumerate(sorted_ids)], output_field=IntegerField())
-            queryset = queryset.filter(id__in=sorted_ids).order_by(preserved)
+            # Sort by denormalized average rating (indexed)
+            queryset = queryset.order_by('-rating_avg', 'id')
         elif sort_by == 'newest':
             # Sort by ID descending (assuming higher ID = newer)
             queryset = queryset.order_by('-id')
         elif sort_by == 'alphabet':
             # Sort by title alphabetically
             queryset = queryset.order_by('title')
+        elif sort_by == 'votes':
+            queryset = queryset.order_by('-vote_count', 'id')
+        elif search:
+            # Most relevant search results first
+            queryset = queryset.order_by('search_rank', '-id')
         
         # Paginate
         paginator = Paginator(queryset, limit)
@@ -144,68 +164,122 @@ class BookViewSet(viewsets.ModelViewSet):
             'limit': limit
         })
 
+    def _ensure_content(self, book):
+        """Return (content_store, job) for a book.
+        
+        When only a stub is stored the text is fetched in the background:
+        ``job`` is the ContentFetchJob to report with 202, ``content_store``
+        is None. A book without an external source to fetch from, or whose
+        last fetch failed, gets (None, None) right away so the caller can
+        serve the fallback text; after a failure a new fetch is queued only
+        once its backoff window is over.
+        """
+        from . import content_jobs
+        
+        content_store = BookContent.for_book(book.id)
+        if content_store is not None and not content_store.is_placeholder:
+            return content_store, None
+        
+        if not content_jobs.has_fetchable_source(book):
+            return None, None
+        
+        if book.content_status == Book.ContentStatus.FAILED:
+            if not content_jobs.in_backoff(book):
+                content_jobs.enqueue(book)
+            return None, None
+        
+        # Скачивание с Флибусты идет через Tor и может занять минуты - запрос его не ждет
+        return None, content_jobs.enqueue(book)
+    
+    def _content_job_response(self, book, job):
+        return Response({
+            'id': book.id,
+            'title': book.title,
+            'content_status': book.content_status,
+            'job_id': job.id,
+            'job_status': job.status,
+        }, status=status.HTTP_202_ACCEPTED)
+
     @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
     def content(self, request, pk=None):
         """Get book content for reading"""
-        from .utils import get_book_content_from_external_sources
-        from .external_sources import ExternalBookSources
+        from .utils import get_demo_book_content
         
         book = self.get_object()
+        content_store, job = self._ensure_content(book)
+        if job is not None:
+            return self._content_job_response(book, job)
         
-        # Если контент пустой или содержит заглушку, пытаемся получить контент
-        if not book.content or book.content == 'Содержимое книги будет добавлено позже.' or len(book.content.strip()) < 100:
-            content_loaded = False
-            
-            # Если книга импортирована с Флибусты, пытаемся загрузить с Флибусты
-            if book.source_type == 'flibusta' and book.source_id:
-                 try:
-                     external_sources = ExternalBookSources(use_tor_for_flibusta=True)
-                     book_data = {
-                         'source_id': book.source_id,
-                         'title': book.title,
-                         'download_links': []  # Будет получено через source_id
-                     }
-                     flibusta_content = external_sources.get_book_content('flibusta', book_data, 'fb2')
-                     if flibusta_content and len(flibusta_content.strip()) > 100:
-                         book.content = flibusta_content
-                         book.save()
-                         content_loaded = True
-                 except Exception as e:
-                     print(f"Ошибка загрузки с Флибусты: {e}")
-            
-            # Если не удалось загрузить с Флибусты, используем демо-контент
-            if not content_loaded:
-                demo_content = get_book_content_from_external_sources(book.title, book.author.name)
-                if demo_content:
-                    book.content = demo_content
-                    book.save()
-        
-        content = book.content or 'Содержимое книги пока недоступно. Не удалось загрузить текст.'
+        if content_store:
+            content = content_store.get_text()
+        else:
+            content = get_demo_book_content(book.title, book.author.name)
         
         return Response({
             'id': book.id,
             'title': book.title,
             'author': book.author.name,
-            'content': content
+            'content': content or BOOK_CONTENT_UNAVAILABLE
+        })
+    
+    @action(detail=True, methods=['get'], url_path=r'content_jobs/(?P<job_id>\d+)',
+            permission_classes=[permissions.AllowAny])
+    def content_job(self, request, pk=None, job_id=None):
+        """Status of a background content fetch"""
+        book = self.get_object()
+        job = get_object_or_404(ContentFetchJob, pk=job_id, book=book)
+        
+        return Response({
+            'id': book.id,
+            'content_status': book.content_status,
+            'job_id': job.id,
+            'job_status': job.status,
+            'error': job.error,
+            'created_at': job.created_at,
+            'finished_at': job.finished_at,
         })
     
     @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
     def content_paginated(self, request, pk=None):
         """Get book content with pagination"""
-        from .utils import paginate_book_content
+        from .utils import paginate_book_content, get_demo_book_content
+        from . import page_cache
         
         book = self.get_object()
-        page = int(request.query_params.get('page', 1))
-        words_per_page = int(request.query_params.get('words_per_page', 300))
-        
-        # Get full content first
-        content_response = self.content(request, pk)
-        full_content = content_response.data['content']
-        
-        # Paginate content
-        paginated_data = paginate_book_content(full_content, page, words_per_page)
-        
-        return Response({
+        try:
+            page = int(request.query_params.get('page', 1))
+        except ValueError:
+            return Response({'error': 'page must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        words_per_page = get_words_per_page(request.query_params)
+        if words_per_page is None:
+            return Response({'error': WORDS_PER_PAGE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+        chapter_number = request.query_params.get('chapter') or None
+        if chapter_number is not None:
+            try:
+                chapter_number = int(chapter_number)
+            except ValueError:
+                return Response({'error': 'chapter must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        content_store, job = self._ensure_content(book)
+        if job is not None:
+            return self._content_job_response(book, job)
+        
+        # Переход к главе: страница берется из оглавления, без прохода по тексту
+        chapter = None
+        if chapter_number is not None:
+            chapter = BookChapter.objects.filter(book=book, number=chapter_number).first()
+            if chapter is None:
+                return Response({'error': 'Chapter not found'}, status=status.HTTP_404_NOT_FOUND)
+            page = chapter.page(words_per_page)
+        
+        # Rendered pages are cached; on a miss only the requested page is read
+        if content_store and content_store.word_count:
+            paginated_data = page_cache.get_page(content_store, page, words_per_page)
+        else:
+            fallback = get_demo_book_content(book.title, book.author.name)
+            paginated_data = paginate_book_content(fallback, page, words_per_page)
+        
+        response_data = {
             'id': book.id,
             'title': book.title,
             'author': book.author.name,
@@ -214,8 +288,37 @@ class BookViewSet(viewsets.ModelViewSet):
             'content': paginated_data['content'],
             'has_next': paginated_data['has_next'],
             'has_previous': paginated_data['has_previous']
+        }
+        if chapter is not None:
+            response_data['chapter'] = BookChapterSerializer(
+                chapter, context={'words_per_page': words_per_page}
+            ).data
+        return Response(response_data)
+
+    @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
+    def toc(self, request, pk=None):
+        """Table of contents with the starting page of every chapter"""
+        book = self.get_object()
+        words_per_page = get_words_per_page(request.query_params)
+        if words_per_page is None:
+            return Response({'error': WORDS_PER_PAGE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+        chapters = BookChapter.objects.filter(book=book)
+        
+        return Response({
+            'id': book.id,
+            'title': book.title,
+            'words_per_page': words_per_page,
+            'chapters': BookChapterSerializer(
+                chapters, many=True, context={'words_per_page': words_per_page}
+            ).data
         })
 
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def page_cache_stats(self, request):
+        """Hit/miss counters of the rendered page cache"""
+        from . import page_cache
+        return Response(page_cache.get_stats())
+
     @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
     def top_voted(self, request):
         """Get top 5 books by vote count"""
@@ -247,80 +350,8 @@ class BookViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def user_reading_stats(self, request):
         """Get comprehensive reading statistics for the user"""
-        from django.db.models import Sum, Max
-        from datetime import datetime, timedelta
-        from django.utils import timezone
-        
-        user = request.user
-        
-        # Get all user books
-        user_books = UserBook.objects.filter(user=user)
-        completed_books = user_books.filter(status=UserBook.Status.COMPLETED)
-        
-        # Calculate total pages read
-        total_pages_read = 0
-        
-        # For completed books, count all pages
-        for book in completed_books:
-            if book.book.content:
-                # Estimate total pages based on content length
-                words_count = len(book.book.content.split())
-                estimated_pages = max(1, words_count // 300)  # 300 words per page
-                total_pages_read += estimated_pages
-        
-        # For books in progress, get current page from progress
-        reading_books = user_books.filter(status=UserBook.Status.READING)
-        for user_book in reading_books:
-            try:
-                # Get latest progress for this book
-                latest_progress = ReadingProgress.objects.filter(
-                    user_book=user_book
-                ).order_by('-created_at').first()
-                
-                if latest_progress and latest_progress.current_page:
-                    total_pages_read += latest_progress.current_page
-            except:
-                pass
-        
-        # Calculate reading streak (consecutive days with reading activity)
-        reading_streak = 0
-        if ReadingProgress.objects.filter(user_book__user=user).exists():
-            # Get all unique dates when user made progress
-            progress_dates = ReadingProgress.objects.filter(
-                user_book__user=user
-            ).dates('created_at', 'day').order_by('-created_at')
-            
-            if progress_dates:
-                current_date = timezone.now().date()
-                streak_count = 0
-                
-                # Check if user read today or yesterday (to account for timezone)
-                latest_reading_date = progress_dates[0]
-                if (current_date - latest_reading_date).days <= 1:
-                    streak_count = 1
-                    check_date = latest_reading_date - timedelta(days=1)
-                    
-                    # Count consecutive days backwards
-                    for date in progress_dates[1:]:
-                        if date == check_date:
-                            streak_count += 1
-                            check_date -= timedelta(days=1)
-                        else:
-                            break
-                
-                reading_streak = streak_count
-        
-        # Get total reading marks and calculate hours
-        total_marks = ReadingProgress.objects.filter(user_book__user=user).count()
-        total_hours = max(0, total_marks // 4)  # 4 marks = 1 hour
-        
-        return Response({
-            'books_read': completed_books.count(),
-            'pages_read': total_pages_read,
-            'reading_streak': reading_streak,
-            'total_hours': total_hours,
-            'total_marks': total_marks
-        })
+        # Статистика ведется инкрементально при записи прогресса и смене статусов
+        return Response(reading_stats.get_stats(request.user))
     
 
     
@@ -328,21 +359,30 @@ class BookViewSet(viewsets.ModelViewSet):
     def rate(self, request, pk=None):
         """Rate a book"""
         book = self.get_object()
-        rating = request.data.get('rating')
         
-        if not rating or not (1 <= int(rating) <= 5):
+        try:
+            rating = int(request.data.get('rating'))
+        except (TypeError, ValueError):
+            rating = None
+        if not rating or not (1 <= rating <= 5):
             return Response({'error': 'Rating must be between 1 and 5'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create or update UserBook with rating
-        user_book, created = UserBook.objects.get_or_create(
-            user=request.user,
-            book=book,
-            defaults={'rating': rating}
-        )
+        # Create or update UserBook with rating. The row is locked so that the
+        # signal computes the rating delta from the committed value: concurrent
+        # requests would otherwise both subtract the same old rating.
+        with transaction.atomic():
+            user_book, created = UserBook.objects.select_for_update().get_or_create(
+                user=request.user,
+                book=book,
+                defaults={'rating': rating}
+            )
+            
+            if not created:
+                user_book.rating = rating
+                user_book.save()
         
-        if not created:
-            user_book.rating = rating
-            user_book.save()
+        # Aggregates are updated in the database by the UserBook signal
+        book.refresh_from_db(fields=['rating_sum', 'rating_count', 'rating_avg'])
         
         # Return updated book data with rating
         serializer = BookFrontendSerializer(book)
@@ -353,13 +393,6 @@ class BookViewSet(viewsets.ModelViewSet):
         """Get book rating information including user's rating"""
         book = self.get_object()
         
-        # Calculate average rating and count
-        from django.db.models import Avg, Count
-        rating_stats = book.user_books.filter(rating__isnull=False).aggregate(
-            average_rating=Avg('rating'),
-            rating_count=Count('rating')
-        )
-        
         # Get user's rating if authenticated
         user_rating = None
         if request.user.is_authenticated:
@@ -371,8 +404,8 @@ class BookViewSet(viewsets.ModelViewSet):
         
         return Response({
             'user_rating': user_rating,
-            'average_rating': round(rating_stats['average_rating'], 1) if rating_stats['average_rating'] else 0.0,
-            'rating_count': rating_stats['rating_count'] or 0
+            'average_rating': round(book.rating_avg, 1),
+            'rating_count': book.rating_count
         })
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
@@ -380,21 +413,14 @@ class BookViewSet(viewsets.ModelViewSet):
         """Vote for a book"""
         book = self.get_object()
         
-        # Check if user already voted for this book
-        existing_vote = BookVote.objects.filter(user=request.user, book=book).first()
-        if existing_vote:
+        # Conditional insert: the unique (user, book) index rejects a second vote
+        added, vote_count = book_votes.cast(request.user, book.id)
+        if not added:
             return Response({'error': 'You have already voted for this book'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create vote
-        BookVote.objects.create(user=request.user, book=book)
-        
-        # Update vote count
-        book.vote_count = book.votes.count()
-        book.save()
-        
         return Response({
             'message': 'Vote added successfully',
-            'vote_count': book.vote_count,
+            'vote_count': vote_count,
             'user_voted': True
         })
 
@@ -403,20 +429,13 @@ class BookViewSet(viewsets.ModelViewSet):
         """Remove vote for a book"""
         book = self.get_object()
         
-        # Find and delete user's vote
-        vote = BookVote.objects.filter(user=request.user, book=book).first()
-        if not vote:
+        removed, vote_count = book_votes.retract(request.user, book.id)
+        if not removed:
             return Response({'error': 'You have not voted for this book'}, status=status.HTTP_400_BAD_REQUEST)
         
-        vote.delete()
-        
-        # Update vote count
-        book.vote_count = book.votes.count()
-        book.save()
-        
         return Response({
             'message': 'Vote removed successfully',
-            'vote_count': book.vote_count,
+            'vote_count': vote_count,
             'user_voted': False
         })
 
@@ -493,22 +512,9 @@ class BookViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
     def genres(self, request):
-        """Get list of all available genres"""
-        # For now, return a static list of genres
-        # In real implementation, this would be extracted from books
-        genres = [
-            "Художественная литература",
-            "Фантастика",
-            "Детектив",
-            "Роман",
-            "Классика",
-            "Приключения",
-            "Драма",
-            "Комедия",
-            "Триллер",
-            "Фэнтези"
-        ]
-        return Response(genres)
+        """Get list of all genres that have books"""
+        genres = Genre.objects.filter(books__isnull=False).distinct().values_list('name', flat=True)
+        return Response(list(genres))
 
     @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
     def flibusta_categories(self, request):
@@ -543,16 +549,7 @@ class BookViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
     def age_categories(self, request):
         """Get list of all available age categories"""
-        # For now, return a static list of age categories
-        # In real implementation, this would be extracted from books
-        age_categories = [
-            "0+",
-            "6+",
-            "12+",
-            "16+",
-            "18+"
-        ]
-        return Response(age_categories)
+        return Response(Book.AgeCategory.values)
 
     @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
     def import_category_books(self, request):
@@ -613,9 +610,9 @@ class BookViewSet(viewsets.ModelViewSet):
                         )
                         
                         # Download full book content
-                        content = import_book_from_external_source(book_data, 'flibusta', 'fb2', use_tor=True)
+                        rendered = import_book_from_external_source(book_data, 'flibusta', 'fb2', use_tor=True)
                         
-                        if content:
+                        if rendered:
                             # Получаем аннотацию книги
                             description = book_data.get('description', '')
                             book_id = book_data.get('source_id') or book_data.get('id')
@@ -627,12 +624,12 @@ class BookViewSet(viewsets.ModelViewSet):
                                 title=book_data.get('title', 'Без названия'),
                                 author=author,
                                 description=description or '',
-                                content=content,
                                 cover_url=book_data.get('cover_url', ''),
                                 genre=book_data.get('genre', 'Общее'),
                                 source_id=book_id or '',
                                 source_type='flibusta'
                             )
+                            book.save_content(rendered.text, word_offsets=rendered.word_offsets, toc=rendered.toc)
                             
                             imported_count += 1
                         
@@ -673,12 +670,61 @@ class BookViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
     def voting_candidates(self, request):
-        """Get books that are candidates for voting"""
-        # Placeholder for actual logic to determine voting candidates
-        # For now, return a few books
-        candidates = Book.objects.all()[:5] # Example: first 5 books
-        serializer = self.get_serializer(candidates, many=True)
-        return Response(serializer.data)
+        """Get books that are candidates for voting: this week's leaders first"""
+        limit = int(request.query_params.get('limit', 5))
+        tallies = dict(book_votes.top_of_week(limit=limit))
+        
+        # Лидеры недели по итогам из WeeklyVoteTally, остальные места - по рейтингу
+        books = Book.objects.select_related('author').exclude(is_book_of_week=True)
+        candidates = sorted(books.filter(id__in=tallies), key=lambda book: (-tallies[book.id], book.id))
+        if len(candidates) < limit:
+            candidates += list(books.exclude(id__in=tallies).order_by('-rating_avg', 'id')[:limit - len(candidates)])
+        
+        data = BookFrontendSerializer(candidates, many=True).data
+        for item in data:
+            item['weekly_votes'] = tallies.get(item['id'], 0)
+        return Response(data)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny],
+            renderer_classes=[EventStreamRenderer])
+    def vote_stream(self, request):
+        """Server-Sent Events with the live weekly vote ranking: a snapshot, then deltas"""
+        from . import vote_stream
+        
+        response = StreamingHttpResponse(vote_stream.event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx не должен буферизовать поток
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def weekly_leaderboard(self, request):
+        """Live vote ranking of a week: ?week=YYYY-MM-DD (any day of the week, default - current), ?limit=N"""
+        from datetime import date
+        
+        limit = min(int(request.query_params.get('limit', 10)), 100)
+        try:
+            day = date.fromisoformat(request.query_params['week']) if 'week' in request.query_params else None
+        except ValueError:
+            return Response({'error': 'week must be a date (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        week = book_votes.week_start(day)
+        
+        tallies = book_votes.top_of_week(week, limit)
+        books = Book.objects.select_related('author').in_bulk([book_id for book_id, _ in tallies])
+        return Response({
+            'week_start': week,
+            'results': [
+                {
+                    'rank': position,
+                    'book_id': book_id,
+                    'title': books[book_id].title,
+                    'author': books[book_id].author.name,
+                    'votes': votes,
+                }
+                for position, (book_id, votes) in enumerate(tallies, start=1)
+                if book_id in books
+            ]
+        })
 
 
 # Отдельные функции представлений для внешних источников
@@ -715,9 +761,9 @@ def import_external_book_view(request):
             return Response({'error': 'Book data is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Получаем содержимое книги
-        content = import_book_from_external_source(book_data, source, download_format, use_tor=True)
+        rendered = import_book_from_external_source(book_data, source, download_format, use_tor=True)
         
-        if not content:
+        if not rendered:
             return Response({'error': 'Failed to download book content'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         # Получаем аннотацию книги
@@ -752,13 +798,14 @@ def import_external_book_view(request):
         book = Book.objects.create(
             title=book_data.get('title', ''),
             author=author,
-            content=content,
             description=description or book_data.get('description', ''),
             genre=book_data.get('genre', ''),
             cover_url=book_data.get('cover_url', ''),
             source_id=book_data.get('id', ''),
             source_type=source
         )
+        # Оглавление из парсера сохраняется вместе с текстом
+        book.save_content(rendered.text, word_offsets=rendered.word_offsets, toc=rendered.toc)
         
         from .serializers import BookSerializer
         serializer = BookSerializer(book)
@@ -798,16 +845,18 @@ class UserBookViewSet(viewsets.ModelViewSet):
         
         book = get_object_or_404(Book, id=book_id)
         
-        # Check if book already in user's library
-        user_book, created = UserBook.objects.get_or_create(
-            user=request.user,
-            book=book,
-            defaults={'status': status}
-        )
-        
-        if not created:
-            user_book.status = status
-            user_book.save()
+        # Check if book already in user's library.
+        # Counters in the signal handlers are updated in the same transaction.
+        with transaction.atomic():
+            user_book, created = UserBook.objects.select_for_update().get_or_create(
+                user=request.user,
+                book=book,
+                defaults={'status': status}
+            )
+            
+            if not created:
+                user_book.status = status
+                user_book.save()
         
         serializer = self.get_serializer(user_book)
         return Response(serializer.data)
@@ -820,14 +869,15 @@ class UserBookViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
         """Update status of a book in user's library"""
-        user_book = self.get_object()
         new_status = request.data.get('status')
         
         if not new_status:
             return Response({'error': 'Status is required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        user_book.status = new_status
-        user_book.save()
+        with transaction.atomic():
+            user_book = get_object_or_404(UserBook.objects.select_for_update(), pk=pk, user=request.user)
+            user_book.status = new_status
+            user_book.save()
         
         serializer = self.get_serializer(user_book)
         return Response(serializer.data)
@@ -841,8 +891,9 @@ class UserBookViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Book ID is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            user_book = UserBook.objects.get(user=request.user, book_id=book_id)
-            user_book.delete()
+            with transaction.atomic():
+                user_book = UserBook.objects.select_for_update().get(user=request.user, book_id=book_id)
+                user_book.delete()
             return Response({'message': 'Book removed from list successfully'})
         except UserBook.DoesNotExist:
             return Response({'error': 'Book not found in user list'}, status=status.HTTP_404_NOT_FOUND)
@@ -903,51 +954,58 @@ class ReadingProgressViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         # Ensure user_book belongs to the current user
         user_book_id = self.request.data.get('user_book')
-        user_book = get_object_or_404(UserBook, id=user_book_id, user=self.request.user)
-        
-        # If book status is not 'reading', update it
-        if user_book.status != UserBook.Status.READING:
-            user_book.status = UserBook.Status.READING
-            user_book.save()
         
-        serializer.save()
+        with transaction.atomic():
+            user_book = get_object_or_404(UserBook.objects.select_for_update(), id=user_book_id, user=self.request.user)
+            
+            # If book status is not 'reading', update it
+            if user_book.status != UserBook.Status.READING:
+                user_book.status = UserBook.Status.READING
+                user_book.save()
+            
+            old_page = CurrentProgress.objects.filter(user_book=user_book).values_list('current_page', flat=True).first()
+            progress = serializer.save(user_book=user_book)
+            book_progress.update_current(user_book, progress.position, progress.current_page, progress.total_pages)
+            book_progress.mark_saved(user_book, old_page, progress.current_page)
     
     @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
     def save_page_progress(self, request):
         """Save reading progress for a specific page"""
-        from .utils import calculate_reading_position
-        
         book_id = request.data.get('book_id')
-        current_page = request.data.get('current_page', 1)
-        total_pages = request.data.get('total_pages', 1)
-        words_per_page = request.data.get('words_per_page', 300)
+        current_page = int(request.data.get('current_page', 1))
+        total_pages = request.data.get('total_pages')
+        words_per_page = get_words_per_page(request.data)
         
         if not book_id:
             return Response({'error': 'book_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if words_per_page is None:
+            return Response({'error': WORDS_PER_PAGE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
             book = Book.objects.get(id=book_id)
-            user_book, created = UserBook.objects.get_or_create(
-                user=request.user,
-                book=book,
-                defaults={'status': UserBook.Status.READING}
-            )
             
-            # Calculate position in text based on page
-            position = calculate_reading_position(book.content, current_page, words_per_page)
+            # Without total_pages from the reader, use the page count stored in the book
+            total_pages = int(total_pages) if total_pages else book.page_count(words_per_page)
             
-            # Always create new reading progress entry
-            progress = ReadingProgress.objects.create(
-                user_book=user_book,
-                position=position,
-                current_page=current_page,
-                total_pages=total_pages
-            )
+            # Calculate position in text based on page (word offset index lookup)
+            content_store = BookContent.for_book(book.id)
+            position = content_store.position_for_page(current_page, words_per_page) if content_store else 0
             
-            # Update user_book status if needed
-            if user_book.status != UserBook.Status.READING:
-                user_book.status = UserBook.Status.READING
-                user_book.save()
+            # Progress, status and the counters updated by their signals are written together
+            with transaction.atomic():
+                user_book, created = UserBook.objects.select_for_update().get_or_create(
+                    user=request.user,
+                    book=book,
+                    defaults={'status': UserBook.Status.READING}
+                )
+                
+                # Upsert the current position and append the event to the history
+                progress = book_progress.record(user_book, position, current_page, total_pages)
+                
+                # Update user_book status if needed
+                if user_book.status != UserBook.Status.READING:
+                    user_book.status = UserBook.Status.READING
+                    user_book.save()
             
             return Response({
                 'success': True,
@@ -961,16 +1019,53 @@ class ReadingProgressViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def save_progress_batch(self, request):
+        """Save a batch of page turns (offline or fast readers flush in one request).
+        
+        Body: {"events": [{book_id, current_page, total_pages, words_per_page, client_timestamp}, ...]}.
+        Only the latest event per book is applied, and only when it is newer than
+        the stored position; ``saved`` holds the resulting position of every book.
+        """
+        events = request.data.get('events') if isinstance(request.data, dict) else request.data
+        if not isinstance(events, list) or not events:
+            return Response({'error': 'events must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(events) > PROGRESS_BATCH_MAX_EVENTS:
+            return Response(
+                {'error': f'At most {PROGRESS_BATCH_MAX_EVENTS} events per batch'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = ProgressEventSerializer(data=events, many=True)
+        serializer.is_valid(raise_exception=True)
+        
+        current, missing = book_progress.record_batch(request.user, serializer.validated_data)
+        book_ids = dict(UserBook.objects.filter(id__in=[c.user_book_id for c in current]).values_list('id', 'book_id'))
+        
+        return Response({
+            'success': True,
+            'saved': [
+                {
+                    'book_id': book_ids[progress.user_book_id],
+                    'current_page': progress.current_page,
+                    'total_pages': progress.total_pages,
+                    'progress_percentage': progress.progress_percentage
+                }
+                for progress in current
+            ],
+            'missing_books': missing
+        })
+    
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def get_page_progress(self, request):
         """Get reading progress for a book"""
-        from .utils import get_page_from_position
-        
         book_id = request.query_params.get('book_id')
-        words_per_page = int(request.query_params.get('words_per_page', 300))
+        words_per_page = get_words_per_page(request.query_params)
         
         if not book_id:
             return Response({'error': 'book_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if words_per_page is None:
+            return Response({'error': WORDS_PER_PAGE_ERROR}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
             book = Book.objects.get(id=book_id)
@@ -984,7 +1079,7 @@ class ReadingProgressViewSet(viewsets.ModelViewSet):
                     'progress_percentage': 0
                 })
             
-            progress = ReadingProgress.objects.filter(user_book=user_book).order_by('-created_at').first()
+            progress = CurrentProgress.objects.filter(user_book=user_book).first()
             
             if not progress:
                 # No progress yet, return first page
@@ -995,12 +1090,10 @@ class ReadingProgressViewSet(viewsets.ModelViewSet):
                 })
             
             # If we have old progress without page info, calculate from position
-            if progress.current_page == 1 and progress.total_pages == 1 and progress.position > 0:
-                progress.current_page = get_page_from_position(book.content, progress.position, words_per_page)
-                # Calculate total pages
-                from .utils import paginate_book_content
-                pagination_info = paginate_book_content(book.content, 1, words_per_page)
-                progress.total_pages = pagination_info['total_pages']
+            if progress.current_page == 1 and progress.total_pages == 1 and progress.position > 0 and book.word_count:
+                content_store = BookContent.for_book(book.id)
+                progress.current_page = content_store.page_for_position(progress.position, words_per_page)
+                progress.total_pages = book.page_count(words_per_page)
                 progress.save()
             
             return Response({
@@ -1016,7 +1109,7 @@ class ReadingProgressViewSet(viewsets.ModelViewSet):
 
 class BookListView(generics.ListAPIView):
     """View для списка книг (используется админкой)"""
-    queryset = Book.objects.all().select_related('author')
+    queryset = Book.objects.all().select_related('author').prefetch_related('genres')
     serializer_class = BookFrontendSerializer
     permission_classes = [permissions.AllowAny]
     
@@ -1033,16 +1126,18 @@ class BookListView(generics.ListAPIView):
         
         # Применяем фильтры
         if search:
-            queryset = queryset.filter(
-                models.Q(title__icontains=search) | 
-                models.Q(author__name__icontains=search)
-            )
+            queryset = book_search.filter_queryset(queryset, search).order_by('search_rank', '-id')
         
         if genre:
-            queryset = queryset.filter(genre__icontains=genre)
+            queryset = queryset.filter(genres__name=genre)
             
         if age_category:
-            queryset = queryset.filter(age_category__icontains=age_category)
+            queryset = queryset.filter(age_category=age_category)
+        
+        if is_cursor_pagination(request):
+            return cursor_paginated_response(
+                self.get_serializer_class(), queryset, request.GET.get('sortBy', ''), request, limit
+            )
         
         # Пагинация
         paginator = Paginator(queryset, limit)
@@ -0,0 +1,217 @@
+"""Живая таблица голосования недели через Server-Sent Events.
+
+Вместо того чтобы каждая открытая страница голосования опрашивала
+top_voted и vote_info, клиент держит один поток SSE. Все потоки читают
+один общий снимок таблицы недели:
+
+- голос и его снятие (books/votes.py) после коммита меняют метку
+  изменений в кеше Django;
+- снимок (топ недели по WeeklyVoteTally) хранится в кеше вместе с меткой,
+  по которой он построен; если метка устарела, снимок
+  перестраивает один воркер, взявший блокировку, остальные отдают
+  предыдущий и догоняют на следующем тике;
+- в каждом процессе кеш опрашивает один фоновый поток (_Poller), раз в
+  VOTE_STREAM_POLL_INTERVAL; потоки SSE ждут на его threading.Condition
+  и просыпаются только при изменении снимка или для heartbeat.
+
+Поэтому стоимость - одно построение снимка на изменение и одно чтение
+кеша за интервал на процесс, а не опрос на каждое соединение. Поток
+отправляет клиенту только изменившиеся строки таблицы.
+
+Открытое соединение занимает обработчик запроса все время жизни, поэтому
+синхронные воркеры gunicorn (по умолчанию sync) для этого эндпоинта не
+подходят: нужен воркер на гринлетах, `gunicorn -k gevent reader.wsgi`
+(monkey patching превращает и поток опроса, и Condition в гринлеты).
+Поток закрывается через VOTE_STREAM_MAX_DURATION секунд; EventSource в
+браузере переподключается сам.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+
+from . import votes
+from .models import Book
+
+CHANGES_KEY = 'books:vote_stream:changes'
+SNAPSHOT_KEY = 'books:vote_stream:snapshot'
+LOCK_KEY = 'books:vote_stream:lock'
+
+POLL_INTERVAL = getattr(settings, 'VOTE_STREAM_POLL_INTERVAL', 1)
+MAX_DURATION = getattr(settings, 'VOTE_STREAM_MAX_DURATION', 5 * 60)
+HEARTBEAT_INTERVAL = 15
+TOP_SIZE = getattr(settings, 'VOTE_STREAM_TOP_SIZE', 10)
+
+logger = logging.getLogger(__name__)
+
+_local_snapshot = None
+_local_lock = threading.Lock()
+
+
+def mark_changed():
+    """Итоги голосования изменились (вызывается после коммита голоса).
+
+    В кеш пишется новая случайная метка, а не увеличивается счетчик: incr
+    кеша в БД - это чтение и запись, и параллельные голоса теряли бы
+    увеличения. Потокам важно лишь, что метка стала другой, а снимок они
+    строят по БД уже после коммита последнего голоса.
+    """
+    cache.set(CHANGES_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def build_snapshot(changes) -> dict:
+    week = votes.week_start()
+    tallies = votes.top_of_week(week, TOP_SIZE)
+    books = Book.objects.select_related('author').in_bulk([book_id for book_id, _ in tallies])
+    entries = [
+        {
+            'rank': position,
+            'book_id': book_id,
+            'title': books[book_id].title,
+            'author': books[book_id].author.name,
+            'votes': count,
+        }
+        for position, (book_id, count) in enumerate(tallies, start=1)
+        if book_id in books
+    ]
+    return {'changes': changes, 'week_start': week.isoformat(), 'entries': entries}
+
+
+def get_snapshot() -> dict:
+    """Общий снимок таблицы недели, перестраивается не чаще одного раза на изменение"""
+    global _local_snapshot
+
+    changes = cache.get(CHANGES_KEY, 0)
+    week = votes.week_start().isoformat()
+
+    def is_fresh(snapshot):
+        # С началом новой недели снимок устаревает и без новых голосов
+        return snapshot is not None and snapshot['changes'] == changes and snapshot['week_start'] == week
+
+    if is_fresh(_local_snapshot):
+        return _local_snapshot
+
+    with _local_lock:
+        if is_fresh(_local_snapshot):
+            return _local_snapshot
+
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if not is_fresh(snapshot):
+            if cache.add(LOCK_KEY, 1, timeout=30):
+                try:
+                    snapshot = build_snapshot(changes)
+                    cache.set(SNAPSHOT_KEY, snapshot, timeout=None)
+                finally:
+                    cache.delete(LOCK_KEY)
+            elif snapshot is None:
+                # Первый снимок строит другой воркер; без него отдавать нечего
+                snapshot = build_snapshot(changes)
+
+        _local_snapshot = snapshot
+        return snapshot
+
+
+def diff(old_entries, new_entries) -> dict:
+    """Строки, которые изменились или появились, и id книг, выбывших из таблицы"""
+    old = {entry['book_id']: entry for entry in old_entries}
+    new_ids = {entry['book_id'] for entry in new_entries}
+    return {
+        'changed': [entry for entry in new_entries if old.get(entry['book_id']) != entry],
+        'removed': [book_id for book_id in old if book_id not in new_ids],
+    }
+
+
+def _event(name, data) -> str:
+    return f'event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+class _Poller:
+    """Один опрос снимка на процесс, пока открыт хотя бы один поток SSE"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.snapshot = None
+        self.subscribers = 0
+        self.thread = None
+
+    def subscribe(self) -> dict:
+        snapshot = get_snapshot()
+        with self.condition:
+            self.subscribers += 1
+            if self.snapshot is None or self.thread is None:
+                self.snapshot = snapshot
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='vote-stream-poller', daemon=True)
+                self.thread.start()
+            return self.snapshot
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def wait(self, seen, timeout) -> dict:
+        """Снимок новее seen; по истечении timeout возвращает seen"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.snapshot is not seen, timeout=timeout)
+            return self.snapshot
+
+    def _run(self):
+        try:
+            while True:
+                time.sleep(POLL_INTERVAL)
+                with self.condition:
+                    if not self.subscribers:
+                        # Поток остановлен под тем же замком, что и subscribe,
+                        # так что новый подписчик запустит следующий
+                        self.thread = None
+                        return
+                close_old_connections()
+                try:
+                    snapshot = get_snapshot()
+                except Exception:
+                    logger.exception('Vote stream snapshot failed')
+                    continue
+                with self.condition:
+                    current = self.snapshot
+                    if (snapshot['changes'], snapshot['week_start']) != (current['changes'], current['week_start']):
+                        self.snapshot = snapshot
+                        self.condition.notify_all()
+        finally:
+            connection.close()
+
+
+_poller = _Poller()
+
+
+def event_stream(max_duration=MAX_DURATION):
+    """Генератор SSE: полный снимок при подключении, затем только изменения"""
+    snapshot = _poller.subscribe()
+    try:
+        yield f'retry: {int(POLL_INTERVAL * 1000) + 1000}\n'
+        yield _event('snapshot', snapshot)
+
+        deadline = time.monotonic() + max_duration
+        while time.monotonic() < deadline:
+            current = _poller.wait(snapshot, min(deadline - time.monotonic(), HEARTBEAT_INTERVAL))
+            if current is snapshot:
+                # Комментарий SSE не дает прокси закрыть простаивающее соединение
+                yield ': heartbeat\n\n'
+                continue
+
+            if current['week_start'] != snapshot['week_start']:
+                # Началась новая неделя - таблица начинается заново
+                yield _event('snapshot', current)
+            else:
+                delta = diff(snapshot['entries'], current['entries'])
+                if delta['changed'] or delta['removed']:
+                    yield _event('delta', dict(delta, changes=current['changes']))
+            snapshot = current
+    finally:
+        # Закрытие генератора при отключении клиента тоже попадает сюда
+        _poller.unsubscribe()
@@ -0,0 +1,108 @@
+"""Голоса за книгу недели.
+
+Голос ставится и снимается одним условным запросом: INSERT, который
+отклоняет уникальный индекс (user, book), если пользователь уже голосовал,
+или DELETE, который удаляет 0 или 1 строку. Счетчик Book.vote_count
+меняется атомарным ``F('vote_count') ± 1`` только если голос
+действительно добавлен или удален, поэтому параллельные голоса не теряются
+и не требуют пересчета COUNT по всем голосам книги.
+
+Вместе со счетчиком меняется недельный итог книги (WeeklyVoteTally) за
+ISO-неделю, в которую был отдан голос: по нему выбирается книга недели,
+строятся кандидаты и живая таблица недели (в том числе поток SSE,
+books/vote_stream.py).
+
+Если счетчик все же разошелся с таблицей голосов (удаление в админке,
+ручные правки БД), его исправляет ``manage.py reconcile_vote_counts``.
+"""
+
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Book, BookVote, WeeklyVoteTally
+
+
+def week_start(day=None):
+    """Понедельник ISO-недели, в которую попадает day (по умолчанию - сегодня)"""
+    day = day or timezone.localdate()
+    return day - timedelta(days=day.weekday())
+
+
+def _add_to_tally(book_id, week, delta):
+    updated = WeeklyVoteTally.objects.filter(book_id=book_id, week_start=week).update(votes=F('votes') + delta)
+    if updated or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            WeeklyVoteTally.objects.create(book_id=book_id, week_start=week, votes=delta)
+    except IntegrityError:
+        # Итог недели успел создать параллельный голос
+        WeeklyVoteTally.objects.filter(book_id=book_id, week_start=week).update(votes=F('votes') + delta)
+
+
+def _notify_stream():
+    from . import vote_stream
+    vote_stream.mark_changed()
+
+
+def _vote_count(book_id) -> int:
+    return Book.objects.filter(pk=book_id).values_list('vote_count', flat=True).first() or 0
+
+
+def cast(user, book_id):
+    """Голос пользователя за книгу. Возвращает (добавлен ли голос, новое число голосов)."""
+    try:
+        with transaction.atomic():
+            vote = BookVote.objects.create(user=user, book_id=book_id)
+            Book.objects.filter(pk=book_id).update(vote_count=F('vote_count') + 1)
+            _add_to_tally(book_id, week_start(timezone.localdate(vote.created_at)), 1)
+            transaction.on_commit(_notify_stream)
+    except IntegrityError:
+        # Уже голосовал: строку отклонил уникальный индекс
+        return False, _vote_count(book_id)
+    return True, _vote_count(book_id)
+
+
+def retract(user, book_id):
+    """Снимает голос. Возвращает (был ли голос, новое число голосов)."""
+    vote = BookVote.objects.filter(user=user, book_id=book_id).values('pk', 'created_at').first()
+    if vote is None:
+        return False, _vote_count(book_id)
+
+    with transaction.atomic():
+        # Условное удаление: из параллельных снятий голоса строку удалит только одно
+        deleted, _ = BookVote.objects.filter(pk=vote['pk']).delete()
+        if deleted:
+            Book.objects.filter(pk=book_id).update(vote_count=F('vote_count') - 1)
+            _add_to_tally(book_id, week_start(timezone.localdate(vote['created_at'])), -1)
+            transaction.on_commit(_notify_stream)
+    return bool(deleted), _vote_count(book_id)
+
+
+def top_of_week(week=None, limit=10):
+    """Итоги недели по убыванию голосов: [(book_id, votes), ...]"""
+    return list(
+        WeeklyVoteTally.objects.filter(week_start=week or week_start(), votes__gt=0)
+        .order_by('-votes', 'book_id').values_list('book_id', 'votes')[:limit]
+    )
+
+
+def reconcile() -> int:
+    """Исправляет vote_count, разошедшиеся с таблицей голосов. Возвращает число исправленных книг."""
+    actual = Coalesce(
+        Subquery(
+            BookVote.objects.filter(book=OuterRef('pk')).order_by().values('book')
+            .annotate(total=Count('id')).values('total')
+        ),
+        Value(0),
+    )
+    drifted = Book.objects.annotate(actual_votes=actual).exclude(vote_count=F('actual_votes'))
+    fixed = 0
+    for book_id in list(drifted.values_list('pk', flat=True)):
+        # Пересчет каждой книги отдельным UPDATE, чтобы не блокировать все строки сразу
+        fixed += Book.objects.filter(pk=book_id).update(vote_count=actual)
+    return fixed
@@ -31,8 +31,8 @@ def check_books():
     
     print()
     
-    # Проверим книги с содержимым
-    books_with_content = Book.objects.exclude(content='').count()
+    # Проверим книги с содержимым (в файловом хранилище поле text пустое, поэтому смотрим статус)
+    books_with_content = Book.objects.filter(content_status=Book.ContentStatus.READY).count()
     print(f"📄 Книг с содержимым: {books_with_content}")
     
     # Проверим книги с обложками
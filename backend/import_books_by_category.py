@@ -68,9 +68,9 @@ def import_books_by_category(category_url: str, count: int = 5) -> List[Dict[str
                     
                     # Загружаем полное содержимое книги
                     print(f"   📥 Загружаем полное содержимое...")
-                    content = import_book_from_external_source(book_data, 'flibusta', 'fb2', use_tor=True)
+                    rendered = import_book_from_external_source(book_data, 'flibusta', 'fb2', use_tor=True)
                     
-                    if not content:
+                    if not rendered:
                         print(f"   ❌ Не удалось загрузить содержимое")
                         errors.append(f"Не удалось загрузить содержимое для '{book_data.get('title', 'Unknown')}'")
                         continue
@@ -89,12 +89,12 @@ def import_books_by_category(category_url: str, count: int = 5) -> List[Dict[str
                         title=book_data.get('title', 'Без названия'),
                         author=author,
                         description=description or '',
-                        content=content,
                         cover_url=book_data.get('cover_url', ''),
                         genre=book_data.get('genre', 'Общее'),
                         source_id=book_id or '',
                         source_type='flibusta'
                     )
+                    book.save_content(rendered.text, word_offsets=rendered.word_offsets, toc=rendered.toc)
                     
                     imported_books.append({
                         'id': book.id,
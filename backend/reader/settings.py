@@ -167,6 +167,41 @@ CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Хранилище текстов книг: 'file' - сжатые файлы с индексом блоков, 'db' - таблица BookContent
+BOOK_CONTENT_STORAGE = os.getenv('BOOK_CONTENT_STORAGE', 'file')
+BOOK_CONTENT_ROOT = Path(os.getenv('BOOK_CONTENT_ROOT', BASE_DIR / 'book_texts'))
+
+# Общий для всех воркеров кеш: страницы читалки и их счетчики, total_count
+# каталога, снимок живой таблицы голосования. Кеш в памяти процесса (LocMem)
+# не подходит: при нескольких воркерах каждый видел бы только свои записи.
+# Redis, если задан REDIS_URL, иначе таблица в БД (ее создает migrate, миграция books 0030)
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'reader_cache',
+        }
+    }
+
+# Кеш отрендеренных страниц читалки: размер LRU в процессе и время жизни в общем кеше
+READER_PAGE_CACHE_SIZE = int(os.getenv('READER_PAGE_CACHE_SIZE', 512))
+READER_PAGE_CACHE_TIMEOUT = int(os.getenv('READER_PAGE_CACHE_TIMEOUT', 60 * 60))
+
+# Фоновая загрузка текстов книг: в пуле потоков веб-процесса или
+# отдельным воркером (manage.py run_content_jobs), если CONTENT_FETCH_IN_PROCESS=False
+CONTENT_FETCH_IN_PROCESS = os.getenv('CONTENT_FETCH_IN_PROCESS', 'True') == 'True'
+CONTENT_FETCH_WORKERS = int(os.getenv('CONTENT_FETCH_WORKERS', 2))
+# Задача дольше этого (секунды) в очереди или в работе считается зависшей и ставится заново
+CONTENT_FETCH_STALE_AFTER = int(os.getenv('CONTENT_FETCH_STALE_AFTER', 15 * 60))
+
 # Frontend URL
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:5173')
 
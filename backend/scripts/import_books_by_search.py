@@ -15,7 +15,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reader.settings')
 django.setup()
 
 from books.models import Book, Author
-from books.external_sources import FlibustaTorClient
+from books.external_sources import FlibustaTorClient, ExternalBookSources
 from books.cover_sources import get_book_cover_url
 
 def import_books_by_search(search_queries: List[str], limit_per_query: int = 2) -> List[Dict[str, Any]]:
@@ -24,6 +24,7 @@ def import_books_by_search(search_queries: List[str], limit_per_query: int = 2)
     
     try:
         client = FlibustaTorClient(use_tor=True)
+        sources = ExternalBookSources(use_tor_for_flibusta=True)
         all_books = []
         
         # Поиск по каждому запросу
@@ -62,9 +63,9 @@ def import_books_by_search(search_queries: List[str], limit_per_query: int = 2)
                     
                     # Получаем полные данные книги с содержимым
                     print(f"   📥 Загружаем полное содержимое...")
-                    content = client.download_book(book_data, format_preference='fb2')
+                    rendered = sources.get_book_content(book_data, 'fb2')
                     
-                    if not content:
+                    if not rendered:
                         print(f"   ❌ Не удалось загрузить содержимое")
                         continue
                     
@@ -90,10 +91,10 @@ def import_books_by_search(search_queries: List[str], limit_per_query: int = 2)
                         title=book_data.get('title', 'Без названия'),
                         author=author,
                         description=book_data.get('description', ''),
-                        content=content or '',
                         cover_url=cover_url,
                         genre='Художественная литература'
                     )
+                    book.save_content(rendered.text, word_offsets=rendered.word_offsets, toc=rendered.toc)
                     
                     imported_books.append({
                         'id': book.id,
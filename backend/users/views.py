@@ -35,7 +35,7 @@ class UserProfileView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_object(self):
-        from books.models import ReadingProgress
+        from books.reading_stats import get_stats
         user = self.request.user
         
         # Calculate book statistics
@@ -44,7 +44,7 @@ class UserProfileView(generics.RetrieveUpdateDestroyAPIView):
             'planning_count': UserBook.objects.filter(user=user, status=UserBook.Status.PLANNED).count(),
             'reading_count': UserBook.objects.filter(user=user, status=UserBook.Status.READING).count(),
             'dropped_count': UserBook.objects.filter(user=user, status=UserBook.Status.DROPPED).count(),
-            'progress_marks_count': ReadingProgress.objects.filter(user_book__user=user).count(),
+            'progress_marks_count': get_stats(user)['total_marks'],
         }
         stats['total_count'] = stats['read_count'] + stats['planning_count'] + stats['reading_count'] + stats['dropped_count']
         